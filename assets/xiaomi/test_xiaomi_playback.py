@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""Tests for the pure helpers of xiaomi_playback.py: segment-name parsing, the Segs snapshot
+(patch / overlap / per-day counts), Range / If-Range / 416 planning, Accept-Encoding choice and
+the faststart moov rewrite. No camera root, server or ffmpeg needed:
+
+    python3 -m pytest -q assets/xiaomi/test_xiaomi_playback.py
+"""
+import datetime
+import os
+import random
+import struct
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import xiaomi_playback as xp  # noqa: E402
+
+
+def sec(*args):
+    return xp._to_sec(datetime.datetime(*args))
+
+
+def name(s, e, ext=".mp4"):
+    """A camera file name for wall-clock seconds s..e."""
+    f = lambda t: (xp._EPOCH + datetime.timedelta(seconds=t)).strftime("%Y%m%d%H%M%S")
+    return "00_%s_%s%s" % (f(s), f(e), ext)
+
+
+# --------------------------------------------------------------------------- #
+# parse_names
+# --------------------------------------------------------------------------- #
+def test_parse_names_matches_parse_name():
+    names = [
+        "00_20260603160305_20260603160947.mp4",
+        "00_20260603235958_20260604000105.mp4",     # across midnight
+        "01_20240229120000_20240229120100.MP4",     # upper-case extension, leap day
+        "00_20260603160305_20260603160305.mp4",     # in-progress chunk: end == start
+        "00_20260631160305_20260631160947.mp4",     # no 31 June
+        "00_20260603246305_20260603246947.mp4",     # hour 24
+        "00_20250229120000_20250229120100.mp4",     # not a leap year
+        "00_20260603160305_20260603160947.mp4.tmp",
+        "00_2026060316030_20260603160947.mp4",
+        "thumbs.db",
+    ]
+    want = {}
+    for n in names:
+        pr = xp._parse_name(n)
+        if pr:
+            want[n] = (xp._to_sec(pr[0]), xp._to_sec(pr[1]))
+    assert xp.parse_names(names) == want
+    assert len(want) == 4
+    assert want["00_20260603160305_20260603160947.mp4"] == (sec(2026, 6, 3, 16, 3, 5), sec(2026, 6, 3, 16, 9, 47))
+
+
+def test_parse_names_repeat_uses_cached_hours():
+    names = [name(t, t + 60) for t in range(sec(2025, 1, 1), sec(2025, 1, 2), 60)]
+    first = xp.parse_names(names)
+    assert first == xp.parse_names(names)
+    assert len(first) == 1440
+    assert first[names[0]] == (sec(2025, 1, 1), sec(2025, 1, 1, 0, 1))
+
+
+# --------------------------------------------------------------------------- #
+# Segs
+# --------------------------------------------------------------------------- #
+def brute_days(rows):
+    out = {}
+    for s, e in rows:
+        for d in range(s // 86400, max(s, e) // 86400 + 1):
+            out[d] = out.get(d, 0) + 1
+    return out
+
+
+def check(segs, files):
+    """segs holds exactly `files` ({name: (start, end)}), sorted, with matching query structures."""
+    rows = sorted((s, e, f) for f, (s, e) in files.items())
+    assert list(segs.start) == [r[0] for r in rows]
+    assert list(segs.end) == [r[1] for r in rows]
+    assert segs.names == [r[2] for r in rows]
+    assert segs.daycount == brute_days((s, e) for s, e, _f in rows)
+    assert [i for i in range(len(rows)) if segs.is_live(i)] == [i for i, r in enumerate(rows) if r[1] <= r[0]]
+    for f in files:
+        assert segs.names[segs.find(f)] == f
+
+
+def test_segs_patched_keeps_original():
+    t = sec(2026, 6, 3, 12)
+    a = xp.Segs().patched({name(t, t + 60): (t, t + 60, 1000, 1.0)}, [])
+    b = a.patched({name(t + 60, t + 120): (t + 60, t + 120, 1000, 2.0)}, [name(t, t + 60)])
+    check(a, {name(t, t + 60): (t, t + 60)})
+    check(b, {name(t + 60, t + 120): (t + 60, t + 120)})
+    assert a.patched({}, []) is a
+    assert a.patched({}, ["00_nope.mp4"]) is a
+
+
+def test_segs_live_chunk_finishes():
+    t = sec(2026, 6, 3, 23, 59)
+    live = "00_%s_%s.mp4" % (("20260603235900",) * 2)
+    a = xp.Segs().patched({live: (t, t, 10, 1.0)}, [])
+    check(a, {live: (t, t)})
+    assert a.mtime == {live: 1.0}
+    grown = a.patched({live: (t, t, 20, 5.0)}, [])         # same extent, newer mtime only
+    assert grown.mtime == {live: 5.0} and grown.daycount is a.daycount
+    done = grown.patched({live: (t, t + 120, 30, 6.0)}, [])
+    check(done, {live: (t, t + 120)})                      # now touches the next day too
+    assert done.mtime == {}
+    assert sorted(d["date"] for d in done.days()) == ["2026-06-03", "2026-06-04"]
+
+
+def test_segs_random_patches():
+    rnd = random.Random(7)
+    base = sec(2026, 1, 1)
+    files, segs = {}, xp.Segs()
+    for _ in range(60):
+        added, removed = {}, []
+        for _ in range(rnd.randrange(1, 20)):
+            s = base + rnd.randrange(0, 5 * 86400)
+            e = s if rnd.random() < 0.1 else s + rnd.randrange(1, 4000)
+            added[name(s, e)] = (s, e, 1, 0.0)
+        for f in rnd.sample(sorted(files), min(len(files), rnd.randrange(0, 6))):
+            if f not in added:
+                removed.append(f)
+        segs = segs.patched(added, removed)
+        for f in removed:
+            del files[f]
+        files.update((f, v[:2]) for f, v in added.items())
+        check(segs, files)
+    assert segs.daycount == xp.Segs(segs.start, segs.end, segs.live, segs.names).daycount
+    rows = list(zip(segs.start, segs.end))
+    for _ in range(200):
+        t0 = base + rnd.randrange(-3600, 6 * 86400)
+        t1 = t0 + rnd.randrange(1, 86400)
+        assert segs.overlapping(t0, t1) == [i for i, (s, e) in enumerate(rows) if e > t0 and s < t1]
+
+
+# --------------------------------------------------------------------------- #
+# _view_plan
+# --------------------------------------------------------------------------- #
+DATA = bytes(range(256)) * 4
+ETAG = '"abc-123"'
+MTIME = 1780000000.0
+HTTP_MTIME = "Thu, 28 May 2026 20:26:40 GMT"
+# a faststart-like view: a slice, generated bytes, another slice, adding up to len(DATA)
+VIEW = [(0, 100), DATA[100:300], (300, len(DATA) - 300)]
+
+
+def plan(headers, etag=ETAG, view=VIEW):
+    hdrs = [("Content-Type", "video/mp4"), ("Accept-Ranges", "bytes"), ("ETag", etag or "")]
+    status, out, body = xp._view_plan(view, len(DATA), headers, hdrs, etag, MTIME)
+    body = b"".join(p if isinstance(p, bytes) else DATA[p[0]:p[0] + p[1]] for p in body)
+    return status, dict(out), body
+
+
+def test_view_plan_full():
+    status, hdrs, body = plan({})
+    assert (status, body) == (200, DATA)
+    assert hdrs["Content-Length"] == str(len(DATA))
+
+
+@pytest.mark.parametrize("spec, a, b", [
+    ("bytes=0-0", 0, 0),
+    ("bytes=90-309", 90, 309),                 # crosses both piece boundaries
+    ("bytes=1000-", 1000, 1023),
+    ("bytes=-24", 1000, 1023),
+    ("bytes=1000-99999", 1000, 1023),          # end clipped to the file
+])
+def test_view_plan_single_range(spec, a, b):
+    status, hdrs, body = plan({"Range": spec})
+    assert status == 206
+    assert hdrs["Content-Range"] == "bytes %d-%d/%d" % (a, b, len(DATA))
+    assert body == DATA[a:b + 1] and hdrs["Content-Length"] == str(len(body))
+
+
+def test_view_plan_multipart():
+    status, hdrs, body = plan({"Range": "bytes=0-9, 200-299"})
+    assert status == 206
+    assert hdrs["Content-Type"] == "multipart/byteranges; boundary=%s" % xp._BOUNDARY
+    assert hdrs["Content-Length"] == str(len(body))
+    parts = body.split(("\r\n--%s" % xp._BOUNDARY).encode())
+    assert parts[0] == b"" and parts[-1] == b"--\r\n"
+    want = [(0, 9), (200, 299)]
+    for part, (a, b) in zip(parts[1:-1], want):
+        head, _, payload = part.partition(b"\r\n\r\n")
+        assert b"Content-Type: video/mp4" in head
+        assert ("Content-Range: bytes %d-%d/%d" % (a, b, len(DATA))).encode() in head
+        assert payload == DATA[a:b + 1]
+
+
+def test_view_plan_unsatisfiable():
+    status, hdrs, body = plan({"Range": "bytes=1024-2000"})
+    assert (status, body) == (416, b"")
+    assert hdrs == {"Content-Range": "bytes */1024", "Content-Length": "0"}
+
+
+@pytest.mark.parametrize("spec", [
+    "bytes=9-1",                               # malformed
+    "items=0-9",                               # not bytes
+    "bytes=" + ",".join("%d-%d" % (i * 10, i * 10) for i in range(xp.MAX_RANGES + 1)),
+])
+def test_view_plan_ignored_range(spec):
+    status, _hdrs, body = plan({"Range": spec})
+    assert (status, body) == (200, DATA)
+
+
+@pytest.mark.parametrize("if_range, status", [
+    (ETAG, 206),
+    ('"stale"', 200),
+    ("W/" + ETAG, 200),                        # weak validators never match If-Range
+    (HTTP_MTIME, 206),
+    ("Thu, 28 May 2026 20:26:41 GMT", 200),
+])
+def test_view_plan_if_range(if_range, status):
+    got, _hdrs, body = plan({"Range": "bytes=10-19", "If-Range": if_range})
+    assert got == status
+    assert body == (DATA[10:20] if status == 206 else DATA)
+
+
+def test_view_plan_if_range_without_validator():
+    status, _hdrs, body = plan({"Range": "bytes=10-19", "If-Range": ETAG}, etag=None)
+    assert (status, body) == (200, DATA)
+
+
+def test_view_plan_not_modified():
+    assert plan({"If-None-Match": 'W/"x", ' + ETAG})[0] == 304
+    assert plan({"If-Modified-Since": HTTP_MTIME})[0] == 304
+    assert plan({"If-None-Match": '"x"', "If-Modified-Since": HTTP_MTIME})[0] == 200
+    assert plan({"If-None-Match": ETAG}, etag=None)[0] == 200
+
+
+# --------------------------------------------------------------------------- #
+# _pick_encoding
+# --------------------------------------------------------------------------- #
+SIZES = {"identity": 1000, "gzip": 300, "br": 250}
+
+
+@pytest.mark.parametrize("header, want", [
+    (None, "identity"),
+    ("", "identity"),
+    ("gzip", "gzip"),
+    ("gzip, deflate, br", "br"),
+    ("br;q=0, gzip", "gzip"),
+    ("BR ; q=0.5", "br"),
+    ("br;q=0.0, gzip;q=0", "identity"),
+    ("*", "br"),
+    ("*, br;q=0", "gzip"),
+    ("deflate", "identity"),
+])
+def test_pick_encoding(header, want):
+    assert xp._pick_encoding(header, SIZES) == want
+
+
+def test_pick_encoding_only_offered_codings():
+    assert xp._pick_encoding("br, gzip", {"identity": 10, "gzip": 5}) == "gzip"
+    assert xp._pick_encoding("gzip", {"identity": 10, "gzip": 50}) == "gzip"   # asked for, so taken
+
+
+# --------------------------------------------------------------------------- #
+# faststart: moov moved in front of mdat, chunk offsets shifted by its size
+# --------------------------------------------------------------------------- #
+def box(typ, *payload):
+    body = b"".join(payload)
+    return struct.pack(">I4s", 8 + len(body), typ) + body
+
+
+def offsets_box(typ, offs):
+    fmt = ">I%d%s" % (len(offs), "I" if typ == b"stco" else "Q")
+    return box(typ, b"\0\0\0\0", struct.pack(fmt, len(offs), *offs))
+
+
+def moov(tables):
+    """moov with one trak per chunk-offset table (plus an edts/udta the rewrite must leave alone)."""
+    traks = [box(b"trak", box(b"edts", b"\0" * 8),
+                 box(b"mdia", box(b"minf", box(b"stbl", offsets_box(typ, offs))))) for typ, offs in tables]
+    return box(b"moov", box(b"mvhd", b"\0" * 20), *traks, box(b"udta", b"\0" * 4))
+
+
+def read_offsets(buf):
+    """Every stco/co64 entry under buf, in file order."""
+    out = []
+    for typ, b, hdr, size in xp._box_iter(buf, 0, len(buf)):
+        if typ in xp._MP4_CONTAINERS:
+            out += read_offsets(buf[b + hdr:b + size])
+        elif typ in (b"stco", b"co64"):
+            n = struct.unpack_from(">I", buf, b + hdr + 4)[0]
+            out += struct.unpack_from(">%d%s" % (n, "I" if typ == b"stco" else "Q"), buf, b + hdr + 8)
+    return out
+
+
+def write_mp4(tmp_path, tables_for):
+    """ftyp + mdat + moov + free, with chunk offsets pointing at two payload chunks in mdat."""
+    ftyp = box(b"ftyp", b"isom\0\0\0\0isom")
+    payload = b"A" * 40 + b"B" * 24
+    mdat = box(b"mdat", payload)
+    chunks = [len(ftyp) + 8, len(ftyp) + 8 + 40]
+    data = ftyp + mdat + moov(tables_for(chunks)) + box(b"free", b"\0" * 5)
+    p = tmp_path / "00_20260603160305_20260603160947.mp4"
+    p.write_bytes(data)
+    return str(p), data, chunks
+
+
+def render(view, data):
+    return b"".join(v if isinstance(v, bytes) else data[v[0]:v[0] + v[1]] for v in view)
+
+
+@pytest.mark.parametrize("tables_for", [
+    lambda c: [(b"stco", c)],
+    lambda c: [(b"co64", c)],
+    lambda c: [(b"stco", c[:1]), (b"co64", c[1:])],
+])
+def test_faststart_view(tmp_path, tables_for):
+    path, data, chunks = write_mp4(tmp_path, tables_for)
+    view = xp._build_faststart(path, len(data))
+    out = render(view, data)
+    assert len(out) == len(data) == sum(xp._piece_len(v) for v in view)
+    types = [t for t, _b, _h, _s in xp._box_iter(out, 0, len(out))]
+    assert types == [b"ftyp", b"moov", b"mdat", b"free"]
+    moov_len = len(moov(tables_for(chunks)))
+    offs = read_offsets(out)
+    assert offs == [c + moov_len for c in chunks]
+    assert out[offs[0]:offs[0] + 40] == b"A" * 40     # the offsets still land on their chunks
+    assert out[offs[1]:offs[1] + 24] == b"B" * 24
+    assert len([v for v in view if isinstance(v, bytes)]) == 1   # only moov is held in memory
+
+
+def test_faststart_already_moov_first(tmp_path):
+    ftyp = box(b"ftyp", b"isom\0\0\0\0isom")
+    data = ftyp + moov([(b"stco", [0])]) + box(b"mdat", b"x" * 16)
+    p = tmp_path / "a.mp4"
+    p.write_bytes(data)
+    assert xp._build_faststart(str(p), len(data)) is None
+
+
+def test_shift_offsets_overflow():
+    buf = bytearray(moov([(b"co64", [10]), (b"stco", [0xFFFFFFF0])]))
+    assert xp._shift_offsets(buf, 0, len(buf), 0x10) is False
+    buf = bytearray(moov([(b"co64", [0xFFFFFFF0]), (b"stco", [0xFFFFFFEF])]))
+    assert xp._shift_offsets(buf, 0, len(buf), 0x10) is True
+    assert read_offsets(buf) == [0x100000000, 0xFFFFFFFF]
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+xiaomi_bench.py  --  Micro-benchmarks for xiaomi_playback.py (synthetic data, nothing touches the shares)
+
+Usage:
+    python3 xiaomi_bench.py [--dir DIR] [NAME ...] [N]
+
+    NAME  Which benchmark(s) to run; default = all of them:
+            store   memory + days_for/segs_for_day latency: per-segment dicts vs the columnar Segs store
+                    (its memory figure includes the SegIndex state kept beside each snapshot)
+            parse   parse a synthetic directory listing: _parse_name (regex + strptime) vs parse_names()
+            send    /video body throughput over loopback TCP: read/write copy loop vs sendfile
+            faststart  cost of the moov-first view of a synthetic moov-at-end segment (cold build, cache hit)
+    N     Number of synthetic 10-minute segments (default: 300000 for store, ~5 cameras x 7 months;
+          100000 for parse); for send, the test file size in MB (default 512); for faststart, the
+          number of video samples (default 12000, a 10-minute 20 fps chunk).
+    DIR   Where send writes its test file (default: the temp dir). Point it at a CIFS mount
+          (e.g. /mnt/c700_01) to measure SMB-backed segments; the file is removed afterwards.
+
+Run it next to xiaomi_playback.py (it imports it); on the router use python3-sda3.
+"""
+
+import os
+import sys
+import time
+import shutil
+import socket
+import struct
+import datetime
+import threading
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import xiaomi_playback as xp  # noqa: E402
+
+DAY0 = datetime.datetime(2025, 1, 1)
+
+
+def synth_names(n):
+    """n back-to-back 10-minute segment names (the last one in progress: start == end)."""
+    out = []
+    for i in range(n):
+        s = DAY0 + datetime.timedelta(seconds=600 * i)
+        e = s if i == n - 1 else s + datetime.timedelta(seconds=599)
+        out.append("00_%s_%s.mp4" % (s.strftime("%Y%m%d%H%M%S"), e.strftime("%Y%m%d%H%M%S")))
+    return out
+
+
+def timeit(fn, reps):
+    """Best of `reps` runs, in seconds (the least disturbed one)."""
+    best = None
+    for _ in range(reps):
+        t = time.perf_counter()
+        fn()
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best
+
+
+def measure(build):
+    tracemalloc.start()
+    obj = build()
+    cur = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, cur
+
+
+# -- the per-segment dict representation scan() used to build, and its two consumers -----------
+def dicts_build(parsed, now):
+    segs = []
+    at = datetime.datetime.fromtimestamp(now)     # the same clock served_build gets
+    for f, s, e in parsed:
+        live = e <= s
+        if live:
+            e = at
+        segs.append({"file": f, "start": s, "end": e, "live": live})
+    segs.sort(key=lambda x: x["start"])
+    return segs
+
+
+def dicts_days_for(segs):
+    days = {}
+    one = datetime.timedelta(days=1)
+    for sg in segs:
+        cur = sg["start"].date()
+        last = sg["end"].date()
+        while cur <= last:
+            k = cur.isoformat()
+            rec = days.setdefault(k, {"date": k, "count": 0})
+            rec["count"] += 1
+            cur += one
+    return [days[k] for k in sorted(days)]
+
+
+def dicts_segs_for_day(segs, date_str):
+    d = datetime.date.fromisoformat(date_str)
+    day0 = datetime.datetime.combine(d, datetime.time.min)
+    day1 = day0 + datetime.timedelta(days=1)
+    return [{"file": sg["file"], "start": sg["start"].isoformat(), "end": sg["end"].isoformat(),
+             "live": sg["live"]} for sg in segs if sg["start"] < day1 and sg["end"] > day0]
+
+
+def served_build(parsed, now):
+    """What the server really holds per camera: the Segs snapshot plus the SegIndex state beside it."""
+    added = {f: (xp._to_sec(s), xp._to_sec(e), 0, now) for f, s, e in parsed}
+    idx = xp.SegIndex(None)
+    idx.apply("/bench", added, [])
+    return xp.Segs().patched(added, []), idx
+
+
+# --------------------------------------------------------------------------- #
+def bench_store(n=None):
+    n = n or 300000
+    parsed = [(f,) + xp._parse_name(f) for f in synth_names(n)]   # parsing is not what's measured here
+    now = time.time()
+    mid = (DAY0 + datetime.timedelta(seconds=300 * n)).date().isoformat()
+    print("store: %d segments, day query = %s" % (n, mid))
+    print("  %-10s %12s %14s %16s" % ("", "memory", "days_for", "segs_for_day"))
+    dicts, mem = measure(lambda: dicts_build(parsed, now))
+    reps = 3
+    print("  %-10s %9.1f MB %11.2f ms %13.2f ms" % (
+        "dicts", mem / 1e6,
+        timeit(lambda: dicts_days_for(dicts), reps) * 1e3,
+        timeit(lambda: dicts_segs_for_day(dicts, mid), reps) * 1e3))
+    (segs, _idx), mem = measure(lambda: served_build(parsed, now))   # the memory the server really holds
+    print("  %-10s %9.1f MB %11.2f ms %13.2f ms" % (
+        "columnar", mem / 1e6,
+        timeit(lambda: xp.days_for(segs), reps) * 1e3,
+        timeit(lambda: xp.segs_for_day(segs, mid), reps) * 1e3))
+
+
+def bench_parse(n=None):
+    n = n or 100000
+    tmp = tempfile.mkdtemp(prefix="xiaomi_bench_")
+    try:
+        for f in synth_names(n):
+            open(os.path.join(tmp, f), "wb").close()
+        with os.scandir(tmp) as it:
+            names = [ent.name for ent in it]
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    def slow():       # the old per-name parser alone (datetimes, not even converted to seconds)
+        return {f: pr for f in names for pr in [xp._parse_name(f)] if pr}
+
+    assert len(slow()) == len(xp.parse_names(names))
+    t_slow = timeit(slow, 7)
+    xp._HOUR_SEC.clear()      # cold hour table, like a fresh process
+    t_fast = timeit(lambda: xp.parse_names(names), 7)
+    print("parse: %d names listed from a synthetic directory" % len(names))
+    print("  _parse_name       %8.1f ms  (%.2f us/name)" % (t_slow * 1e3, t_slow * 1e6 / len(names)))
+    print("  parse_names       %8.1f ms  (%.2f us/name)" % (t_fast * 1e3, t_fast * 1e6 / len(names)))
+    print("  speedup           %8.1fx" % (t_slow / t_fast))
+
+
+def _stream(path, size, zerocopy):
+    """Sends the whole file over loopback TCP with xp.send_range; returns (seconds, sender CPU seconds)."""
+    srv = socket.socket()
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(1)
+    cli = socket.create_connection(srv.getsockname())
+    conn = srv.accept()[0]
+    srv.close()
+    res = {}
+
+    def sender():
+        c = time.thread_time()
+        with open(path, "rb") as f:
+            res["sent"] = xp.send_range(conn, f, 0, size, zerocopy)
+        res["cpu"] = time.thread_time() - c
+        conn.close()
+
+    buf = bytearray(1 << 20)
+    t = time.perf_counter()
+    th = threading.Thread(target=sender)
+    th.start()
+    while cli.recv_into(buf):
+        pass
+    th.join()
+    t = time.perf_counter() - t
+    cli.close()
+    assert res["sent"] == size
+    return t, res["cpu"]
+
+
+def bench_send(n=None, where=None):
+    size = (n or 512) << 20
+    fd, path = tempfile.mkstemp(prefix="xiaomi_bench_", suffix=".mp4", dir=where)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            block = os.urandom(1 << 20)
+            for _ in range(size >> 20):
+                f.write(block)
+        print("send: %d MB file in %s, loopback TCP (file warm in the page cache after the first pass)"
+              % (size >> 20, os.path.dirname(path)))
+        print("  %-10s %12s %14s" % ("", "throughput", "sender CPU"))
+        _stream(path, size, False)            # warm-up: pull the file into the page cache
+        for label, zc in (("copy loop", False), ("sendfile", True)):
+            if zc and not hasattr(os, "sendfile"):
+                print("  %-10s (not available on this OS)" % label)
+                continue
+            runs = [_stream(path, size, zc) for _ in range(3)]
+            t = min(r[0] for r in runs)
+            cpu = min(r[1] for r in runs)
+            print("  %-10s %7.0f MB/s %11.2f s" % (label, (size >> 20) / t, cpu))
+    finally:
+        os.unlink(path)
+
+
+def _box(typ, payload):
+    return struct.pack(">I4s", 8 + len(payload), typ) + payload
+
+
+def synth_mp4(n):
+    """A Xiaomi-shaped file: ftyp, mdat, then moov with one track of n samples (one chunk each)."""
+    sample = 10000
+    ftyp = _box(b"ftyp", b"isom\0\0\2\0isomiso2mp41")
+    mdat_at = len(ftyp)
+    stco = _box(b"stco", struct.pack(">II", 0, n) + struct.pack(">%dI" % n, *range(mdat_at + 8, mdat_at + 8 + n * sample, sample)))
+    stsz = _box(b"stsz", struct.pack(">III", 0, 0, n) + struct.pack(">%dI" % n, *([sample] * n)))
+    stts = _box(b"stts", struct.pack(">IIII", 0, 1, n, 1000))
+    moov = _box(b"moov", _box(b"trak", _box(b"mdia", _box(b"minf", _box(b"stbl", stts + stsz + stco)))))
+    return ftyp, n * sample, moov
+
+
+def bench_faststart(n=None):
+    n = n or 12000
+    ftyp, mdat_len, moov = synth_mp4(n)
+    fd, path = tempfile.mkstemp(prefix="xiaomi_bench_", suffix=".mp4")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(ftyp)
+            f.write(struct.pack(">I4s", 8 + mdat_len, b"mdat"))
+            f.truncate(len(ftyp) + 8 + mdat_len)        # sparse: the payload is never read
+            f.seek(0, 2)
+            f.write(moov)
+        st = os.stat(path)
+
+        def cold():
+            xp._fs_cache.clear()
+            return xp.faststart_view(path, st)
+
+        view = cold()
+        assert view and isinstance(view[1], bytes) and len(view[1]) == len(moov)
+        t_cold = timeit(cold, 7)
+        t_hit = timeit(lambda: xp.faststart_view(path, st), 7)
+        print("faststart: %d samples, moov %.0f KB at the end of a %.0f MB file"
+              % (n, len(moov) / 1024, st.st_size / 1e6))
+        print("  cold build (box walk + moov read + stco shift)  %8.2f ms" % (t_cold * 1e3))
+        print("  cached view                                       %8.3f ms" % (t_hit * 1e3))
+        print("  moov now starts at byte %d (was %d)" % (len(ftyp), st.st_size - len(moov)))
+    finally:
+        os.unlink(path)
+
+
+BENCHES = {"store": bench_store, "parse": bench_parse, "send": bench_send, "faststart": bench_faststart}
+
+
+def main():
+    args = sys.argv[1:]
+    n, where = None, None
+    if "--dir" in args:
+        k = args.index("--dir")
+        where = args[k + 1] if k + 1 < len(args) else sys.exit("--dir needs a directory")
+        del args[k:k + 2]
+    if args and args[-1].isdigit():
+        n = int(args.pop())
+    for name in args or list(BENCHES):
+        if name not in BENCHES:
+            sys.exit("unknown benchmark %r (have: %s)" % (name, ", ".join(BENCHES)))
+        if name == "send":
+            BENCHES[name](n, where)
+        else:
+            BENCHES[name](n)
+
+
+if __name__ == "__main__":
+    main()
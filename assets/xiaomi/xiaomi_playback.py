@@ -20,12 +20,16 @@ Multiple root directories (multiple disks / multiple cameras) are supported. If
 one or more XiaomiCamera_* subdirectories, they are all aggregated into the same dropdown.
 
 Usage:
-    python3 xiaomi_playback.py [ROOT ...] [PORT]
+    python3 xiaomi_playback.py [--async] [--global-rate=MBIT] [ROOT ...] [PORT]
 
     ROOT  The "parent directory" containing the XiaomiCamera_* folders; multiple may be given
           (you can also point it directly at a single camera folder).
           If omitted, defaults to /Volumes/c700_01 /Volumes/c700_02 (macOS CIFS mount points).
     PORT  If the last argument is a plain number it is used as the port; default is 8800.
+    --async  Serve from one asyncio event loop (blocking file I/O on small bounded thread pools)
+             instead of one thread per connection; for many concurrent streams (needs asyncio).
+    --global-rate=MBIT  Cap all video bodies together at MBIT Mbit/s (set it a little under the
+             link the recordings come over, e.g. 90 for 100 Mbit/s SMB); default: no cap.
 
 Examples:
     python3 xiaomi_playback.py /Volumes/c700_01 /Volumes/c700_02 8800
@@ -34,16 +38,47 @@ Examples:
 Then open in a browser  http://<local IP>:8800/   (or http://127.0.0.1:8800/)
 """
 
+import io
 import os
 import re
 import sys
+import stat
+import select
+import queue
+import shutil
+import subprocess
+import struct
+import binascii
 import time
 import datetime
+import bisect
+import itertools
+import collections
 import threading
+from array import array
+from http.client import parse_headers
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
-from urllib.parse import urlparse, parse_qs
-import urllib.request
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import urlparse, parse_qs, urlencode, unquote
+import http.client
 import json
+try:
+    import sqlite3
+except ImportError:   # OpenWrt python3-light ships without it; the segment index then stays in memory only
+    sqlite3 = None
+try:
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:   # OpenWrt packages it separately (python3-asyncio); only the --async engine needs it
+    asyncio = None
+try:
+    import zlib
+except ImportError:   # not in every minimal build; the page is then sent uncompressed
+    zlib = None
+try:
+    import brotli
+except ImportError:   # optional (pip install brotli / opkg python3-brotli): br variants of the page, else gzip only
+    brotli = None
 
 # --------------------------------------------------------------------------- #
 # Configuration / constants
@@ -65,8 +100,9 @@ SMB_HOST_DEFAULT = "192.168.10.200"
 # go2rtc (Frigate machine): the player same-origin proxies its video-stream component JS,
 # bypassing the CORS restriction on cross-origin ES modules.
 GO2RTC = "http://192.168.10.240:1984"
-_JS_CACHE = {}
-_JS_LOCK = threading.Lock()
+JS_TTL = 300.0        # seconds a proxied go2rtc file counts as fresh; after that it is revalidated in the background
+JS_FAIL_TTL = 30.0    # seconds a failed go2rtc fetch is remembered (stale copy or 502 meanwhile, no retry)
+JS_TIMEOUT = 3.0      # seconds go2rtc gets to connect / answer one request
 
 # Locally-hosted tesseract.js OCR engine (served same-origin at /ocr/<file>); computation runs in the browser, this server only serves the static files.
 OCR_DIR = "/mnt/sda3/opt/ocr"
@@ -79,6 +115,10 @@ FN_RE = re.compile(r"(\d{14})_(\d{14})\.mp4$", re.IGNORECASE)
 # Camera folder recognition (Xiaomi default prefix)
 CAM_RE = re.compile(r"xiaomicamera", re.IGNORECASE)
 
+# HTTP Range: one "first-last" spec of a Range header, and the multipart/byteranges separator
+_RANGE_RE = re.compile(r"(\d*)-(\d*)$")
+_BOUNDARY = binascii.hexlify(os.urandom(12)).decode()
+
 # Camera display name: defaults to the "share name" (mount point name, e.g. c700_01). For a more
 # readable name, fill it in here keyed by MAC to override (leave "" to use the share name).
 # The key is the 12-char MAC.
@@ -102,193 +142,3315 @@ def _cam_label(folder, share):
             return name
     return share   # internally always use the lowercase share name (c700_01); the page shows uppercase C700 via CSS text-transform
 
-CACHE_TTL = 15.0  # seconds: how long scan results are cached; after that it auto-rescans to discover new files
-LIVE_STALE_SEC = 300.0  # a start==end chunk not written for this long = abandoned (camera froze), not truly in-progress
+# Persistent segment index (SQLite): every parsed file name is remembered across restarts, so a cold
+# /api/timeline reads the index instead of walking every share again. Lives on the data disk next to
+# Python/OCR, never on the recording shares (those stay read-only). Unwritable/None → memory-only.
+INDEX_DB = "/mnt/sda3/opt/xiaomi_playback/index.db"
+DIR_MTIME_SLACK = 2.0   # a directory listing is trusted only if taken this long after the dir's mtime (same-second writes)
+WATCH_TICK = 1.0        # seconds: watcher loop period (in-progress chunk re-stat, network-mount dir-mtime check)
+PAST_DAY_MAX_AGE = 3600  # seconds a finished past day's /api/segments may be reused unasked (rotation can still prune it)
+ROOT_TIMEOUT = 3.0      # seconds a root (mount) gets to answer a registry probe before it is reported degraded
+PRIME_WAIT = 5.0        # seconds a request for a never-indexed camera waits for the watcher's first listing
+EVENTS_BACKLOG = 256    # index change events kept for /api/events clients reconnecting with Last-Event-ID
+EVENTS_BATCH_MAX = 64   # a camera diff bigger than this (a listing after downtime) is pushed as one "reset"
+EVENTS_PING = 15.0      # seconds an idle /api/events stream goes between keep-alive comments
+SENDFILE = hasattr(os, "sendfile")   # /video: kernel copies file -> socket (zero-copy); False = read/write loop
+COPY_CHUNK = 256 * 1024              # bytes per read/write in the fallback copy loop
+ASYNC_IO_THREADS = 8      # --async: worker threads for blocking file reads (opens/reads on the shares)
+ASYNC_API_THREADS = 8     # --async: worker threads running Handler for the non-streaming routes
+ASYNC_CHUNK = 64 * 1024   # --async: bytes per /video read; one such buffer per open stream
+KEEPALIVE_TIMEOUT = 15.0  # seconds a kept-alive connection may sit idle before its next request
+SEND_TIMEOUT = 300.0      # seconds a response body may make no progress (a paused <video> stops reading)
+SEGMENT_MAX_AGE = 30 * 86400  # seconds a browser may reuse a finished segment unasked (it never changes)
+STATIC_MAX_AGE = 365 * 86400  # seconds a browser keeps the page's content-hashed /static/ CSS/JS (a change = a new name)
+FASTSTART_CACHE = 64      # rewritten moov boxes kept in memory (~25-200 KB each)
+REMUX_CACHE = 8           # remuxed segments' generated init + moofs kept in memory (~100-300 KB each)
+PREBUILD_MAX = 4          # newly finished clips per listing diff parsed ahead of time (more = a first listing: skip)
+KEYFRAME_CACHE = 512      # parsed keyframe indexes / fragment tables kept in memory (~10-40 KB each)
+MAX_RANGES = 16           # more parts than this in one Range header: just send the whole file
+GLOBAL_RATE = 0           # bytes/s all video bodies together may take; 0 = no cap (--global-rate=MBIT: e.g. 90 on a 100 Mbit/s SMB link)
+STREAM_RATE_X = 8.0       # one stream may take this many times its own media bitrate (fills ahead, can't hog); 0 = no cap
+STREAM_RATE_MIN = 1 << 20  # ...but never less than this many bytes/s
+MEDIA_RATE_DEFAULT = 256 * 1024   # bytes/s of media assumed where a stream's duration is unknown (the in-progress chunk)
+SCHED_CHUNK = 64 * 1024   # bytes a stream sends per scheduler grant (smaller = finer fairness, more syscalls)
+READAHEAD_AT = 0.5        # a client streamed past this fraction of a segment: warm the next one up
+READAHEAD_BYTES = 2 << 20  # bytes of the next segment's head pulled into the page cache (plus its moov, wherever)
+DAY_CACHE = 8             # day-stream layouts kept in memory (init + sidx + one entry per segment)
+DAY_BUILD_BUDGET = 3.0    # seconds /api/daymap parses not-yet-indexed segments before answering with fewer
+HLS_SEGMENT = 6.0         # seconds: shortest HLS sub-segment (cut at the first keyframe fragment past it)
+FFMPEG = shutil.which("ffmpeg")   # timeline hover thumbnails are extracted with it; None = thumbnails off
+THUMB_DIR = "/mnt/sda3/opt/xiaomi_playback/thumbs"   # on-disk sprite cache (data disk, next to INDEX_DB)
+THUMB_EVERY = 60          # seconds of wall clock per thumbnail; a day sheet has 24 rows of 3600/THUMB_EVERY tiles
+THUMB_W, THUMB_H = 128, 72  # pixels per tile
+THUMB_WORKERS = 2         # ffmpeg processes running at once (each one nice'd, idle I/O class where ionice exists)
+THUMB_CACHE_MB = 256      # on-disk cache cap; the least recently written files go first
+THUMB_TIMEOUT = 60.0      # seconds one ffmpeg run may take before it is killed
+THUMB_BATCH = 16          # tiles one ffmpeg run extracts (a longer segment takes several runs)
+NET_FS = {"cifs", "smb3", "smbfs", "nfs", "nfs4", "9p"}   # inotify is silent here (other machines write): poll instead
+
+CACHE_TTL = 15.0  # seconds the camera registry counts as fresh; after that it is served stale while one refresh runs
+LIVE_STALE_SEC = 300.0  # a start==end chunk not written for this long = abandoned (camera froze), not truly in-progress
+
+ROOTS = list(DEFAULT_ROOTS)
+PORT = DEFAULT_PORT
+
+_cams = {}                 # cam_id -> SegStore (live segment list, maintained by the IndexWatcher)
+_seg_lock = threading.Lock()
+
+
+# --------------------------------------------------------------------------- #
+# Per-root lanes: all disk work for one root (mount) runs on that root's own worker thread, so a
+# slow or hung share only ever delays its own cameras; callers wait with a deadline, never forever.
+# --------------------------------------------------------------------------- #
+class _Job:
+    __slots__ = ("fn", "done", "result")
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.done = threading.Event()
+        self.result = None
+
+    def run(self):
+        try:
+            self.result = self.fn()
+        except Exception:  # noqa: BLE001  (a failed probe just yields no result)
+            self.result = None
+        finally:
+            self.done.set()
+
+
+class _Lanes:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = {}   # lane key (root path) -> queue.Queue of _Job
+
+    def submit(self, key, fn):
+        with self._lock:
+            q = self._queues.get(key)
+            if q is None:
+                q = self._queues[key] = queue.Queue()
+                threading.Thread(target=self._serve, args=(q,), name="lane:%s" % key, daemon=True).start()
+        job = _Job(fn)
+        q.put(job)
+        return job
+
+    @staticmethod
+    def _serve(q):
+        while True:
+            q.get().run()
+
+
+_LANES = _Lanes()
+
+
+def _wait_all(jobs, timeout):
+    """Waits until every job is done or `timeout` seconds passed; returns the set of late keys."""
+    deadline = time.monotonic() + timeout
+    for j in jobs.values():
+        j.done.wait(max(0.0, deadline - time.monotonic()))
+    return {k for k, j in jobs.items() if not j.done.is_set()}
+
+
+# --------------------------------------------------------------------------- #
+# Single-flight, stale-while-revalidate cache: one build per key at a time. A cold key makes its
+# callers wait for that one build; an expired key is served stale at once while it refreshes in
+# the background, so a request never pays for a rebuild that another request already started.
+# --------------------------------------------------------------------------- #
+class _SwrCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._ents = {}   # key -> [t (monotonic), value, has value, in-flight Event or None]
+
+    def peek(self, key):
+        """The last value built for `key` (however old), or None."""
+        with self._lock:
+            e = self._ents.get(key)
+            return e[1] if e else None
+
+    def invalidate(self, key):
+        with self._lock:
+            e = self._ents.get(key)
+            if e:
+                e[0] = float("-inf")
+
+    def get(self, key, build, wait=False):
+        """Value for `key`. Fresh: returned as is. Stale: returned as is, and one background
+        refresh is started (unless `wait`, which waits for a fresh one). Cold: the first caller
+        builds, the rest wait for its result."""
+        with self._lock:
+            e = self._ents.get(key)
+            if e is None:
+                e = self._ents[key] = [0.0, None, False, None]
+            if e[2] and time.monotonic() - e[0] < self.ttl:
+                return e[1]
+            flight, lead = e[3], e[3] is None
+            if lead:
+                flight = e[3] = threading.Event()
+            if e[2] and not wait:
+                if lead:
+                    threading.Thread(target=self._refresh, args=(e, build, flight),
+                                     name="refresh:%s" % (key,), daemon=True).start()
+                return e[1]
+        if lead:
+            self._refresh(e, build, flight)
+        else:
+            flight.wait()
+        with self._lock:
+            return e[1]
+
+    def _refresh(self, e, build, flight):
+        try:
+            t = time.monotonic()
+            val = build()
+            with self._lock:
+                e[0], e[1], e[2] = t, val, True
+        finally:
+            with self._lock:
+                e[3] = None
+            flight.set()
+
+
+_CACHE = _SwrCache(CACHE_TTL)   # the camera registry ("reg")
+
+
+# --------------------------------------------------------------------------- #
+# Camera registry: maps (root, folder) to a safe cam_id, preventing path traversal
+# --------------------------------------------------------------------------- #
+def _probe_root(i, root):
+    """The cameras of one root, as {cam_id: {"id","label","dir","root"}} (runs on the root's lane)."""
+    reg = {}
+    if not os.path.isdir(root):
+        return reg
+    subs = []
+    try:
+        with os.scandir(root) as it:
+            for ent in it:
+                try:
+                    if ent.is_dir() and CAM_RE.search(ent.name):
+                        subs.append(ent.name)
+                except OSError:
+                    continue
+    except OSError:
+        return reg
+    subs.sort()
+    share = os.path.basename(os.path.normpath(root)) or root
+    if subs:
+        multi = len(subs) > 1
+        for name in subs:
+            cid = "%d:%s" % (i, name)
+            lbl = _cam_label(name, share)
+            if multi and lbl == share:        # when one disk has multiple cameras, use the MAC tail to tell them apart
+                mac = re.search(r"([0-9A-Fa-f]{12})$", name)
+                if mac:
+                    lbl = "%s·%s" % (share, mac.group(1)[-4:])
+            reg[cid] = {"id": cid, "label": lbl, "dir": os.path.join(root, name), "root": root}
+    else:
+        cid = "%d:." % i
+        reg[cid] = {"id": cid, "label": _cam_label(share, share), "dir": root, "root": root}
+    return reg
+
+
+_probes = {}   # root -> its in-flight/last _Job (a hung root gets no second probe piled behind the first)
+
+
+def _build_registry():
+    """Returns a dict (roots in order): cam_id -> {"id","label","dir","root"[,"degraded"]}.
+    Each XiaomiCamera_* subdirectory under a root counts as one camera; if a root has no such
+    subdirectory (it holds recording segments directly, or it is still an empty spare disk), the
+    root itself is treated as one camera — so the empty disk c700_05 also appears in the dropdown
+    by its share name (no recordings yet), and will be picked up automatically once a camera
+    starts writing into it (at that point cid changes from "i:." to "i:XiaomiCamera_...", the
+    label still being the share name).
+    All roots are probed in parallel (one lane each). A root that misses ROOT_TIMEOUT, or whose
+    probe raised, keeps the cameras it had last time, flagged "degraded", instead of holding up
+    the others or dropping out."""
+    jobs, stuck = {}, {}
+    for i, root in enumerate(ROOTS):
+        if not root:
+            continue
+        j = _probes.get(root)
+        if j is None or j.done.is_set():
+            jobs[i] = _probes[root] = _LANES.submit(root, lambda i=i, root=root: _probe_root(i, root))
+        else:
+            stuck[i] = j       # still hung from an earlier build: don't wait on it again
+    late = _wait_all(jobs, ROOT_TIMEOUT) | set(stuck)
+    jobs.update(stuck)
+    prev = _CACHE.peek("reg") or {}
+    reg = {}
+    for i, j in sorted(jobs.items()):
+        if i not in late and j.result is not None:   # (None: the probe raised)
+            reg.update(j.result)
+            continue
+        for cid, c in prev.items():
+            if c["root"] == ROOTS[i]:
+                reg[cid] = dict(c, degraded=True)
+    return reg
+
+
+def registry(wait=False):
+    """The camera registry; once built, never blocks a request (see _SwrCache). `wait` = the caller
+    wants one no older than CACHE_TTL and will wait for the refresh (the watcher does)."""
+    return _CACHE.get("reg", _build_registry, wait) or {}
+
+
+def list_cameras():
+    """Returns [{id,label[,degraded]}], across all root directories."""
+    out = []
+    for c in registry().values():
+        cam = {"id": c["id"], "label": c["label"]}
+        if c.get("degraded"):
+            cam["degraded"] = True     # its root didn't answer in time: last known entry
+        out.append(cam)
+    return out
+
+
+def cam_dir(cam_id):
+    """Resolves cam_id to a disk directory; only via the registry, never concatenating untrusted input → no path traversal."""
+    c = registry().get(cam_id)
+    if c and os.path.isdir(c["dir"]):
+        return c["dir"]
+    return None
+
+
+# --------------------------------------------------------------------------- #
+# Index: read file names only
+# --------------------------------------------------------------------------- #
+def _parse_name(name):
+    m = FN_RE.search(name)
+    if not m:
+        return None
+    try:
+        s = datetime.datetime.strptime(m.group(1), "%Y%m%d%H%M%S")
+        e = datetime.datetime.strptime(m.group(2), "%Y%m%d%H%M%S")
+    except ValueError:
+        return None
+    return s, e
+
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_EPOCH_ORD = _EPOCH.toordinal()
+_MP4_EXT = frozenset("." + m + p + "4" for m in "mM" for p in "pP")   # FN_RE is case-insensitive
+
+
+def _to_sec(dt):
+    """Naive local datetime -> "wall-clock epoch" seconds (the file names carry no zone; neither does this)."""
+    return int((dt - _EPOCH).total_seconds())
+
+
+def _iso(sec):
+    """Wall-clock seconds -> 'YYYY-MM-DDTHH:MM:SS' (same text as datetime.isoformat(), without building one)."""
+    return "%04d-%02d-%02dT%02d:%02d:%02d" % time.gmtime(sec)[:6]
+
+
+def _day_iso(day):
+    return "%04d-%02d-%02d" % time.gmtime(day * 86400)[:3]
+
+
+# Fixed-offset parse tables: a timestamp is two dict hits ("YYYYMMDDHH" + "MMSS") instead of a regex
+# + strptime. Only valid pieces are ever keys, so a hit is also the validation. The end timestamp's
+# keys carry the separator and the extension with them ("_YYYYMMDDHH", "MMSS.mp4"), so four hits
+# check the whole 33-char tail and nothing else is looked at per name.
+_HOUR_SEC = {}   # "YYYYMMDDHH" and "_YYYYMMDDHH" -> wall-clock seconds at HH:00:00 (filled lazily, real dates only)
+_MMSS_SEC = {"%02d%02d" % (m, sec): m * 60 + sec for m in range(60) for sec in range(60)}
+_MMSS_MP4_SEC = {k + ".mp4": v for k, v in _MMSS_SEC.items()}
+
+
+def _hour_sec(k):
+    v = _HOUR_SEC.get(k)
+    if v is None and k.isascii() and k.isdigit() and len(k) == 10:
+        try:
+            d = datetime.date(int(k[:4]), int(k[4:6]), int(k[6:8]))
+        except ValueError:
+            return None
+        if int(k[8:]) > 23:
+            return None
+        v = _HOUR_SEC[k] = _HOUR_SEC["_" + k] = (d.toordinal() - _EPOCH_ORD) * 86400 + int(k[8:]) * 3600
+    return v
+
+
+def parse_names(names):
+    """Bulk ingest: {name: (start, end)} wall-clock seconds for every segment name in `names`.
+
+    Fast path: the fixed-width tail `YYYYMMDDHHMMSS_YYYYMMDDHHMMSS.mp4` is sliced at fixed offsets
+    and looked up in the tables above; no per-name check, datetime or int() runs. A name that misses
+    (an hour not in the table yet, an upper-case extension) is retried piece by piece, filling the
+    hour table; only one that still misses is handed to _parse_name (regex + strptime), which stays
+    the authority on what counts as a segment."""
+    out, miss = {}, []
+    hg, sg, eg = _HOUR_SEC.get, _MMSS_SEC.get, _MMSS_MP4_SEC.get
+    for name in names:
+        try:
+            out[name] = (hg(name[-33:-23]) + sg(name[-23:-19]), hg(name[-19:-8]) + eg(name[-8:]))
+        except TypeError:         # some piece was None
+            miss.append(name)
+    mg, mp4 = _MMSS_SEC.get, _MP4_EXT
+    for name in miss:
+        t = name[-33:]
+        if t[14:15] == "_" and t[29:] in mp4:
+            sh, ss, eh, es = hg(t[:10]), mg(t[10:14]), hg(t[15:25]), mg(t[25:29])
+            if sh is None:
+                sh = _hour_sec(t[:10])
+            if eh is None:
+                eh = _hour_sec(t[15:25])
+            try:
+                out[name] = (sh + ss, eh + es)
+                continue
+            except TypeError:     # some piece was None: not a clean name
+                pass
+        pr = _parse_name(name)
+        if pr:
+            out[name] = (_to_sec(pr[0]), _to_sec(pr[1]))
+    return out
+
+
+def _parse_secs(name):
+    """(start, end) wall-clock seconds of one segment file name, or None."""
+    return parse_names((name,)).get(name)
+
+
+class SegIndex:
+    """Persistent file index: cam dir -> {file: (start, end, size, mtime)}, start/end in wall-clock seconds.
+
+    One SQLite table mirrors what each camera folder held at the last pass. A pass only lists the
+    folder when its mtime moved (create/delete/rename all bump it, on CIFS too), and then only parses
+    and stats the names that were added; removed names are dropped. The in-progress chunk (start==end)
+    is the one file whose size/mtime still changes, so it alone is re-stat'ed (in memory, not persisted).
+    Every mutator returns the diff it applied as (added {file: row}, removed [file]).
+
+    Nothing per file stays in memory here: the rows live in the DB and in the camera's Segs snapshot,
+    so a listing pass is handed the names the caller already holds (`known`). Only the in-progress
+    rows and each folder's listing state are kept."""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS segments (cam TEXT NOT NULL, file TEXT NOT NULL, start INTEGER NOT NULL,"
+        " end INTEGER NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL, PRIMARY KEY (cam, file))",
+        "CREATE INDEX IF NOT EXISTS segments_cam_start ON segments (cam, start)",
+        "CREATE TABLE IF NOT EXISTS dirs (cam TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, scanned REAL NOT NULL)",
+    )
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._live = {}    # cam dir -> {file: (start, end, size, mtime)}, in-progress chunks only
+        self._dirs = {}    # cam dir -> (dir mtime_ns, time of that listing)
+        self._db = None
+        if path and sqlite3 is not None:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                db = sqlite3.connect(path, check_same_thread=False)   # every use is under self._lock
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+                for stmt in self.SCHEMA:
+                    db.execute(stmt)
+                db.commit()
+                self._db = db
+            except (OSError, sqlite3.Error) as ex:
+                print(" Warning: segment index %s unavailable (%s); indexing in memory only." % (path, ex))
+
+    def _note(self, d, added, removed):
+        """Keeps the in-progress rows of `d` in step with a diff."""
+        live = self._live.setdefault(d, {})
+        for f in removed:
+            live.pop(f, None)
+        for f, r in added.items():
+            if r[1] <= r[0]:
+                live[f] = r
+            else:
+                live.pop(f, None)
+
+    def _store(self, d, added, removed, dstate=None):
+        if self._db is None:
+            return
+        try:
+            with self._db:
+                if removed:
+                    self._db.executemany("DELETE FROM segments WHERE cam = ? AND file = ?",
+                                         [(d, f) for f in removed])
+                if added:
+                    self._db.executemany("INSERT OR REPLACE INTO segments VALUES (?, ?, ?, ?, ?, ?)",
+                                         [(d, f) + v for f, v in added.items()])
+                if dstate:
+                    self._db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)", (d,) + dstate)
+        except sqlite3.Error:
+            pass
+
+    def load(self, d):
+        """(rows, known): what the DB holds for `d`, to seed a new snapshot from (this is what makes a
+        restart cheap); `known` = it has been listed before, so the rows are usable as they are.
+        Without a DB there is nothing to seed from: the next refresh lists the folder in full."""
+        rows = {}
+        with self._lock:
+            self._dirs.pop(d, None)
+            if self._db is not None:
+                try:
+                    for f, s, e, size, mt in self._db.execute(
+                            "SELECT file, start, end, size, mtime FROM segments WHERE cam = ?", (d,)):
+                        rows[f] = (s, e, size, mt)
+                    r = self._db.execute("SELECT mtime_ns, scanned FROM dirs WHERE cam = ?", (d,)).fetchone()
+                    if r:
+                        self._dirs[d] = (r[0], r[1])
+                except sqlite3.Error:
+                    pass
+            self._live[d] = {}
+            self._note(d, rows, [])
+            return rows, d in self._dirs
+
+    def apply(self, d, added, removed):
+        """Records changes seen by someone else (inotify). Leaves the dir state alone, so a later
+        listing pass (e.g. after a restart) still re-checks the folder."""
+        with self._lock:
+            self._note(d, added, removed)
+            self._store(d, added, removed)
+        return added, removed
+
+    def restat_live(self, d, now):
+        """Re-stats the in-progress chunk(s) of `d` (memory only: their mtime just keeps moving)."""
+        with self._lock:
+            live = [(f, r) for f, r in self._live.get(d, {}).items() if now - r[3] < LIVE_STALE_SEC]
+        added = {}
+        for f, (s, e, size, omt) in live:
+            try:
+                st = os.stat(os.path.join(d, f))
+            except OSError:
+                continue
+            if st.st_mtime != omt or st.st_size != size:
+                added[f] = (s, e, st.st_size, st.st_mtime)
+        if added:
+            with self._lock:
+                rows = self._live.get(d, {})
+                for f, r in added.items():
+                    if f in rows:
+                        rows[f] = r
+        return added, []
+
+    def refresh(self, d, now, known=(), force=False):
+        """Brings `d` up to date with the disk: lists it only if its mtime moved (or `force`).
+        `known` = the names the caller's snapshot holds; the diff is taken against them."""
+        with self._lock:
+            prev = self._dirs.get(d)
+        try:
+            mt = os.stat(d).st_mtime_ns
+        except OSError:
+            return {}, []
+        if not force and prev and prev[0] == mt and prev[1] - mt / 1e9 > DIR_MTIME_SLACK:
+            return self.restat_live(d, now)
+        names = set()
+        try:
+            with os.scandir(d) as it:
+                for ent in it:
+                    try:
+                        if ent.is_file():
+                            names.add(ent.name)
+                    except OSError:
+                        continue
+        except OSError:
+            return {}, []
+        known = set(known)
+        removed = [f for f in known if f not in names]
+        added = {}
+        for f, (s, e) in parse_names(names - known).items():
+            try:
+                st = os.stat(os.path.join(d, f))
+            except OSError:
+                continue
+            added[f] = (s, e, st.st_size, st.st_mtime)
+        del known, names
+        with self._lock:
+            self._note(d, added, removed)
+            self._dirs[d] = (mt, now)
+            self._store(d, added, removed, (mt, now))
+        more, _ = self.restat_live(d, now)
+        added.update(more)
+        return added, removed
+
+
+class Segs:
+    """Immutable, start-sorted columnar snapshot of one camera's segments (what scan() returns).
+
+    Replaces one dict + two datetimes per file: start/end are array('q') wall-clock seconds, `live`
+    is a packed bitmap of in-progress chunks, `names` an interned filename table (a name is found
+    again by bisecting its own start time, so there is no name -> position dict). An in-progress
+    chunk is stored with end == start; its real end is resolved per request from its mtime (see
+    ends_at).
+
+    Two query structures ride along: `maxend` (running max of end, so "first segment that can still
+    overlap t" is a bisect, making a day query O(log n + k)) and `daycount` (day number -> segments
+    touching that day, carried over incrementally from the previous snapshot, so the timeline is a
+    lookup). `cover` holds per-day minute coverage bitsets, built on first use and carried over the
+    same way for every day a diff did not touch (see minutes)."""
+    __slots__ = ("start", "end", "live", "names", "live_at", "mtime", "maxend", "daycount", "_days", "bodies",
+                 "cover")
+
+    def __init__(self, start=None, end=None, live=None, names=None, live_mtime=None, live_at=None,
+                 maxend=None, daycount=None, bodies=None, cover=None):
+        self.start = start if start is not None else array("q")
+        self.end = end if end is not None else array("q")
+        self.live = live if live is not None else bytearray()
+        self.names = names if names is not None else []
+        if live_at is None:
+            live_at = tuple(b * 8 + k for b, byte in enumerate(self.live) if byte
+                            for k in range(8) if byte & (1 << k))
+        self.live_at = live_at
+        self.mtime = live_mtime or {}   # file -> mtime, in-progress chunks only
+        self.maxend = maxend if maxend is not None else array("q", itertools.accumulate(self.end, max))
+        if daycount is None:
+            daycount = {}
+            _count_days(daycount, zip(self.start, self.end), 1)
+        self.daycount = daycount
+        self._days = None
+        self.bodies = bodies if bodies is not None else {}   # encoded API responses, see _cached_body()
+        self.cover = cover if cover is not None else {}      # day number -> minute bitset, see minutes()
+
+    def __len__(self):
+        return len(self.names)
+
+    def is_live(self, i):
+        return bool(self.live[i >> 3] & (1 << (i & 7)))
+
+    def find(self, f, s=None):
+        """Position of file `f` (whose start is `s`, parsed from the name if not given), or None."""
+        if s is None:
+            pr = _parse_secs(f)
+            if not pr:
+                return None
+            s = pr[0]
+        start, names = self.start, self.names
+        i = bisect.bisect_left(start, s)
+        while i < len(names) and start[i] == s:
+            if names[i] == f:
+                return i
+            i += 1
+        return None
+
+    def overlapping(self, t0, t1):
+        """Positions of the stored segments overlapping [t0, t1), in start order: O(log n + k).
+        (In-progress chunks only count with their stored end == start; see ends_at.)"""
+        lo = bisect.bisect_right(self.maxend, t0)    # everything before lo ended by t0
+        hi = bisect.bisect_left(self.start, t1)      # everything from hi on starts at/after t1
+        end = self.end
+        return [i for i in range(lo, hi) if end[i] > t0]
+
+    def days(self):
+        """[{"date", "count"}] ascending, for the stored extents (built once per snapshot; read-only)."""
+        if self._days is None:
+            self._days = [{"date": _day_iso(k), "count": n} for k, n in sorted(self.daycount.items())]
+        return self._days
+
+    def minutes(self, day):
+        """Coverage of day number `day` as a 1440-bit bitset (see _cover_bits), from the stored extents
+        of finished segments (callers overlay the in-progress chunks: ends_at). Built once per day and
+        kept across snapshots until a diff touches that day."""
+        bits = self.cover.get(day)
+        if bits is None:
+            t0 = day * 86400
+            start, end = self.start, self.end
+            bits = bytes(_cover_bits(((start[i], end[i]) for i in self.overlapping(t0, t0 + 86400)
+                                      if end[i] > start[i]), t0, 60, 1440))
+            self.cover[day] = bits
+        return bits
+
+    def ends_at(self, now):
+        """{i: (end_sec, live, end_iso)} for the in-progress chunks: end = now while the chunk is still
+        being written, else (abandoned: the camera froze) a 1 s stub that is no longer live."""
+        out = {}
+        if not self.live_at:
+            return out
+        now_sec = _to_sec(datetime.datetime.now())
+        for i in self.live_at:
+            s = self.start[i]
+            if (now - self.mtime.get(self.names[i], 0.0)) >= LIVE_STALE_SEC:
+                out[i] = (s + 1, False, _iso(s + 1))
+            elif now_sec > s:
+                out[i] = (now_sec, True, _iso(now_sec))
+            else:
+                out[i] = (s + 1, True, _iso(s + 1))
+        return out
+
+    def patched(self, added, removed):
+        """A new snapshot with the index diff applied (self is left untouched)."""
+        mt = dict(self.mtime)
+        fresh = {}
+        drop = set()
+        for f, (s, e, size, m) in added.items():
+            i = self.find(f, s)
+            if i is not None:
+                if self.end[i] == e:         # same chunk, it just grew
+                    if e <= s:
+                        mt[f] = m
+                    continue
+                drop.add(i)
+            fresh[f] = (s, e, m)
+        for f in removed:
+            i = self.find(f)
+            if i is not None:
+                drop.add(i)
+            mt.pop(f, None)
+        if not fresh and not drop:
+            if mt == self.mtime:
+                return self
+            return Segs(self.start, self.end, self.live, self.names, mt, self.live_at,
+                        self.maxend, self.daycount, self.bodies, self.cover)   # same extents: all still valid
+        daycount = dict(self.daycount)
+        _count_days(daycount, ((self.start[i], self.end[i]) for i in drop), -1)
+        _count_days(daycount, ((s, e) for s, e, _m in fresh.values()), 1)
+        touched = {}
+        _count_days(touched, ((self.start[i], self.end[i]) for i in drop), 1)
+        _count_days(touched, ((s, e) for s, e, _m in fresh.values()), 1)
+        cover = {k: v for k, v in self.cover.items() if k not in touched}
+        start, end, names = self.start, self.end, self.names
+        if drop:
+            rows = [(start[i], end[i], f) for i, f in enumerate(names) if i not in drop]
+        else:
+            rows = list(zip(start, end, names))
+        for f, (s, e, m) in fresh.items():
+            rows.append((s, e, sys.intern(f)))
+            if e <= s:
+                mt[f] = m
+            else:
+                mt.pop(f, None)
+        rows.sort()   # mostly already in order (new chunks append at the end): linear for timsort
+        live = bytearray((len(rows) + 7) >> 3)
+        for i, (s, e, _f) in enumerate(rows):
+            if e <= s:
+                live[i >> 3] |= 1 << (i & 7)
+        return Segs(array("q", [r[0] for r in rows]), array("q", [r[1] for r in rows]), live,
+                    [r[2] for r in rows], mt, daycount=daycount, cover=cover)
+
+
+def _count_days(counts, extents, step):
+    """Adds `step` to counts[day] for every day each (start, end) extent touches (end day inclusive)."""
+    get = counts.get
+    for s, e in extents:
+        a, b = s // 86400, max(s, e) // 86400
+        while True:
+            n = get(a, 0) + step
+            if n:
+                counts[a] = n
+            else:
+                counts.pop(a, None)
+            if a >= b:
+                break
+            a += 1
+
+
+def _cover_bits(extents, t0, res, n):
+    """Coverage bitset of n slots of `res` seconds from t0: bit k (byte k >> 3, mask 0x80 >> (k & 7))
+    is set when any (start, end) extent overlaps [t0 + k*res, t0 + (k+1)*res)."""
+    bits = bytearray((n + 7) >> 3)
+    for s, e in extents:
+        a, b = max(0, (s - t0) // res), min(n, -(-(e - t0) // res))
+        while a < b and a & 7:
+            bits[a >> 3] |= 0x80 >> (a & 7)
+            a += 1
+        while b > a and b & 7:
+            b -= 1
+            bits[b >> 3] |= 0x80 >> (b & 7)
+        if a < b:
+            bits[a >> 3:b >> 3] = b"\xff" * ((b - a) >> 3)
+    return bits
+
+
+class SegStore:
+    """One camera's current Segs snapshot, swapped copy-on-write by the watcher thread; `ready` is
+    set once it reflects a real listing (or a previously persisted one)."""
+
+    def __init__(self, d):
+        self.dir = d
+        self.segs = Segs()
+        self.ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def apply(self, added, removed):
+        if not added and not removed:
+            return
+        with self._lock:
+            self.segs = self.segs.patched(added, removed)
+
+
+# --------------------------------------------------------------------------- #
+# Change feed: what the watcher applied, as numbered Server-Sent Events for /api/events
+# --------------------------------------------------------------------------- #
+class _Feed:
+    """Numbered index change events, encoded once as SSE frames. The last EVENTS_BACKLOG stay for
+    clients resuming with Last-Event-ID (ids carry a per-process tag, so ids from before a restart
+    are told apart). Stream threads block in wait(); listeners (the asyncio engine) are called on
+    the publishing thread after each batch and must not block."""
+
+    def __init__(self):
+        self.boot = os.urandom(4).hex()      # random: two starts within one second still differ
+        self.seq = 0
+        self.recent = collections.deque(maxlen=EVENTS_BACKLOG)   # (seq, frame)
+        self.cond = threading.Condition()
+        self.listeners = set()
+
+    def _frame(self, seq, typ, obj):
+        return ("id: %s-%d\nevent: %s\ndata: %s\n\n" % (
+            self.boot, seq, typ, json.dumps(obj, ensure_ascii=False, separators=(",", ":")))).encode("utf-8")
+
+    def publish(self, events):
+        """Appends [(type, obj)] and wakes every stream."""
+        if not events:
+            return
+        with self.cond:
+            for typ, obj in events:
+                self.seq += 1
+                self.recent.append((self.seq, self._frame(self.seq, typ, obj)))
+            self.cond.notify_all()
+            listeners = list(self.listeners)
+        for fn in listeners:
+            fn()
+
+    def _read(self, seq):
+        if seq == self.seq:
+            return seq, b""
+        if not self.recent or self.recent[0][0] > seq + 1:     # some already left the backlog
+            return self.seq, self._frame(self.seq, "reset", {})
+        return self.seq, b"".join(f for n, f in self.recent if n > seq)
+
+    def start(self, last_id):
+        """(seq, bytes) opening a stream: the reconnect delay, then the events a resuming client
+        missed, or "hello" (a new client starts from here) or "reset" (its events are gone, or came
+        from an earlier process: refetch whatever it shows)."""
+        with self.cond:
+            boot, _, n = (last_id or "").partition("-")
+            if boot == self.boot and n.isdigit() and int(n) <= self.seq:
+                seq, out = self._read(int(n))
+            else:
+                seq, out = self.seq, self._frame(self.seq, "reset" if last_id else "hello", {})
+        return seq, b"retry: 3000\n\n" + out
+
+    def read(self, seq):
+        """(seq, bytes) of whatever came after `seq` (b"" = nothing yet), without waiting."""
+        with self.cond:
+            return self._read(seq)
+
+    def wait(self, seq, timeout):
+        """read(), after waiting up to `timeout` for something to come after `seq`."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq != seq, timeout)
+            return self._read(seq)
+
+    def listen(self, fn, on=True):
+        with self.cond:
+            (self.listeners.add if on else self.listeners.discard)(fn)
+
+
+_FEED = _Feed()
+
+
+def _seg_events(cam, old, added, removed):
+    """Feed events for one camera's index diff, against its snapshot before the diff: "segment" (a
+    new clip, finished or in progress), "finalized" (the in-progress chunk was renamed to its
+    finished name: same start, "was" = the old name), "removed". A chunk that merely grew is no
+    news; a diff bigger than EVENTS_BATCH_MAX is a single "reset" (refetch this camera)."""
+    if len(added) + len(removed) > EVENTS_BATCH_MAX:
+        return [("reset", {"cam": cam})]
+    now_sec = _to_sec(datetime.datetime.now())
+    gone = {}
+    for f in removed:
+        i = old.find(f)
+        if i is not None:
+            gone[f] = i
+    was = {old.start[i]: f for f, i in gone.items() if old.is_live(i)}
+    out = []
+    for f, (s, e, _size, _mtime) in sorted(added.items(), key=lambda kv: kv[1][0]):
+        i = old.find(f, s)
+        if i is not None and old.end[i] == e:
+            continue
+        live = e <= s
+        obj = {"cam": cam, "file": f, "start": _iso(s), "end": _iso(max(now_sec, s + 1) if live else e),
+               "live": live}
+        if not live and s in was:
+            obj["was"] = was[s]
+            gone.pop(was.pop(s))
+            out.append(("finalized", obj))
+        else:
+            out.append(("segment", obj))
+    out += [("removed", {"cam": cam, "file": f}) for f in gone]
+    return out
+
+
+# --------------------------------------------------------------------------- #
+# Watcher: keeps the index live (inotify on local disks, readdir diff on network mounts)
+# --------------------------------------------------------------------------- #
+class _Inotify:
+    """Just enough inotify(7) through ctypes (no dependency). `open()` returns None where it can't work
+    (not Linux, or a python3 build without ctypes) and the watcher then polls everything."""
+    IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+    IN_DELETE_SELF, IN_MOVE_SELF, IN_Q_OVERFLOW, IN_IGNORED = 0x400, 0x800, 0x4000, 0x8000
+    IN_ONLYDIR = 0x01000000
+    MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+    GONE = IN_DELETE | IN_MOVED_FROM
+    _EV = struct.Struct("iIII")   # wd, mask, cookie, len, then len bytes of NUL-padded name
+
+    def __init__(self, libc, fd):
+        self._libc = libc
+        self.fd = fd
+
+    @classmethod
+    def open(cls):
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (ImportError, OSError, AttributeError):
+            return None
+        return cls(libc, fd) if fd >= 0 else None
+
+    def add(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        return wd if wd >= 0 else None
+
+    def rm(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        """[(wd, mask, name)] that arrived within `timeout` seconds."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        out, off = [], 0
+        while off + self._EV.size <= len(buf):
+            wd, mask, _cookie, ln = self._EV.unpack_from(buf, off)
+            off += self._EV.size
+            name = buf[off:off + ln].rstrip(b"\0").decode("utf-8", "surrogateescape")
+            off += ln
+            out.append((wd, mask, name))
+        return out
+
+
+def _local_fs(path):
+    """True if `path` sits on a local filesystem (inotify sees writes there; it stays silent on CIFS/NFS,
+    where other machines do the writing)."""
+    try:
+        real = os.path.realpath(path)
+        with open("/proc/mounts") as f:
+            mounts = [ln.split() for ln in f]
+    except OSError:
+        return False
+    best, fstype = "", None
+    for m in mounts:
+        if len(m) < 3:
+            continue
+        mnt = m[1].replace("\\040", " ")
+        if (real == mnt or real.startswith(mnt.rstrip("/") + "/")) and len(mnt) >= len(best):
+            best, fstype = mnt, m[2]
+    return fstype is not None and fstype not in NET_FS and not fstype.startswith("fuse")
+
+
+class IndexWatcher(threading.Thread):
+    """Keeps the in-memory segment lists live. Local camera folders get an inotify watch and their
+    create/rename/delete events are applied as they arrive; folders on network mounts (or everything,
+    without inotify) get the cheap dir-mtime check + readdir diff every WATCH_TICK. Anything that
+    touches a share (first listing, polling) runs on that root's lane, so one slow mount never stalls
+    the other cameras or the inotify loop. The registry is re-synced every CACHE_TTL."""
+
+    def __init__(self, index):
+        super().__init__(name="index-watcher", daemon=True)
+        self.index = index
+        self.ino = _Inotify.open()
+        self.wds = {}       # inotify wd -> cam dir
+        self.watched = {}   # cam dir -> wd (None = polled)
+        self.roots = {}     # cam dir -> its root (= lane)
+        self.busy = set()   # polled cam dirs with a refresh still in flight on their lane
+        self._lock = threading.Lock()
+        self._reg_t = 0.0
+        self._cam_ids = None   # the registry's cameras at the last sync (None = not synced yet)
+
+    def track(self, cam_id, cam):
+        """Registers a camera (from the watcher, or from a request that got there first) and seeds
+        its list from the index — a persisted index makes it usable right away; the first real
+        listing then runs on the camera's lane."""
+        d = cam["dir"]
+        with _seg_lock:
+            st = _cams.get(cam_id)
+            if st is not None and st.dir == d:
+                return st
+            st = _cams[cam_id] = SegStore(d)
+        rows, known = self.index.load(d)
+        st.apply(rows, [])
+        if known:
+            st.ready.set()
+        with self._lock:
+            self.roots[d] = cam["root"]
+        _LANES.submit(cam["root"], lambda: self._prime(cam_id, d))
+        return st
+
+    def _prime(self, cam_id, d):
+        with self._lock:
+            fresh = d not in self.watched
+        if fresh:
+            wd = self.ino.add(d) if self.ino and _local_fs(d) else None   # watch first, then list: no gap
+            with self._lock:
+                self.watched[d] = wd
+                if wd is not None:
+                    self.wds[wd] = d
+        try:
+            self._publish(d, self.index.refresh(d, time.time(), self._known(d)))
+        finally:
+            with _seg_lock:
+                st = _cams.get(cam_id)
+            if st is not None:
+                st.ready.set()
+
+    def _poll(self, d, force=False):
+        """Queues a readdir diff of `d` on its lane, unless one is still in flight."""
+        with self._lock:
+            if d in self.busy:
+                return
+            self.busy.add(d)
+            root = self.roots.get(d, d)
+
+        def job():
+            try:
+                self._publish(d, self.index.refresh(d, time.time(), self._known(d), force))
+            finally:
+                with self._lock:
+                    self.busy.discard(d)
+        _LANES.submit(root, job)
+
+    def _known(self, d):
+        """The file names the current snapshot of `d` holds (what a listing is diffed against)."""
+        with _seg_lock:
+            for st in _cams.values():
+                if st.dir == d:
+                    return st.segs.names
+        return ()
+
+    def run(self):
+        while True:
+            try:
+                self._tick()
+            except Exception:  # noqa: BLE001  (never let the watcher die; retry next tick)
+                time.sleep(WATCH_TICK)
+
+    def _sync_cams(self):
+        reg = registry(wait=True)
+        want = {c["dir"]: cid for cid, c in reg.items()}
+        if self._cam_ids is not None:
+            _FEED.publish([("camera", {"id": cid, "label": reg[cid]["label"], "gone": False})
+                           for cid in reg if cid not in self._cam_ids] +
+                          [("camera", {"id": cid, "gone": True}) for cid in self._cam_ids if cid not in reg])
+        self._cam_ids = set(reg)
+        with _seg_lock:
+            for cid in [cid for cid, st in _cams.items() if want.get(st.dir) != cid]:
+                del _cams[cid]
+        with self._lock:
+            for d in [d for d in self.watched if d not in want]:
+                wd = self.watched.pop(d)
+                if wd is not None:
+                    self.wds.pop(wd, None)
+                    self.ino.rm(wd)
+        for d, cid in want.items():
+            self.track(cid, reg[cid])
+
+    def _publish(self, d, diff):
+        added, removed = diff
+        if not added and not removed:
+            return
+        with _seg_lock:
+            sts = [(cid, st) for cid, st in _cams.items() if st.dir == d]
+        events = []
+        for cid, st in sts:
+            old = st.segs
+            st.apply(added, removed)
+            # a camera's first listing is news as a whole: whoever shows it refetches
+            events += _seg_events(cid, old, added, removed) if st.ready.is_set() else [("reset", {"cam": cid})]
+        _FEED.publish(events)
+        if len(added) <= PREBUILD_MAX:          # a clip just finished (not a first listing): index it now
+            with self._lock:
+                root = self.roots.get(d, d)
+            for name, (s, e, _size, _mtime) in added.items():
+                if e > s:
+                    _LANES.submit(root, lambda p=os.path.join(d, name): prebuild(p))
+
+    def _events(self, now):
+        if not self.ino:
+            time.sleep(WATCH_TICK)
+            return
+        per_dir = {}
+        for wd, mask, name in self.ino.read(WATCH_TICK):
+            if mask & _Inotify.IN_Q_OVERFLOW:       # events were lost: re-list every watched folder
+                for d in list(self.wds.values()):
+                    self._poll(d, force=True)
+                continue
+            d = self.wds.get(wd)
+            if d is None:
+                continue
+            if mask & (_Inotify.IN_IGNORED | _Inotify.IN_DELETE_SELF | _Inotify.IN_MOVE_SELF):
+                with self._lock:
+                    self.wds.pop(wd, None)
+                    self.watched.pop(d, None)
+                self._rescan_registry()         # folder went away: let the registry sort it out
+                continue
+            if not FN_RE.search(name):
+                if mask & (_Inotify.IN_CREATE | _Inotify.IN_MOVED_TO) and CAM_RE.search(name):
+                    self._rescan_registry()     # a camera folder appeared under a root-as-camera
+                continue
+            per_dir.setdefault(d, []).append((mask, name))
+        for d, evs in per_dir.items():
+            added, removed = {}, []
+            for mask, name in evs:               # in order: a rename shows up as FROM old + TO new
+                if mask & _Inotify.GONE:
+                    added.pop(name, None)
+                    removed.append(name)
+                    continue
+                pr = _parse_secs(name)
+                try:
+                    st = os.stat(os.path.join(d, name))
+                except OSError:
+                    continue
+                if pr and not stat.S_ISDIR(st.st_mode):
+                    added[name] = pr + (st.st_size, st.st_mtime)
+            self._publish(d, self.index.apply(d, added, removed))
+
+    def _rescan_registry(self):
+        _CACHE.invalidate("reg")
+        self._reg_t = 0.0
+
+    def _tick(self):
+        now = time.time()
+        if now - self._reg_t >= CACHE_TTL:
+            self._reg_t = now
+            self._sync_cams()
+        self._events(now)
+        now = time.time()
+        with self._lock:
+            watched = list(self.watched.items())
+        for d, wd in watched:
+            if wd is None:
+                self._poll(d)
+            else:                                # local disk: the in-progress chunk's stat is cheap
+                self._publish(d, self.index.restat_live(d, now))
+
+
+_INDEX = None     # SegIndex, opened on first use
+_WATCHER = None   # IndexWatcher, started on first use (main() starts it up front)
+_index_lock = threading.Lock()
+
+
+def seg_index():
+    global _INDEX
+    with _index_lock:
+        if _INDEX is None:
+            _INDEX = SegIndex(INDEX_DB)
+        return _INDEX
+
+
+def watcher():
+    global _WATCHER
+    idx = seg_index()
+    with _index_lock:
+        if _WATCHER is None:
+            _WATCHER = IndexWatcher(idx)
+            _WATCHER.start()
+        return _WATCHER
+
+
+def scan(cam_id):
+    """All recognizable segments of a camera, straight from the live in-memory index (never lists
+    the folder on the request thread; a camera never indexed before waits up to PRIME_WAIT for its
+    first listing by the watcher; concurrent requests for it all wait on that one listing). An
+    unknown camera gets an empty Segs."""
+    segs = scan_many([cam_id])[cam_id]
+    return Segs() if segs is None else segs
+
+
+def scan_many(cam_ids):
+    """{cam_id: Segs, or None for an unknown camera}: scan() for several cameras in one pass. The
+    never-indexed ones all get their first listing queued before any is waited for, so together they
+    wait PRIME_WAIT at most, not once each."""
+    w = watcher()
+    with _seg_lock:
+        sts = {cid: _cams.get(cid) for cid in cam_ids}
+    if None in sts.values():
+        reg = registry()
+        for cid, st in sts.items():
+            if st is None and cid in reg:
+                sts[cid] = w.track(cid, reg[cid])
+    deadline = time.monotonic() + PRIME_WAIT
+    for st in sts.values():
+        if st is not None:
+            st.ready.wait(max(0.0, deadline - time.monotonic()))
+    return {cid: None if st is None else st.segs for cid, st in sts.items()}
+
+
+def days_for(segs):
+    """List of dates that have recordings (with a rough per-day segment count), in ascending date order."""
+    extra = {}
+    for i, (e, _live, _e_iso) in segs.ends_at(time.time()).items():   # days an in-progress chunk has run into
+        for a in range(segs.start[i] // 86400 + 1, e // 86400 + 1):
+            extra[a] = extra.get(a, 0) + 1
+    if not extra:
+        return segs.days()
+    counts = dict(segs.daycount)
+    for a, n in extra.items():
+        counts[a] = counts.get(a, 0) + n
+    return [{"date": _day_iso(k), "count": counts[k]} for k in sorted(counts)]
+
+
+def segs_for_day(segs, date_str):
+    """All segments overlapping a given day (00:00~24:00 local time), sorted."""
+    try:
+        d = datetime.date.fromisoformat(date_str)
+    except ValueError:
+        return []
+    day0 = _to_sec(datetime.datetime.combine(d, datetime.time.min))
+    day1 = day0 + 86400
+    ends = segs.ends_at(time.time())
+    start, end, names = segs.start, segs.end, segs.names
+    hits = segs.overlapping(day0, day1)
+    extra = [i for i, lv in ends.items() if start[i] < day1 and lv[0] > day0 and end[i] <= day0]
+    if extra:                                     # an in-progress chunk that started before today
+        hits = sorted(hits + extra)
+    out = []
+    for i in hits:
+        lv = ends.get(i)
+        out.append({
+            "file": names[i],
+            "start": _iso(start[i]),
+            "end": lv[2] if lv else _iso(end[i]),
+            "live": lv[1] if lv else False,
+        })
+    return out
+
+
+def _cached_body(segs, key, dyn, build, cache):
+    """(body, etag, cache_control) for API response `key`, JSON-encoded once per snapshot.
+    `dyn` captures whatever else the body depends on (the in-progress chunks' resolved ends); a new
+    value rebuilds. The ETag is derived from the bytes, so it is strong and stable across restarts."""
+    hit = segs.bodies.get(key)
+    if hit and hit[0] == dyn:
+        return hit[1]
+    body = json.dumps(build(), ensure_ascii=False).encode("utf-8")
+    ent = (body, '"%08x-%x"' % (binascii.crc32(body), len(body)), cache)
+    segs.bodies[key] = (dyn, ent)
+    return ent
+
+
+def timeline_body(segs):
+    ends = segs.ends_at(time.time())
+    dyn = tuple(sorted((segs.start[i], lv[0] // 86400) for i, lv in ends.items()))   # days they reach
+    return _cached_body(segs, "days", dyn, lambda: {"days": days_for(segs)}, "no-cache")
+
+
+def segments_body(segs, date_str):
+    try:
+        d = datetime.date.fromisoformat(date_str)
+    except ValueError:
+        return _cached_body(segs, "nodate", (), lambda: {"segments": []}, "no-cache")
+    day0 = _to_sec(datetime.datetime.combine(d, datetime.time.min))
+    day1 = day0 + 86400
+    ends = segs.ends_at(time.time())
+    dyn = tuple((i, lv[0], lv[1]) for i, lv in sorted(ends.items())
+                if segs.start[i] < day1 and max(lv[0], segs.start[i]) > day0)
+    settled = not dyn and day1 <= _to_sec(datetime.datetime.now()) // 86400 * 86400
+    cache = "private, max-age=%d" % PAST_DAY_MAX_AGE if settled else "no-cache"
+    return _cached_body(segs, day0, dyn, lambda: {"segments": segs_for_day(segs, date_str)}, cache)
+
+
+def segments_many_body(cam_ids, date_str):
+    """(body, etag, cache_control) for a batched /api/segments: {"cams": {cam_id: {"segments": [...]}}}
+    (null = no such camera). Each camera's part is its snapshot's cached single-camera body, spliced
+    in as is; the whole stays cacheable only as long as every part is."""
+    parts, cache = [], None
+    for cid, segs in scan_many(cam_ids).items():
+        if segs is None:
+            body = b"null"
+        else:
+            body, _etag, c = segments_body(segs, date_str)
+            cache = c if cache is None or c == "no-cache" else cache
+        parts.append(json.dumps(cid, ensure_ascii=False).encode("utf-8") + b":" + body)
+    body = b'{"cams":{' + b",".join(parts) + b"}}"
+    return body, '"%08x-%x"' % (binascii.crc32(body), len(body)), cache or "no-cache"
+
+
+def _cam_ids(vals):
+    """Camera ids of ?cam= values: each value is one id, or several joined by commas (a value that is
+    itself a known id is taken whole, whatever it contains). Order kept, duplicates dropped."""
+    reg = registry()
+    out = []
+    for v in vals:
+        out += [v] if v in reg or "," not in v else [c for c in v.split(",") if c]
+    return list(dict.fromkeys(out))
+
+
+def _cover_span(span, date_str):
+    """(t0, days, res) of a /api/coverage span, or None: "day" = that day per second, "week" = 7 days
+    from it per minute, "month" = its calendar month per hour."""
+    try:
+        d = datetime.date.fromisoformat(date_str)
+    except ValueError:
+        return None
+    if span == "month":
+        d = d.replace(day=1)
+        days, res = ((d + datetime.timedelta(days=31)).replace(day=1) - d).days, 3600
+    elif span in ("day", "week"):
+        days, res = (1, 1) if span == "day" else (7, 60)
+    else:
+        return None
+    return _to_sec(datetime.datetime.combine(d, datetime.time.min)), days, res
+
+
+def cam_coverage(segs, t0, days, res, live):
+    """Coverage bitset (see _cover_bits) of one camera over `days` days from midnight t0 in `res`-second
+    slots; `live` = the in-progress chunks' resolved (start, end) extents, overlaid. Minutes and hours
+    come from the per-day minute bitsets the snapshots keep (Segs.minutes), seconds from the day's
+    segments directly."""
+    n = days * 86400 // res
+    if res == 1:
+        start, end = segs.start, segs.end
+        return _cover_bits([(start[i], end[i]) for i in segs.overlapping(t0, t0 + 86400 * days)
+                            if end[i] > start[i]] + live, t0, 1, n)
+    day0 = t0 // 86400
+    if res == 60:
+        bits = bytearray(b"".join(segs.minutes(day0 + k) for k in range(days)))
+    else:                                   # an hour is covered when any minute of it is
+        bits = bytearray((n + 7) >> 3)
+        hour = (1 << 60) - 1
+        for k in range(days):
+            m = int.from_bytes(segs.minutes(day0 + k), "big")
+            for h in range(24):
+                if m >> (1380 - 60 * h) & hour:
+                    j = k * 24 + h
+                    bits[j >> 3] |= 0x80 >> (j & 7)
+    if live:
+        bits = bytearray(a | b for a, b in zip(bits, _cover_bits(live, t0, res, n)))
+    return bits
+
+
+def coverage_body(cams, span, date_str):
+    """(body, etag, cache_control) for /api/coverage, or None (bad span or date): one base64 bitset per
+    camera (null = no such camera), bit k covering [start + k*res, start + (k+1)*res) seconds."""
+    sp = _cover_span(span, date_str)
+    if sp is None:
+        return None
+    t0, days, res = sp
+    t1 = t0 + 86400 * days
+    now = time.time()
+    settled = t1 <= _to_sec(datetime.datetime.now()) // 86400 * 86400
+    out = {}
+    for cam, segs in scan_many(cams).items():
+        if segs is None:
+            out[cam] = None
+            continue
+        live = [(segs.start[i], max(lv[0], segs.start[i])) for i, lv in segs.ends_at(now).items()
+                if segs.start[i] < t1 and lv[0] > t0]
+        settled = settled and not live
+        bits = cam_coverage(segs, t0, days, res, live)
+        out[cam] = binascii.b2a_base64(bytes(bits), newline=False).decode("ascii")
+    obj = {"span": span, "start": _iso(t0), "res": res, "bits": 86400 * days // res, "cams": out}
+    body = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    cache = "private, max-age=%d" % PAST_DAY_MAX_AGE if settled else "no-cache"
+    return body, '"%08x-%x"' % (binascii.crc32(body), len(body)), cache
+
+
+# --------------------------------------------------------------------------- #
+# MP4 boxes / virtual faststart. Xiaomi writes moov (the sample tables) after mdat, so a browser
+# opening a segment reads the head, seeks to the tail for moov, then seeks back for the first frame:
+# several SMB round-trips per segment switch. For a finished segment, /video?...&faststart=1 serves a
+# moov-first view instead — the same bytes, moov moved in front of mdat and its chunk offsets shifted
+# by its own size. Only the rewritten moov lives in memory (cached per file); nothing is written.
+# --------------------------------------------------------------------------- #
+_MP4_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts", b"dinf", b"mvex"}
+_fs_cache = {}   # (path, size, mtime_ns) -> view (list of pieces) or None; insertion order = age
+_kf_cache = {}   # (path, size, mtime_ns) -> keyframe index or None; insertion order = age
+_fs_lock = threading.Lock()
+
+
+def _box_iter(buf, pos, end):
+    """(type, start, header_len, size) of each box in buf[pos:end]; stops at anything malformed."""
+    while pos + 8 <= end:
+        size, typ = struct.unpack_from(">I4s", buf, pos)
+        hdr = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size, hdr = struct.unpack_from(">Q", buf, pos + 8)[0], 16
+        elif size == 0:
+            size = end - pos
+        if size < hdr or pos + size > end:
+            return
+        yield typ, pos, hdr, size
+        pos += size
+
+
+def _top_boxes(fd, fsize):
+    """Top-level boxes of an MP4 file as [(type, start, size)], reading only their headers
+    (a handful of small reads); None if the chain doesn't add up to the file."""
+    out, pos = [], 0
+    while pos < fsize:
+        h = os.pread(fd, 16, pos)
+        if len(h) < 8:
+            return None
+        size, typ = struct.unpack_from(">I4s", h)
+        if size == 1:
+            if len(h) < 16:
+                return None
+            size = struct.unpack_from(">Q", h, 8)[0]
+        elif size == 0:
+            size = fsize - pos
+        if size < 8 or pos + size > fsize:
+            return None
+        out.append((typ, pos, size))
+        pos += size
+    return out
+
+
+def _shift_offsets(buf, pos, end, delta):
+    """Adds `delta` to every stco/co64 chunk offset under buf[pos:end] in place; False if a 32-bit
+    stco entry would overflow (the caller then gives up on the view)."""
+    for typ, b, hdr, size in _box_iter(buf, pos, end):
+        if typ in _MP4_CONTAINERS:
+            if not _shift_offsets(buf, b + hdr, b + size, delta):
+                return False
+        elif typ in (b"stco", b"co64"):
+            n = struct.unpack_from(">I", buf, b + hdr + 4)[0]
+            fmt = ">%d%s" % (n, "I" if typ == b"stco" else "Q")
+            if b + hdr + 8 + struct.calcsize(fmt) > b + size:
+                return False
+            offs = [o + delta for o in struct.unpack_from(fmt, buf, b + hdr + 8)]
+            if typ == b"stco" and offs and max(offs) > 0xFFFFFFFF:
+                return False
+            struct.pack_into(fmt, buf, b + hdr + 8, *offs)
+    return True
+
+
+def _build_faststart(fpath, size):
+    fd = os.open(fpath, os.O_RDONLY)
+    try:
+        boxes = _top_boxes(fd, size)
+        if not boxes:
+            return None
+        mdat = next((b for b in boxes if b[0] == b"mdat"), None)
+        moov = next((b for b in boxes if b[0] == b"moov"), None)
+        if not mdat or not moov or moov[1] < mdat[1]:
+            return None                    # not an MP4 we know, or already moov-first
+        buf = bytearray(os.pread(fd, moov[2], moov[1]))
+    finally:
+        os.close(fd)
+    if len(buf) != moov[2] or not _shift_offsets(buf, 0, len(buf), len(buf)):
+        return None
+    m0, m1 = moov[1], moov[1] + moov[2]
+    view = [(0, mdat[1])] if mdat[1] else []
+    view += [bytes(buf), (mdat[1], m0 - mdat[1])]
+    if m1 < size:
+        view.append((m1, size - m1))
+    return view
+
+
+def faststart_view(fpath, st):
+    """Moov-first layout of a finished segment as pieces (bytes, or (offset, length) slices of the
+    real file) adding up to st.st_size, or None (not rewritable / already moov-first)."""
+    key = (fpath, st.st_size, st.st_mtime_ns)
+    with _fs_lock:
+        if key in _fs_cache:
+            view = _fs_cache[key] = _fs_cache.pop(key)    # refresh its age
+            return view
+    try:
+        view = _build_faststart(fpath, st.st_size)
+    except (OSError, struct.error):
+        view = None
+    with _fs_lock:
+        _fs_cache[key] = view
+        while len(_fs_cache) > FASTSTART_CACHE:
+            del _fs_cache[next(iter(_fs_cache))]
+    return view
+
+
+def _child(buf, pos, end, typ):
+    """(start, header_len, size) of the first `typ` box directly under buf[pos:end], or None."""
+    for t, b, hdr, size in _box_iter(buf, pos, end):
+        if t == typ:
+            return b, hdr, size
+    return None
+
+
+def _path(buf, pos, end, *types):
+    """Walks down a chain of box types; (payload start, payload end) of the last one, or None."""
+    for typ in types:
+        c = _child(buf, pos, end, typ)
+        if c is None:
+            return None
+        pos, end = c[0] + c[1], c[0] + c[2]
+    return pos, end
+
+
+def _tracks(moov):
+    """({track_id: (timescale, handler type, trex defaults (duration, size, flags), stbl payload
+    range)}, signature) of a moov. The signature covers everything a decoder is set up from (track
+    ids, timescales, sample descriptions, trex): two files with the same one can share an init."""
+    out, sig = {}, []
+    m = _child(moov, 0, len(moov), b"moov")
+    if m is None:
+        return out, 0
+    mp, me = m[0] + m[1], m[0] + m[2]
+    trexs = {}
+    mvex = _path(moov, mp, me, b"mvex")
+    if mvex:
+        for xt, xb, xhdr, xsize in _box_iter(moov, mvex[0], mvex[1]):
+            if xt == b"trex":
+                trexs[struct.unpack_from(">I", moov, xb + xhdr + 4)[0]] = struct.unpack_from(">III", moov, xb + xhdr + 12)
+                sig.append(moov[xb:xb + xsize])
+    for tt, tb, thdr, tsize in _box_iter(moov, mp, me):
+        if tt != b"trak":
+            continue
+        tp, te = tb + thdr, tb + tsize
+        hd = _path(moov, tp, te, b"mdia", b"hdlr")
+        md = _path(moov, tp, te, b"mdia", b"mdhd")
+        th = _path(moov, tp, te, b"tkhd")
+        if not hd or not md or not th:
+            continue
+        track_id = struct.unpack_from(">I", moov, th[0] + (20 if moov[th[0]] == 1 else 12))[0]
+        timescale = struct.unpack_from(">I", moov, md[0] + (20 if moov[md[0]] == 1 else 12))[0]
+        kind = bytes(moov[hd[0] + 8:hd[0] + 12])
+        stbl = _path(moov, tp, te, b"mdia", b"minf", b"stbl")
+        out[track_id] = (timescale, kind, trexs.get(track_id, (0, 0, 0)), stbl)
+        sd = _child(moov, stbl[0], stbl[1], b"stsd") if stbl else None
+        desc = bytes(moov[sd[0]:sd[0] + sd[2]]) if sd else b""
+        # less any btrt: per-file bitrate statistics some muxers write, nothing a decoder reads
+        sig += [struct.pack(">II4s", track_id, timescale, kind), re.sub(rb"\0\0\0\x14btrt[\s\S]{12}", b"", desc)]
+    return out, binascii.crc32(b"".join(sig))
+
+
+def _video_track(tracks):
+    """(track_id, timescale, stbl payload range, trex defaults) of the first video track, or None."""
+    for track_id, (timescale, kind, trex, stbl) in tracks.items():
+        if kind == b"vide":
+            return track_id, timescale, stbl, trex
+    return None
+
+
+def _table(buf, rng, typ, fmt):
+    """Entries of a full-box sample table (count, then `fmt` records) under stbl, as a flat tuple."""
+    c = _child(buf, rng[0], rng[1], typ)
+    if c is None:
+        return None
+    at = c[0] + c[1]
+    n = struct.unpack_from(">I", buf, at + 4)[0]
+    return struct.unpack_from(">%d%s" % (n * len(fmt), fmt[0]), buf, at + 8) if n else ()
+
+
+def _samples(moov, stbl):
+    """A progressive track's sample table, one entry per sample: {"off", "size", "dts" (one more
+    entry than samples: the last is the track's end), "cto" (composition offsets; None = no ctts),
+    "sync" (0-based indexes of the sync samples; None = every sample is one)}, all array()s; None
+    if a table is missing."""
+    stts = _table(moov, stbl, b"stts", "II")
+    stsc = _table(moov, stbl, b"stsc", "III")
+    chunks = _table(moov, stbl, b"stco", "I")
+    if chunks is None:
+        chunks = _table(moov, stbl, b"co64", "Q")
+    sz = _child(moov, stbl[0], stbl[1], b"stsz")
+    if stts is None or stsc is None or chunks is None or sz is None:
+        return None
+    fixed, count = struct.unpack_from(">II", moov, sz[0] + sz[1] + 4)
+    sizes = array("L", itertools.repeat(fixed, count) if fixed else
+                  struct.unpack_from(">%dI" % count, moov, sz[0] + sz[1] + 12))
+    offs = array("Q")
+    for k in range(0, len(stsc), 3):
+        first, per = stsc[k], stsc[k + 1]
+        last = stsc[k + 3] - 1 if k + 3 < len(stsc) else len(chunks)
+        for ch in range(first, last + 1):
+            off = chunks[ch - 1]
+            for n in range(len(offs), min(len(offs) + per, count)):
+                offs.append(off)
+                off += sizes[n]
+    del sizes[len(offs):]                          # chunks that hold fewer samples than stsz lists
+    n = len(offs)
+    durs = list(itertools.islice(itertools.chain.from_iterable(
+        itertools.repeat(stts[k + 1], stts[k]) for k in range(0, len(stts), 2)), n))
+    durs += [0] * (n - len(durs))                  # stts short of samples: the rest take no time
+    dts = array("q", itertools.accumulate(durs, initial=0))
+    ctts = _child(moov, stbl[0], stbl[1], b"ctts")
+    cto = None
+    if ctts is not None:
+        signed = moov[ctts[0] + ctts[1]] == 1
+        ent = _table(moov, stbl, b"ctts", "ii" if signed else "II")
+        cto = array("q", itertools.islice(itertools.chain.from_iterable(
+            itertools.repeat(ent[k + 1], ent[k]) for k in range(0, len(ent), 2)), n))
+        cto.extend(itertools.repeat(0, n - len(cto)))
+    sync = _table(moov, stbl, b"stss", "I")
+    if sync is not None:
+        sync = array("L", (i - 1 for i in sync if 0 < i <= n))
+    return {"off": offs, "size": sizes, "dts": dts, "cto": cto, "sync": sync}
+
+
+def _moov_keyframes(moov, trak):
+    """[(seconds, byte offset)] of every sync sample of a progressive (sample-table) video track."""
+    _tid, scale, stbl, _trex = trak
+    smp = _samples(moov, stbl) if stbl else None
+    if smp is None:
+        return None
+    dts, offs = smp["dts"], smp["off"]
+    sync = smp["sync"] if smp["sync"] is not None else range(len(offs))
+    return [(dts[i] / scale, offs[i]) for i in sync], dts[-1] / scale
+
+
+def _traf_times(moof, pos, end, tracks, dts):
+    """Walks one traf: (track_id, base dts, first sync sample's dts or None, number of sync
+    samples), and dts[track_id] moved to the end of its samples; None for a track the moov doesn't
+    know."""
+    fh = _child(moof, pos, end, b"tfhd")
+    if fh is None:
+        return None
+    at = fh[0] + fh[1]
+    flags = struct.unpack_from(">I", moof, at)[0] & 0xFFFFFF
+    track_id = struct.unpack_from(">I", moof, at + 4)[0]
+    if track_id not in tracks:
+        return None
+    trex = tracks[track_id][2]
+    at += 8 + (8 if flags & 0x01 else 0) + (4 if flags & 0x02 else 0)
+    d_dur = struct.unpack_from(">I", moof, at)[0] if flags & 0x08 else trex[0]
+    at += 4 if flags & 0x08 else 0
+    at += 4 if flags & 0x10 else 0
+    d_flags = struct.unpack_from(">I", moof, at)[0] if flags & 0x20 else trex[2]
+    t = dts.get(track_id, 0)
+    fd_ = _child(moof, pos, end, b"tfdt")
+    if fd_ is not None:
+        at = fd_[0] + fd_[1]
+        t = struct.unpack_from(">Q" if moof[at] == 1 else ">I", moof, at + 4)[0]
+    base, hit, syncs = t, None, 0
+    for rt, rb, rhdr, _rs in _box_iter(moof, pos, end):
+        if rt != b"trun":
+            continue
+        at = rb + rhdr
+        rflags = struct.unpack_from(">I", moof, at)[0] & 0xFFFFFF
+        n = struct.unpack_from(">I", moof, at + 4)[0]
+        at += 8 + (4 if rflags & 0x01 else 0)
+        first = None
+        if rflags & 0x04:
+            first = struct.unpack_from(">I", moof, at)[0]
+            at += 4
+        rec = 4 * bin(rflags & 0xF00).count("1")
+        for i in range(n):
+            dur, sflags, p = d_dur, d_flags, at
+            if rflags & 0x100:
+                dur = struct.unpack_from(">I", moof, p)[0]
+                p += 4
+            p += 4 if rflags & 0x200 else 0
+            if rflags & 0x400:
+                sflags = struct.unpack_from(">I", moof, p)[0]
+            if i == 0 and first is not None:
+                sflags = first
+            if not sflags & 0x10000:                      # sample_is_non_sync_sample clear
+                hit = t if hit is None else hit
+                syncs += 1
+            t += dur
+            at += rec
+    dts[track_id] = t
+    return track_id, base, hit, syncs
+
+
+def _moof_growth(moof):
+    """Bytes a moof gains when its version-0 (32-bit) tfdts are widened to version 1."""
+    n = 0
+    for t, b, hdr, size in _box_iter(moof, 8, len(moof)):
+        if t == b"traf":
+            c = _child(moof, b + hdr, b + size, b"tfdt")
+            n += 4 if c and moof[c[0] + c[1]] == 0 else 0
+    return n
+
+
+def _frag_table(fd, boxes, tracks, vid):
+    """Fragment table of a fragmented MP4 (reads every moof once), all columns array()s:
+    moofs/sizes = each moof's offset and size, grow = bytes it gains when its version-0 tfdts are
+    widened (None: none are), vmoof/vdts/vsync = for each moof carrying video: its index, the video
+    base dts and the first sync sample's dts (-1: none); run = (first moof, end of the last
+    fragment) — what follows (mfra) is not part of it; t0/t1 = per-track first/end dts."""
+    moofs, sizes, grow = array("Q"), array("L"), array("L")
+    vmoof, vdts, vsync = array("L"), array("Q"), array("q")
+    t0, dts, end = {}, {}, 0
+    for typ, start, size in boxes:
+        if typ == b"mdat" and moofs:
+            end = start + size
+        if typ != b"moof":
+            continue
+        moof = os.pread(fd, size, start)
+        if len(moof) < size:
+            return None
+        v = None
+        for t, b, hdr, bsize in _box_iter(moof, 8, len(moof)):
+            if t != b"traf":
+                continue
+            r = _traf_times(moof, b + hdr, b + bsize, tracks, dts)
+            if r is None:
+                continue
+            track_id, base, hit, _syncs = r
+            t0.setdefault(track_id, base)
+            if track_id == vid:
+                if v is None:
+                    v = [base, hit]
+                elif v[1] is None:
+                    v[1] = hit
+        if v is not None:
+            vmoof.append(len(moofs))
+            vdts.append(v[0])
+            vsync.append(-1 if v[1] is None else v[1])
+        moofs.append(start)
+        sizes.append(size)
+        grow.append(_moof_growth(moof))
+        end = start + size
+    if not vmoof:
+        return None
+    return {"run": (moofs[0], end), "moofs": moofs, "sizes": sizes, "grow": grow if any(grow) else None,
+            "vmoof": vmoof, "vdts": vdts, "vsync": vsync, "t0": t0, "t1": dts,
+            "scales": {k: tracks[k][0] for k in dts}, "vid": vid}
+
+
+def _build_keyframes(fpath, size):
+    fd = os.open(fpath, os.O_RDONLY)
+    try:
+        boxes = _top_boxes(fd, size)
+        if not boxes:
+            return None
+        moov = next((b for b in boxes if b[0] == b"moov"), None)
+        if moov is None:
+            return None
+        mbuf = os.pread(fd, moov[2], moov[1])
+        tracks, sig = _tracks(mbuf)
+        trak = _video_track(tracks)
+        if trak is None or not trak[1]:
+            return None
+        frags = None
+        if any(b[0] == b"moof" for b in boxes):
+            frags = _frag_table(fd, boxes, tracks, trak[0])
+            if frags is None:
+                return None
+            scale = trak[1]
+            got = ([(t / scale, frags["moofs"][i]) for i, t in zip(frags["vmoof"], frags["vsync"]) if t >= 0],
+                   frags["t1"][trak[0]] / scale)
+        else:
+            got = _moov_keyframes(mbuf, trak)
+    finally:
+        os.close(fd)
+    if not got:
+        return None
+    kfs, duration = got
+    return {"keyframes": kfs, "duration": duration, "init": frags["run"][0] if frags else None,
+            "frags": frags, "sig": sig}
+
+
+def keyframe_index(fpath, st):
+    """Keyframes of a finished segment: {"keyframes": [(seconds, byte offset)], "duration": seconds,
+    "init": offset of the first moof (fragmented MP4: the offsets are fragment starts) or None
+    (sample-table MP4: the offsets are the keyframe samples themselves), "frags": its fragment
+    table (see _frag_table; None for a sample-table MP4), "sig": its decoder-setup signature}, or
+    None if unparsable. Parsed once per file (only box headers, moov and the moof boxes are read),
+    then cached."""
+    key = (fpath, st.st_size, st.st_mtime_ns)
+    with _fs_lock:
+        if key in _kf_cache:
+            kf = _kf_cache[key] = _kf_cache.pop(key)
+            return kf
+    try:
+        kf = _build_keyframes(fpath, st.st_size)
+    except (OSError, struct.error, IndexError):
+        kf = None
+    with _fs_lock:
+        _kf_cache[key] = kf
+        while len(_kf_cache) > KEYFRAME_CACHE:
+            del _kf_cache[next(iter(_kf_cache))]
+    return kf
+
+
+def keyframe_at(kf, t):
+    """The last keyframe at or before `t` seconds (the first one if t is before it)."""
+    i = bisect.bisect_right(kf["keyframes"], (t, float("inf"))) - 1
+    return kf["keyframes"][max(i, 0)]
+
+
+def prebuild(fpath):
+    """Parses a newly finished segment's keyframes / moov-first view (and remuxed layout, for a
+    sample-table MP4) ahead of its first request (the watcher runs this on the camera's lane)."""
+    try:
+        st = os.stat(fpath)
+    except OSError:
+        return
+    kf = keyframe_index(fpath, st)
+    faststart_view(fpath, st)
+    if kf and kf["frags"] is None:
+        remux_index(fpath, st)
+
+
+def keyframes_body(cam, fn):
+    """(body, etag, cache_control) for /api/keyframes, or None (404). The offsets are byte offsets
+    into the file as stored; a finished segment never changes, so the reply is cacheable for long."""
+    d = cam_dir(cam)
+    if not d or not FN_RE.search(fn or ""):
+        return None
+    fpath = os.path.join(d, os.path.basename(fn))
+    pr = _parse_secs(os.path.basename(fn))
+    try:
+        st = os.stat(fpath)
+    except OSError:
+        return None
+    if not pr or pr[1] <= pr[0] or not stat.S_ISREG(st.st_mode):
+        return None                            # in progress: no final index yet
+    kf = keyframe_index(fpath, st)
+    obj = {"file": os.path.basename(fn), "duration": round(kf["duration"], 3) if kf else None,
+           "fragmented": bool(kf and kf["init"] is not None),
+           "keyframes": [[round(t, 3), off] for t, off in kf["keyframes"]] if kf else []}
+    body = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    return body, '"%08x-%x"' % (binascii.crc32(body), len(body)), "private, max-age=%d" % SEGMENT_MAX_AGE
+
+
+def _piece_len(p):
+    return len(p) if isinstance(p, bytes) else p[1] if isinstance(p, tuple) else p.size
+
+
+def _view_slice(view, start, length):
+    """The pieces covering bytes [start, start+length) of a view, lazily: a day stream's runs are
+    expanded (and their moofs read) only as the body is written."""
+    pos, stop = 0, start + length
+    for p in view:
+        n = _piece_len(p)
+        a, b = max(start, pos), min(stop, pos + n)
+        if a < b:
+            if isinstance(p, bytes):
+                yield p[a - pos:b - pos]
+            elif isinstance(p, tuple):
+                yield (p[0] + a - pos, b - a) + p[2:]
+            else:
+                yield from p.pieces(a - pos, b - a)
+        pos += n
+        if pos >= stop:
+            break
+
+
+# --------------------------------------------------------------------------- #
+# Remuxing. Xiaomi writes progressive MP4s (sample tables in a moov after mdat): a day stream or an
+# HLS playlist can't address those as they are stored. remux_view() gives one a fragmented form on
+# the fly: ftyp, the moov with its sample tables emptied and an mvex added, then one moof + mdat per
+# keyframe (at most one a second), each track's samples cut by time. Only moov and the moofs are
+# generated; each mdat holds slices of the file as stored, so the media still goes out by sendfile.
+# The layout is kept per file like a keyframe index; the generated boxes for REMUX_CACHE files only.
+# --------------------------------------------------------------------------- #
+_rx_cache = {}    # (path, size, mtime_ns) -> fragment table of the remuxed view or None; insertion order = age
+_rx_views = {}    # (path, size, mtime_ns) -> (fragment table, view) or None; insertion order = age
+_RX_EMPTY = {b"stts": 8, b"stsc": 8, b"stco": 8, b"co64": 8, b"stsz": 12}   # emptied in the init: payload bytes
+_RX_DROP = {b"stss", b"ctts", b"sdtp", b"stps", b"sbgp", b"subs", b"cslg", b"stsh", b"padb"}   # per-sample, left out
+_RX_SYNC, _RX_NONSYNC = 0x02000000, 0x01010000   # sample flags: depends on nothing / depends on others, not sync
+
+
+def _rx_moov(moov, track_ids):
+    """The init moov of a remuxed segment: sample tables emptied, per-sample boxes dropped, and an
+    mvex with one trex (no defaults: every moof spells its samples out) per track."""
+    mvex = b"".join(struct.pack(">I4sIIIIII", 32, b"trex", 0, tid, 1, 0, 0, 0) for tid in track_ids)
+
+    def walk(pos, end):
+        out = bytearray()
+        for t, b, hdr, size in _box_iter(moov, pos, end):
+            if t in _RX_DROP:
+                continue
+            if t in _RX_EMPTY:
+                out += struct.pack(">I4s", 8 + _RX_EMPTY[t], t) + bytes(_RX_EMPTY[t])
+            elif t in (b"moov", b"trak", b"mdia", b"minf", b"stbl"):
+                body = walk(b + hdr, b + size)
+                if t == b"moov":
+                    body += struct.pack(">I4s", 8 + len(mvex), b"mvex") + mvex
+                out += struct.pack(">I4s", 8 + len(body), t) + body
+            else:
+                out += moov[b:b + size]
+        return out
+
+    return bytes(walk(0, len(moov)))
+
+
+def _rx_traf(tid, smp, a, b, video):
+    """(traf bytes, [(file offset, length, position of its trun's data_offset in the traf)]) for
+    samples [a, b) of one track: a trun per run of samples that sit back to back in the file."""
+    offs, sizes, dts, cto, sync = smp["off"], smp["size"], smp["dts"], smp["cto"], smp["sync"]
+    durs = [dts[i + 1] - dts[i] for i in range(a, b)]
+    szs = sizes[a:b]
+    flags = 0x020000 | 0x20                          # default-base-is-moof, default sample flags
+    dflt = struct.pack(">I", _RX_NONSYNC if video else _RX_SYNC)
+    if min(durs) == max(durs):
+        flags |= 0x08
+        dflt = struct.pack(">I", durs[0]) + dflt
+    if min(szs) == max(szs):
+        flags |= 0x10
+        dflt = dflt[:-4] + struct.pack(">I", szs[0]) + dflt[-4:]
+    head = struct.pack(">I4sII", 16 + len(dflt), b"tfhd", flags, tid) + dflt
+    head += struct.pack(">I4sIQ", 20, b"tfdt", 0x01000000, dts[a])
+    keys = set(sync[bisect.bisect_left(sync, a):bisect.bisect_left(sync, b)]) if video and sync is not None else None
+    body, slices = bytearray(), []
+    i = a
+    while i < b:
+        j = i + 1
+        while j < b and offs[j] == offs[j - 1] + sizes[j - 1]:
+            j += 1
+        rflags = 0x01 | (0 if flags & 0x08 else 0x100) | (0 if flags & 0x10 else 0x200)
+        ver = 0
+        first = None
+        if video:
+            syncs = [k for k in range(i, j) if keys is None or k in keys]
+            if syncs and syncs != [i]:
+                rflags |= 0x400                          # sync samples past the first: flags per sample
+            elif syncs:
+                rflags |= 0x04
+                first = _RX_SYNC
+        if cto is not None:
+            rflags |= 0x800
+            ver = 1 if min(cto[i:j]) < 0 else 0
+        rec = []
+        for k in range(i, j):
+            if rflags & 0x100:
+                rec.append(dts[k + 1] - dts[k])
+            if rflags & 0x200:
+                rec.append(sizes[k])
+            if rflags & 0x400:
+                rec.append(_RX_SYNC if keys is None or k in keys else _RX_NONSYNC)
+            if rflags & 0x800:
+                rec.append(cto[k] & 0xFFFFFFFF)
+        at = len(head) + 8 + len(body) + 16            # where data_offset lands, from the traf's start
+        body += struct.pack(">I4sIIi", 20 + (4 if first is not None else 0) + 4 * len(rec), b"trun",
+                            ver << 24 | rflags, j - i, 0)
+        if first is not None:
+            body += struct.pack(">I", first)
+        body += struct.pack(">%dI" % len(rec), *rec)
+        slices.append((offs[i], offs[j - 1] + sizes[j - 1] - offs[i], at))
+        i = j
+    return struct.pack(">I4s", 8 + len(head) + len(body), b"traf") + head + body, slices
+
+
+def _build_remux(fpath, size):
+    """remux_view's (fragment table, view) of the file, uncached; None for a fragmented one."""
+    fd = os.open(fpath, os.O_RDONLY)
+    try:
+        boxes = _top_boxes(fd, size)
+        if not boxes or any(b[0] == b"moof" for b in boxes):
+            return None                                # not an MP4 we know, or fragmented already
+        ftyp = next((b for b in boxes if b[0] == b"ftyp"), None)
+        mv = next((b for b in boxes if b[0] == b"moov"), None)
+        if mv is None:
+            return None
+        head = os.pread(fd, ftyp[2], ftyp[1]) if ftyp else b""
+        moov = os.pread(fd, mv[2], mv[1])
+    finally:
+        os.close(fd)
+    tracks, _sig = _tracks(moov)
+    trak = _video_track(tracks)
+    if trak is None or not trak[1]:
+        return None
+    vid, vscale = trak[0], trak[1]
+    smps = {}
+    for tid, (scale, _kind, _trex, stbl) in tracks.items():
+        smp = _samples(moov, stbl) if stbl and scale else None
+        if smp is None:
+            return None
+        if len(smp["off"]):
+            smps[tid] = smp
+    if vid not in smps:
+        return None
+    order = [vid] + sorted(t for t in smps if t != vid)
+    vs = smps[vid]
+    cuts = []                                          # video dts each fragment starts at (after the first)
+    for i in (vs["sync"] if vs["sync"] is not None else range(len(vs["off"]))):
+        t = vs["dts"][i]
+        if t > 0 and (not cuts or t - cuts[-1] >= vscale):
+            cuts.append(t)
+    bounds = {}                                        # track -> sample index each fragment starts at
+    for tid in order:
+        sc, dts, n = tracks[tid][0], smps[tid]["dts"], len(smps[tid]["off"])
+        bounds[tid] = [0] + [bisect.bisect_left(dts, c * sc / vscale, 0, n) for c in cuts] + [n]
+    init = _rx_moov(moov, order)
+    sig = _tracks(init)[1]
+    view, pos = [head, init], len(head) + len(init)
+    moofs, sizes = array("Q"), array("L")
+    vmoof, vdts, vsync = array("L"), array("Q"), array("q")
+    for j in range(len(cuts) + 1):
+        trafs, slices = [], []
+        at = 24                                        # mfhd + moof header come first
+        for tid in order:
+            a, b = bounds[tid][j], bounds[tid][j + 1]
+            if a >= b:
+                continue
+            traf, sl = _rx_traf(tid, smps[tid], a, b, tid == vid)
+            trafs.append(traf)
+            slices += [(off, n, at + k) for off, n, k in sl]
+            at += len(traf)
+            if tid == vid:
+                sync = vs["sync"]
+                k = a if sync is None else next(iter(sync[bisect.bisect_left(sync, a):bisect.bisect_left(sync, b)]), -1)
+                vmoof.append(len(moofs))
+                vdts.append(vs["dts"][a])
+                vsync.append(vs["dts"][k] if k >= 0 else -1)
+        if not trafs:
+            continue
+        moof = bytearray(struct.pack(">I4sI4sII", at, b"moof", 16, b"mfhd", 0, len(moofs) + 1) + b"".join(trafs))
+        slices.sort()
+        payload, parts = 0, []
+        for off, n, k in slices:                       # in file order, neighbours merged: few, long sendfiles
+            struct.pack_into(">i", moof, k, len(moof) + 8 + payload)
+            payload += n
+            if parts and parts[-1][0] + parts[-1][1] == off:
+                parts[-1] = (parts[-1][0], parts[-1][1] + n)
+            else:
+                parts.append((off, n))
+        moofs.append(pos)
+        sizes.append(len(moof))
+        view += [bytes(moof), struct.pack(">I4s", 8 + payload, b"mdat")] + parts
+        pos += len(moof) + 8 + payload
+    if not vmoof:
+        return None
+    fr = {"run": (len(head) + len(init), pos), "moofs": moofs, "sizes": sizes, "grow": None,
+          "vmoof": vmoof, "vdts": vdts, "vsync": vsync, "t0": {t: 0 for t in order},
+          "t1": {t: smps[t]["dts"][-1] for t in order}, "scales": {t: tracks[t][0] for t in order},
+          "vid": vid, "sig": sig}
+    return fr, view
+
+
+def remux_view(fpath, st):
+    """(fragment table, view) of a finished sample-table segment's fragmented form, or None (not
+    one, or not remuxable). The view is pieces (bytes, or (offset, length) slices of the file) like
+    faststart_view's: ftyp, the init moov, then moof / mdat header / payload slices per fragment.
+    The table is _frag_table's, with offsets into the view and the init's decoder signature ("sig")."""
+    key = (fpath, st.st_size, st.st_mtime_ns)
+    with _fs_lock:
+        if key in _rx_views:
+            got = _rx_views[key] = _rx_views.pop(key)
+            return got
+    try:
+        got = _build_remux(fpath, st.st_size)
+    except (OSError, struct.error, IndexError, ValueError):
+        got = None
+    with _fs_lock:
+        _rx_views[key] = got
+        while len(_rx_views) > REMUX_CACHE:
+            del _rx_views[next(iter(_rx_views))]
+        _rx_cache[key] = got and got[0]
+        while len(_rx_cache) > KEYFRAME_CACHE:
+            del _rx_cache[next(iter(_rx_cache))]
+    return got
+
+
+def remux_index(fpath, st):
+    """remux_view's fragment table alone (kept for as many files as keyframe indexes are)."""
+    key = (fpath, st.st_size, st.st_mtime_ns)
+    with _fs_lock:
+        if key in _rx_cache:
+            fr = _rx_cache[key] = _rx_cache.pop(key)
+            return fr
+    got = remux_view(fpath, st)
+    return got and got[0]
+
+
+def stream_index(fpath, st):
+    """(fragment table, remuxed) of a finished segment as a day stream / HLS playlist addresses it:
+    a fragmented MP4 as stored, a sample-table one in its remuxed form; None if neither works."""
+    kf = keyframe_index(fpath, st)
+    if not kf:
+        return None
+    if kf["frags"]:
+        return dict(kf["frags"], sig=kf["sig"]), False
+    fr = remux_index(fpath, st)
+    return (fr, True) if fr else None
+
+
+def _indexed(fpath, st):
+    """Whether stream_index() for this file is answered from memory (nothing to parse)."""
+    key = (fpath, st.st_size, st.st_mtime_ns)
+    with _fs_lock:
+        kf = _kf_cache.get(key, False)
+        return kf is not False and (not kf or kf["frags"] is not None or key in _rx_cache)
+
+
+# --------------------------------------------------------------------------- #
+# Day streams. /video/day?cam=&date= serves a day's finished segments as ONE fragmented MP4: the
+# first segment's ftyp + moov (durations set to the day's) and a sidx indexing every fragment, then
+# each segment's moof/mdat run as stored, back to back. Only the moofs are rewritten, on the way
+# out (tfdt shifted so the timeline runs on without the gaps between files); the mdat payloads go
+# out as slices of the segment files (sendfile). Playback crosses segment boundaries without the
+# <video> element reloading. A sample-table segment joins in its remuxed form (see remux_view).
+# Segments must share one decoder setup (the init's signature); the stream ends before the first
+# that doesn't. /api/daymap says where each segment sits in it.
+# --------------------------------------------------------------------------- #
+_day_cache = {}     # (cam dir, date, last file) -> (files tuple, day); insertion order = age
+_day_queued = set()  # keys of day streams / HLS playlists whose segments are being indexed on a lane
+
+
+def _moof_patch(moof, shift, disp):
+    """A moof rewritten for a day stream: each traf's tfdt moved by shift[track_id] ticks (widened to
+    64 bits), an explicit tfhd base_data_offset moved by `disp` (how far the bytes after this moof
+    moved), and moof-relative trun data offsets moved past whatever the moof grew by."""
+    grow = _moof_growth(moof)
+    out = bytearray(struct.pack(">I4s", len(moof) + grow, b"moof"))
+    first = True
+    for t, b, hdr, size in _box_iter(moof, 8, len(moof)):
+        if t != b"traf":
+            out += moof[b:b + size]
+            continue
+        body, track_id, flags = bytearray(), None, 0
+        for ct, cb, chdr, csize in _box_iter(moof, b + hdr, b + size):
+            box = bytearray(moof[cb:cb + csize])
+            if ct == b"tfhd":
+                flags = struct.unpack_from(">I", box, chdr)[0] & 0xFFFFFF
+                track_id = struct.unpack_from(">I", box, chdr + 4)[0]
+                if flags & 0x01:
+                    struct.pack_into(">Q", box, chdr + 8, struct.unpack_from(">Q", box, chdr + 8)[0] + disp)
+            elif ct == b"tfdt":
+                vf = struct.unpack_from(">I", box, chdr)[0]
+                t0 = struct.unpack_from(">Q" if vf >> 24 == 1 else ">I", box, chdr + 4)[0]
+                box = struct.pack(">I4sIQ", 20, b"tfdt", 0x01000000 | (vf & 0xFFFFFF),
+                                  max(0, t0 + shift.get(track_id, 0)))
+            elif ct == b"trun" and grow and not flags & 0x01 and (first or flags & 0x20000):
+                if struct.unpack_from(">I", box, chdr)[0] & 0x01:        # data_offset present
+                    struct.pack_into(">i", box, chdr + 8, struct.unpack_from(">i", box, chdr + 8)[0] + grow)
+            body += box
+        out += struct.pack(">I4s", 8 + len(body), b"traf") + body
+        first = False
+    return bytes(out)
+
+
+def _set_durations(moov, sec):
+    """Sets the movie, track and media durations in a moov (bytearray) to `sec` seconds, and the
+    mvex fragment duration if there is one (0 = unknown where a 32-bit field can't hold it)."""
+    m = _child(moov, 0, len(moov), b"moov")
+    mv = m and _child(moov, m[0] + m[1], m[0] + m[2], b"mvhd")
+    if not mv:
+        return
+    scale = struct.unpack_from(">I", moov, mv[0] + mv[1] + (20 if moov[mv[0] + mv[1]] == 1 else 12))[0]
+
+    def put(at, v1, ticks):
+        struct.pack_into(">Q" if v1 else ">I", moov, at, ticks if v1 or ticks <= 0xFFFFFFFF else 0)
+
+    def walk(pos, end):
+        for t, b, hdr, size in _box_iter(moov, pos, end):
+            at = b + hdr
+            v1 = moov[at] == 1
+            if t in (b"trak", b"mdia", b"mvex"):
+                walk(at, b + size)
+            elif t == b"mvhd":
+                put(at + (24 if v1 else 16), v1, round(sec * scale))
+            elif t == b"tkhd":
+                put(at + (28 if v1 else 20), v1, round(sec * scale))
+            elif t == b"mehd":
+                put(at + 4, v1, round(sec * scale))
+            elif t == b"mdhd":
+                put(at + (24 if v1 else 16), v1, round(sec * struct.unpack_from(">I", moov, at + (20 if v1 else 12))[0]))
+
+    walk(m[0] + m[1], m[0] + m[2])
+
+
+def _sidx(track_id, scale, refs, size, end_dts):
+    """A sidx over a day stream's fragments: refs = [(offset from the first moof, video dts, starts
+    with a sync sample)], one per fragment that starts video; `size` = bytes after the sidx. It lets
+    the browser's demuxer seek anywhere in the day with one Range request (no moof-by-moof walk)."""
+    step = -(-len(refs) // 0xFFFF)                # reference_count is 16 bits: merge neighbours
+    refs = refs[::step]
+    out = bytearray(struct.pack(">I4sIIIQQHH", 0, b"sidx", 0x01000000, track_id, scale, refs[0][1], 0, 0, len(refs)))
+    for k, (off, dts, sap) in enumerate(refs):
+        nxt = refs[k + 1] if k + 1 < len(refs) else (size, end_dts)
+        out += struct.pack(">III", (nxt[0] - off) & 0x7FFFFFFF, max(0, nxt[1] - dts), 0x90000000 if sap else 0)
+    struct.pack_into(">I", out, 0, len(out))
+    return bytes(out)
+
+
+class _DayRun:
+    """One segment's fragments inside a day stream (a view piece of `size` bytes at stream offset
+    `at`): its moof/mdat run as stored, every moof rewritten on the way out."""
+    __slots__ = ("path", "at", "fr", "shift", "size")
+
+    def __init__(self, path, at, fr, shift):
+        self.path, self.at, self.fr, self.shift = path, at, fr, shift
+        self.size = fr["run"][1] - fr["run"][0] + (sum(fr["grow"]) if fr["grow"] else 0)
+
+    def pieces(self, start, length):
+        """Bytes [start, start+length) of the run as body pieces: rewritten moofs (bytes) and the
+        mdat between them as (offset, length, path) slices of the segment file."""
+        fr = self.fr
+        moofs, sizes, grow = fr["moofs"], fr["sizes"], fr["grow"]
+        rs, re_ = fr["run"]
+        stop = start + length
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            g = 0
+            for i, off in enumerate(moofs):
+                gi = grow[i] if grow else 0
+                mv = off - rs + g                          # this moof, as served (run-relative)
+                me = mv + sizes[i] + gi
+                ve = (moofs[i + 1] if i + 1 < len(moofs) else re_) - rs + g + gi   # end of what follows it
+                g += gi
+                if ve <= start:
+                    continue
+                if mv >= stop:
+                    break
+                if start < me:
+                    buf = os.pread(fd, sizes[i], off)
+                    if len(buf) < sizes[i]:
+                        raise OSError("%s shrank" % self.path)
+                    buf = _moof_patch(buf, self.shift, self.at + me - off - sizes[i])
+                    yield buf[max(start, mv) - mv:min(stop, me) - mv]
+                a, b = max(start, me), min(stop, ve)
+                if a < b:
+                    yield off + sizes[i] + a - me, b - a, self.path
+        finally:
+            os.close(fd)
+
+
+class _RemuxRun(_DayRun):
+    """A sample-table segment's fragments inside a day stream: the run part of its remuxed view
+    (see remux_view), the generated moofs rewritten like stored ones on the way out."""
+    __slots__ = ("st",)
+
+    def __init__(self, path, at, fr, shift, st):
+        super().__init__(path, at, fr, shift)
+        self.st = st
+
+    def pieces(self, start, length):
+        got = remux_view(self.path, self.st)
+        if got is None or got[0]["run"] != self.fr["run"]:
+            raise OSError("%s changed" % self.path)
+        begin = self.fr["run"][0] + start
+        pos, stop = 0, begin + length
+        for p in got[1]:
+            n = _piece_len(p)
+            a, b = max(begin, pos), min(stop, pos + n)
+            if a < b:
+                if not isinstance(p, bytes):
+                    yield p[0] + a - pos, b - a, self.path
+                elif p[4:8] == b"moof":
+                    yield _moof_patch(p, self.shift, 0)[a - pos:b - pos]
+                else:
+                    yield p[a - pos:b - pos]
+            pos += n
+            if pos >= stop:
+                break
+
+
+def _build_day(d, files, deadline=None):
+    """Lays out the day stream over `files` (segment names in d, in order); stops at the first one
+    that can't join, or, past `deadline` (monotonic), before the first one not parsed yet.
+    {"view", "size", "etag", "mtime", "duration", "segments": [(file, start second, duration)],
+    "upto": last file, "pending": stopped by the deadline}, or None if not even the first joins."""
+    runs, segs, refs, tags = [], [], [], []
+    first, cum, pos, mtime, pending = None, 0.0, 0, 0.0, False
+    end_dts = 0
+    for name in files:
+        path = os.path.join(d, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            break
+        if runs and deadline is not None and time.monotonic() > deadline and not _indexed(path, st):
+            pending = True
+            break
+        got = stream_index(path, st)
+        if not got or (first and got[0]["sig"] != first[1]["sig"]):
+            break
+        fr, rx = got
+        if first is None:
+            first = (path, fr, rx, st)
+        scales, vid = fr["scales"], fr["vid"]
+        f0 = min(fr["t0"][k] / scales[k] for k in fr["t0"])      # the segment's own start/end
+        f1 = max(fr["t1"][k] / scales[k] for k in fr["t1"])
+        shift = {k: round((cum - f0) * sc) for k, sc in scales.items()}   # onto the day's timeline
+        rs = fr["run"][0]
+        gpre = list(itertools.accumulate(fr["grow"], initial=0)) if fr["grow"] else None
+        for j, i in enumerate(fr["vmoof"]):
+            refs.append((pos + fr["moofs"][i] - rs + (gpre[i] if gpre else 0),
+                         fr["vdts"][j] + shift[vid], fr["vsync"][j] == fr["vdts"][j]))
+        run = _RemuxRun(path, pos, fr, shift, st) if rx else _DayRun(path, pos, fr, shift)
+        runs.append(run)
+        segs.append((name, cum, f1 - f0))
+        tags.append("%s:%x:%x" % (name, st.st_size, st.st_mtime_ns))
+        mtime = max(mtime, st.st_mtime)
+        end_dts = fr["t1"][vid] + shift[vid]
+        pos += run.size
+        cum += f1 - f0
+    if first is None:
+        return None
+    path, fr, rx, st = first
+    if rx:                                         # the remuxed view starts with ftyp + the init moov
+        got = remux_view(path, st)
+        if got is None:
+            return None
+        head, moov = got[1][0], bytearray(got[1][1])
+    else:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            boxes = _top_boxes(fd, os.fstat(fd).st_size) or []
+            ftyp = next((b for b in boxes if b[0] == b"ftyp"), None)
+            mv = next((b for b in boxes if b[0] == b"moov"), None)
+            if mv is None:
+                return None
+            head = os.pread(fd, ftyp[2], ftyp[1]) if ftyp else b""
+            moov = bytearray(os.pread(fd, mv[2], mv[1]))
+        finally:
+            os.close(fd)
+    _set_durations(moov, cum)
+    vid = fr["vid"]
+    if refs[0][0]:                                 # the first fragment carries no video
+        refs.insert(0, (0, refs[0][1], False))
+    init = head + bytes(moov) + _sidx(vid, fr["scales"][vid], refs, pos, end_dts)
+    for run in runs:
+        run.at += len(init)                         # run offsets were counted from the first moof
+    size = len(init) + pos
+    return {"view": [init] + runs, "size": size, "mtime": mtime, "duration": cum, "segments": segs,
+            "etag": '"%08x-%x"' % (binascii.crc32("|".join(tags).encode("utf-8")), size),
+            "upto": segs[-1][0], "pending": pending}
+
+
+def _day_files(cam, date_str):
+    """(camera dir, names of its finished segments overlapping the day, in start order)."""
+    d = cam_dir(cam)
+    if not d:
+        return None, []
+    out = []
+    for sg in segs_for_day(scan(cam), date_str):
+        pr = _parse_secs(sg["file"])
+        if pr and pr[1] > pr[0] and not sg["live"]:
+            out.append(sg["file"])
+    return d, out
+
+
+def day_stream(cam, date_str, upto=None, budget=None):
+    """The day stream of camera `cam` on `date_str` through segment `upto` (default: every finished
+    one), cached per (camera, day, last segment) while the segment list under it is unchanged.
+    `budget` caps the seconds spent parsing segments nobody indexed yet: the stream then stops short
+    ("pending") and the rest is indexed on the camera's lane. None if there is nothing to serve."""
+    d, files = _day_files(cam, date_str)
+    if upto is not None:
+        if upto not in files:
+            return None
+        files = files[:files.index(upto) + 1]
+    if not files:
+        return None
+    files = tuple(files)
+    key = (d, date_str, files[-1])
+    with _fs_lock:
+        hit = _day_cache.get(key)
+        if hit and hit[0] == files:
+            _day_cache[key] = _day_cache.pop(key)
+            return hit[1]
+    day = _build_day(d, files, time.monotonic() + budget if budget is not None else None)
+    if day is None:
+        return None
+    done = files[:len(day["segments"])]
+    with _fs_lock:
+        _day_cache[(d, date_str, done[-1])] = (done, day)
+        while len(_day_cache) > DAY_CACHE:
+            del _day_cache[next(iter(_day_cache))]
+    if day["pending"]:
+        _queue_once(cam, key, lambda: day_stream(cam, date_str, files[-1]))
+    return day
+
+
+def _queue_once(cam, key, fn):
+    """Runs fn() on camera `cam`'s lane unless a job under `key` is already queued or running."""
+    with _fs_lock:
+        if key in _day_queued:
+            return
+        _day_queued.add(key)
+    c = registry().get(cam)
+
+    def job():
+        try:
+            fn()
+        finally:
+            with _fs_lock:
+                _day_queued.discard(key)
+    if c:
+        _LANES.submit(c["root"], job)
+    else:
+        with _fs_lock:
+            _day_queued.discard(key)
+
+
+def daymap_body(cam, date_str):
+    """(body, etag, cache_control) for /api/daymap: the day stream's URL and where each segment sits
+    in it ([file, start second, duration]); "pending" = more segments are still being indexed (ask
+    again later). No finished segment that day that can start one: url null, no segments."""
+    day = day_stream(cam, date_str, budget=DAY_BUILD_BUDGET)
+    obj = {"date": date_str, "url": None, "duration": 0, "pending": False, "segments": []}
+    if day:
+        obj.update(url="/video/day?" + urlencode({"cam": cam, "date": date_str, "upto": day["upto"]}),
+                   duration=round(day["duration"], 3), pending=day["pending"],
+                   segments=[[f, round(at, 3), round(dur, 3)] for f, at, dur in day["segments"]])
+    body = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    return body, '"%08x-%x"' % (binascii.crc32(body), len(body)), "no-cache"
+
+
+# --------------------------------------------------------------------------- #
+# HLS. /hls/<cam>/<date>.m3u8 is a playlist of a day's finished fragmented segments, each split at
+# keyframe fragments into ~HLS_SEGMENT-second EXT-X-BYTERANGE sub-segments of the file as stored
+# (segment URIs are relative: /hls/<cam>/<file>.mp4 is the same bytes as /video, Range and all).
+# No transcoding, no copies: the init section is the file's own ftyp + moov, and each file opens
+# with EXT-X-DISCONTINUITY (its timestamps restart) and EXT-X-PROGRAM-DATE-TIME (its wall-clock
+# start, from the name). A sample-table MP4 is addressed in its remuxed form (see remux_view),
+# which /hls/ serves for it in place of the file as stored.
+# --------------------------------------------------------------------------- #
+_hls_cache = {}     # (cam dir, date) -> ((files tuple, live), (body, etag, cache_control)); insertion order = age
+
+
+def _hls_parts(fr):
+    """[(byte offset, length, seconds)] of a segment's HLS sub-segments (`fr`: its stream_index
+    table): its fragment run cut before fragments that open on a video sync sample, at least
+    HLS_SEGMENT seconds apart."""
+    vid = fr["vid"]
+    scale = fr["scales"][vid]
+    cuts = [(fr["run"][0], fr["vdts"][0])]
+    for j, i in enumerate(fr["vmoof"]):
+        if fr["vsync"][j] == fr["vdts"][j] and fr["moofs"][i] > cuts[0][0]:
+            cuts.append((fr["moofs"][i], fr["vdts"][j]))
+    cuts.append((fr["run"][1], fr["t1"][vid]))
+    out, a = [], cuts[0]
+    for k, b in enumerate(cuts[1:], 2):
+        if b[1] - a[1] >= HLS_SEGMENT * scale or k == len(cuts):
+            out.append((a[0], b[0] - a[0], (b[1] - a[1]) / scale))
+            a = b
+    return out
+
+
+def _hls_date(sec):
+    """Wall-clock seconds -> an EXT-X-PROGRAM-DATE-TIME value, in the server's local zone."""
+    off = time.localtime(time.mktime(time.gmtime(sec)[:8] + (-1,))).tm_gmtoff
+    return "%s.000%s%02d:%02d" % (_iso(sec), "-" if off < 0 else "+", abs(off) // 3600, abs(off) % 3600 // 60)
+
+
+def hls_playlist(cam, date_str):
+    """(body, etag, cache_control) for /hls/<cam>/<date>.m3u8, or None (404: no such camera, or no
+    recording that day it can play, none being recorded and none still to index). A day that is
+    over, fully indexed and not being recorded into is a VOD playlist (EXT-X-ENDLIST); otherwise an
+    EVENT playlist the client reloads: new clips get appended as they finish, and segments nobody
+    indexed yet (past DAY_BUILD_BUDGET) are parsed on the camera's lane meanwhile."""
+    d = cam_dir(cam)
+    try:
+        day0 = _to_sec(datetime.datetime.combine(datetime.date.fromisoformat(date_str), datetime.time.min))
+    except ValueError:
+        return None
+    if not d:
+        return None
+    files, live = [], False
+    for sg in segs_for_day(scan(cam), date_str):
+        pr = _parse_secs(sg["file"])
+        if sg["live"] or not pr or pr[1] <= pr[0]:
+            live = True
+        else:
+            files.append(sg["file"])
+    if not files and not live:
+        return None
+    key = (d, date_str)
+    state = (tuple(files), live)
+    with _fs_lock:
+        hit = _hls_cache.get(key)
+        if hit and hit[0] == state:
+            _hls_cache[key] = _hls_cache.pop(key)
+            return hit[1]
+    deadline = time.monotonic() + DAY_BUILD_BUDGET
+    out, top, rest = [], 0.0, []
+    for k, name in enumerate(files):
+        path = os.path.join(d, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if time.monotonic() > deadline and not _indexed(path, st):
+            rest = files[k:]
+            break
+        got = stream_index(path, st)
+        if not got:
+            continue
+        fr = got[0]
+        if out:
+            out.append("#EXT-X-DISCONTINUITY")
+        out += ["#EXT-X-PROGRAM-DATE-TIME:%s" % _hls_date(_parse_secs(name)[0]),
+                '#EXT-X-MAP:URI="%s",BYTERANGE="%d@0"' % (name, fr["run"][0])]
+        for n, (off, length, dur) in enumerate(_hls_parts(fr)):
+            top = max(top, dur)
+            out += ["#EXTINF:%.3f," % dur, "#EXT-X-BYTERANGE:%d%s" % (length, "" if n else "@%d" % off), name]
+    if not out and not rest and not live:
+        return None                                # nothing it can play, and nothing more coming
+    ended = not rest and not live and day0 + 86400 <= _to_sec(datetime.datetime.now())
+    # EXT-X-TARGETDURATION may not change while an EVENT playlist grows: leave room for long GOPs
+    head = ["#EXTM3U", "#EXT-X-VERSION:7", "#EXT-X-INDEPENDENT-SEGMENTS",
+            "#EXT-X-TARGETDURATION:%d" % max(int(top + 0.999), 2 * int(HLS_SEGMENT)),
+            "#EXT-X-MEDIA-SEQUENCE:0", "#EXT-X-PLAYLIST-TYPE:%s" % ("VOD" if ended else "EVENT")]
+    body = "\n".join(head + out + (["#EXT-X-ENDLIST"] if ended else [])).encode("utf-8") + b"\n"
+    ent = (body, '"%08x-%x"' % (binascii.crc32(body), len(body)), "no-cache")
+    if rest:
+        _queue_once(cam, ("hls",) + key, lambda: [prebuild(os.path.join(d, f)) for f in rest])
+        return ent
+    with _fs_lock:
+        _hls_cache[key] = (state, ent)
+        while len(_hls_cache) > DAY_CACHE:
+            del _hls_cache[next(iter(_hls_cache))]
+    return ent
+
+
+def _hls_path(path):
+    """(cam, name) of an /hls/<cam>/<name> path, or None."""
+    parts = path.split("/")
+    if len(parts) != 4 or parts[1] != "hls" or not parts[3]:
+        return None
+    return unquote(parts[2]), parts[3]
+
+
+# --------------------------------------------------------------------------- #
+# Thumbnails. /api/thumbs?cam=&date= describes one JPEG sprite sheet per camera-day: 24 rows (hours)
+# of 3600/THUMB_EVERY tiles, tile k showing the recording around second k*THUMB_EVERY of the day.
+# Tiles come from ffmpeg (one keyframe each, one run per segment for all its tiles, decoded at low
+# priority on a small bounded pool; a fragmented segment feeds it just init + the fragments those
+# keyframes open, a sample-table one is opened once per tile, each seeked) and are kept per segment on disk
+# (THUMB_DIR/<camera folder>/<date>/<segment>.tiles), the sheet is tiled from them by ffmpeg too.
+# Without ffmpeg (or a writable THUMB_DIR) the endpoint says so and the page hovers without them.
+# --------------------------------------------------------------------------- #
+_thumb_queued = set()     # keys of queued/running thumbnail jobs
+_thumb_q = queue.Queue()
+_thumb_started = []
+_thumb_blank = []         # the black tile for slots with no recording, made once
+_THUMB_NICE = ((["nice", "-n", "19"] if shutil.which("nice") else [])   # (not preexec_fn: unsafe with threads)
+               + (["ionice", "-c", "3"] if shutil.which("ionice") else []))
+_THUMB_VF = "scale=%d:%d:force_original_aspect_ratio=decrease,pad=%d:%d:-1:-1" % (THUMB_W, THUMB_H, THUMB_W, THUMB_H)
+
+
+def _thumb_submit(key, fn):
+    """Queues fn() on the thumbnail pool unless a job under `key` is already waiting or running."""
+    with _fs_lock:
+        if key in _thumb_queued:
+            return
+        _thumb_queued.add(key)
+        if not _thumb_started:
+            for i in range(THUMB_WORKERS):
+                threading.Thread(target=_thumb_worker, name="thumbs:%d" % i, daemon=True).start()
+            _thumb_started.append(True)
+    _thumb_q.put((key, fn))
+
+
+def _thumb_worker():
+    while True:
+        key, fn = _thumb_q.get()
+        try:
+            fn()
+        except Exception:  # noqa: BLE001  (a failed job just leaves its tiles/sheet missing)
+            pass
+        finally:
+            with _fs_lock:
+                _thumb_queued.discard(key)
+
+
+def _ffmpeg(args, data=None):
+    """Runs ffmpeg at the lowest CPU (and, where ionice exists, I/O) priority; its stdout, or None."""
+    try:
+        r = subprocess.run(_THUMB_NICE + [FFMPEG, "-nostats", "-loglevel", "error"] + args, input=data,
+                           stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=THUMB_TIMEOUT)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return r.stdout if r.returncode == 0 and r.stdout else None
+
+
+def _thumb_slots(s, e, day0):
+    """{slot: (seconds of [s, e) inside it, second into the segment to show)} for the slots of the
+    day starting at wall-clock `day0` that a segment spanning [s, e) overlaps."""
+    out = {}
+    for k in range(max(0, (s - day0) // THUMB_EVERY), min(86400 // THUMB_EVERY, -(-(e - day0) // THUMB_EVERY))):
+        lo = day0 + k * THUMB_EVERY
+        ov = min(e, lo + THUMB_EVERY) - max(s, lo)
+        if ov > 0:
+            out[k] = (ov, min(max(lo + THUMB_EVERY // 2, s), e - 1) - s)
+    return out
+
+
+def _thumb_grab(path, kf, t):
+    """A THUMB_W x THUMB_H JPEG of the keyframe at/before `t` seconds into segment `path`, or None."""
+    vf = ["-an", "-frames:v", "1", "-vf", _THUMB_VF, "-q:v", "6", "-f", "mjpeg", "pipe:1"]
+    if not kf or kf["init"] is None:          # sample-table MP4: ffmpeg seeks it through its moov
+        return _ffmpeg(["-skip_frame", "nokey", "-noaccurate_seek", "-ss", "%.3f" % t, "-i", path] + vf)
+    fr = kf["frags"]
+    off = keyframe_at(kf, t)[1]
+    i = bisect.bisect_left(fr["moofs"], off)
+    end = fr["moofs"][i + 1] if i + 1 < len(fr["moofs"]) else fr["run"][1]
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        init = os.pread(fd, kf["init"], 0)
+        moof = os.pread(fd, fr["sizes"][i], off)
+        rest = os.pread(fd, end - off - fr["sizes"][i], off + fr["sizes"][i])
+    finally:
+        os.close(fd)
+    moof = _moof_patch(moof, {}, len(init) + _moof_growth(moof) - off)   # explicit base offsets: now after init
+    return _ffmpeg(["-skip_frame", "nokey", "-f", "mp4", "-i", "pipe:0"] + vf, init + moof + rest)
+
+
+def _thumb_grabs(path, kf, ts):
+    """_thumb_grab for each of the times `ts` in one ffmpeg run: [JPEG or None] in their order (a
+    keyframe several of them land on is decoded once). A fragmented segment feeds init + the
+    fragments the keyframes open, back to back, and keeps each one's first decoded keyframe; a
+    sample-table one is opened once per keyframe, each seeked through its moov and cut to its first
+    frame. A run whose frame count doesn't add up gives all Nones (then grab them one by one)."""
+    def key(t):                                   # the keyframe t lands on (unindexed: t itself)
+        return keyframe_at(kf, t)[1] if kf else t
+    keys = sorted({key(t) for t in ts})
+    if kf and kf["init"] is not None:
+        fr = kf["frags"]
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            init = os.pread(fd, kf["init"], 0)
+            tracks = _tracks(init)[0]
+            feed, pos, firsts, n = [init], len(init), [], 0
+            for off in keys:
+                i = bisect.bisect_left(fr["moofs"], off)
+                end = fr["moofs"][i + 1] if i + 1 < len(fr["moofs"]) else fr["run"][1]
+                moof = os.pread(fd, fr["sizes"][i], off)
+                rest = os.pread(fd, end - off - fr["sizes"][i], off + fr["sizes"][i])
+                firsts.append(n)                  # decoded keyframes (skip_frame) before this fragment's
+                for t, b, hdr, size in _box_iter(moof, 8, len(moof)):
+                    r = _traf_times(moof, b + hdr, b + size, tracks, {}) if t == b"traf" else None
+                    n += r[3] if r and r[0] == fr["vid"] else 0
+                moof = _moof_patch(moof, {}, pos + _moof_growth(moof) - off)   # explicit base offsets: now at pos
+                feed += [moof, rest]
+                pos += len(moof) + len(rest)
+        finally:
+            os.close(fd)
+        pick = "select='%s'," % "+".join("eq(n,%d)" % k for k in firsts)
+        out = _ffmpeg(["-skip_frame", "nokey", "-f", "mp4", "-i", "pipe:0", "-an", "-vf", pick + _THUMB_VF,
+                       "-vsync", "0", "-q:v", "6", "-f", "mjpeg", "pipe:1"], b"".join(feed))
+    else:
+        at = {}                                   # keyframe -> a time that lands on it
+        for t in ts:
+            at.setdefault(key(t), t)
+        args, graph = [], []
+        for i, k in enumerate(keys):              # -t: read no further than the frame it keeps
+            args += ["-skip_frame", "nokey", "-noaccurate_seek", "-ss", "%.3f" % at[k], "-t", "1", "-i", path]
+            graph.append("[%d:v:0]trim=end_frame=1,setpts=PTS-STARTPTS[v%d]" % (i, i))
+        graph = ";".join(graph) + ";%sconcat=n=%d:v=1:a=0,setpts=N,%s" % (   # (one-frame parts: renumber)
+            "".join("[v%d]" % i for i in range(len(keys))), len(keys), _THUMB_VF)
+        out = _ffmpeg(args + ["-filter_complex", graph, "-an", "-vsync", "0", "-q:v", "6", "-f", "mjpeg", "pipe:1"])
+    jpgs = _split_jpegs(out or b"")
+    if len(jpgs) != len(keys):
+        return [None] * len(ts)
+    got = dict(zip(keys, jpgs))
+    return [got[key(t)] for t in ts]
+
+
+def _split_jpegs(data):
+    """The images of a concatenated MJPEG stream, each cut at its EOI marker (searched for past its
+    header segments: entropy-coded data escapes every 0xFF, so the first FF D9 there is the end)."""
+    out, pos = [], 0
+    while data.startswith(b"\xff\xd8", pos):
+        i = pos + 2
+        while i + 4 <= len(data) and data[i] == 0xFF and data[i + 1] != 0xDA:   # header segments up to SOS
+            i += 2 + struct.unpack_from(">H", data, i + 2)[0]
+        end = data.find(b"\xff\xd9", i)
+        if end < 0:
+            break
+        out.append(data[pos:end + 2])
+        pos = end + 2
+    return out
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = "%s.%d.tmp" % (path, threading.get_ident())
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _thumb_tiles(d, date_str, day0, name):
+    """Extracts (once) the tiles of every slot segment `name` overlaps: <segment>.tiles, each tile
+    a 4-byte length + JPEG, in slot order; a frame ffmpeg can't produce becomes the blank tile."""
+    out = os.path.join(THUMB_DIR, os.path.basename(d), date_str, name + ".tiles")
+    if os.path.exists(out):
+        return
+    path = os.path.join(d, name)
+    st = os.stat(path)
+    pr = _parse_secs(name)
+    kf = keyframe_index(path, st)
+    ts = [t for _k, (_ov, t) in sorted(_thumb_slots(pr[0], pr[1], day0).items())]
+    buf = bytearray()
+    for i in range(0, len(ts), THUMB_BATCH):
+        for t, jpg in zip(ts[i:i + THUMB_BATCH], _thumb_grabs(path, kf, ts[i:i + THUMB_BATCH])):
+            jpg = jpg or _thumb_grab(path, kf, t) or _blank_tile()
+            buf += struct.pack(">I", len(jpg)) + jpg
+    _write_atomic(out, bytes(buf))
+
+
+def _read_tiles(path):
+    with open(path, "rb") as f:
+        buf = f.read()
+    out, pos = [], 0
+    while pos + 4 <= len(buf):
+        n = struct.unpack_from(">I", buf, pos)[0]
+        out.append(buf[pos + 4:pos + 4 + n])
+        pos += 4 + n
+    return out
+
+
+def _blank_tile():
+    if not _thumb_blank:
+        jpg = _ffmpeg(["-f", "lavfi", "-i", "color=c=black:s=%dx%d" % (THUMB_W, THUMB_H),
+                       "-frames:v", "1", "-q:v", "6", "-f", "mjpeg", "pipe:1"])
+        if not jpg:
+            raise OSError("ffmpeg can't make a blank tile")
+        _thumb_blank.append(jpg)
+    return _thumb_blank[0]
+
+
+def _thumb_sheet(d, date_str, day0, files):
+    """(Re)tiles the day sheet <date>.jpg from the segments' tile files it has, each slot taken from
+    the segment covering most of it; <date>.json records the slots filled and a tag of the inputs."""
+    base = os.path.join(THUMB_DIR, os.path.basename(d), date_str)
+    best, have = {}, []
+    for name in files:
+        tp = os.path.join(base, name + ".tiles")
+        if not os.path.exists(tp):
+            continue
+        pr = _parse_secs(name)
+        slots = _thumb_slots(pr[0], pr[1], day0)
+        have.append(name)
+        for j, (k, (ov, _t)) in enumerate(sorted(slots.items())):
+            if k not in best or ov > best[k][0]:
+                best[k] = (ov, tp, j)
+    tag = "%08x" % binascii.crc32("|".join(have).encode("utf-8"))
+    meta = _thumb_meta(d, date_str)
+    if not have or (meta and meta["tag"] == tag):
+        return
+    tiles, blank = {}, _blank_tile()
+    for tp in {v[1] for v in best.values()}:
+        tiles[tp] = _read_tiles(tp)
+    n = 86400 // THUMB_EVERY
+    feed = b"".join(tiles[best[k][1]][best[k][2]] if k in best and best[k][2] < len(tiles[best[k][1]])
+                    else blank for k in range(n))
+    jpg = _ffmpeg(["-f", "image2pipe", "-c:v", "mjpeg", "-i", "pipe:0", "-vf", "tile=%dx24" % (n // 24),
+                   "-frames:v", "1", "-q:v", "6", "-f", "mjpeg", "pipe:1"], feed)
+    if not jpg:
+        return
+    _write_atomic(base + ".jpg", jpg)
+    runs = []
+    for k in sorted(best):
+        if runs and runs[-1][1] == k:
+            runs[-1][1] = k + 1
+        else:
+            runs.append([k, k + 1])
+    _write_atomic(base + ".json", json.dumps({"tag": tag, "slots": runs}).encode("utf-8"))
+    _thumb_prune()
+
+
+def _thumb_meta(d, date_str):
+    try:
+        with open(os.path.join(THUMB_DIR, os.path.basename(d), date_str + ".json"), "rb") as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _thumb_prune():
+    """Holds the on-disk cache under THUMB_CACHE_MB: deletes the least recently written files."""
+    files, total = [], 0
+    for root, _dirs, names in os.walk(THUMB_DIR):
+        for n in names:
+            p = os.path.join(root, n)
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+            total += st.st_size
+    files.sort()
+    for _m, size, p in files:
+        if total <= THUMB_CACHE_MB << 20:
+            break
+        try:
+            os.unlink(p)
+            total -= size
+        except OSError:
+            pass
+
+
+def thumbs_body(cam, date_str):
+    """(body, etag, cache_control) for /api/thumbs, or None (404): {"enabled", "every", "w", "h",
+    "cols", "url" (the sheet, versioned; null until one exists), "slots": [[first, end)] tiles
+    filled, "pending": tiles still being extracted (ask again later)}. Asking queues the missing
+    work; enabled false = no ffmpeg / no cache dir, nothing will ever come."""
+    d = cam_dir(cam)
+    try:
+        day0 = _to_sec(datetime.datetime.combine(datetime.date.fromisoformat(date_str), datetime.time.min))
+    except ValueError:
+        return None
+    if not d:
+        return None
+    obj = {"enabled": False, "every": THUMB_EVERY, "w": THUMB_W, "h": THUMB_H, "cols": 3600 // THUMB_EVERY,
+           "url": None, "slots": [], "pending": False}
+    ok = bool(FFMPEG)
+    if ok:
+        try:
+            os.makedirs(THUMB_DIR, exist_ok=True)
+            ok = os.access(THUMB_DIR, os.W_OK)
+        except OSError:
+            ok = False
+    if ok:
+        _d, files = _day_files(cam, date_str)
+        base = os.path.join(THUMB_DIR, os.path.basename(d), date_str)
+        missing = [f for f in files if not os.path.exists(os.path.join(base, f + ".tiles"))]
+        for f in missing:
+            _thumb_submit(("tiles", d, date_str, f), lambda f=f: _thumb_tiles(d, date_str, day0, f))
+        meta = _thumb_meta(d, date_str)
+        tag = "%08x" % binascii.crc32("|".join(f for f in files if f not in missing).encode("utf-8"))
+        if files and (missing or not meta or meta["tag"] != tag):   # after the tiles (FIFO pool)
+            _thumb_submit(("sheet", d, date_str), lambda: _thumb_sheet(d, date_str, day0, files))
+        obj.update(enabled=True, pending=bool(files) and (bool(missing) or not meta or meta["tag"] != tag))
+        if meta:
+            obj.update(url="/api/thumbs?" + urlencode({"cam": cam, "date": date_str, "sheet": meta["tag"]}),
+                       slots=meta["slots"])
+    body = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    return body, '"%08x-%x"' % (binascii.crc32(body), len(body)), "no-cache"
+
+
+def thumb_sheet(cam, date_str, tag):
+    """The day sheet's JPEG bytes if its current tag is `tag` (the URL is versioned), else None."""
+    d = cam_dir(cam)
+    meta = _thumb_meta(d, date_str) if d and re.match(r"\d{4}-\d\d-\d\d$", date_str or "") else None
+    if not meta or meta["tag"] != tag:
+        return None
+    try:
+        with open(os.path.join(THUMB_DIR, os.path.basename(d), date_str + ".jpg"), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+# --------------------------------------------------------------------------- #
+# Stream scheduler: every video body (/video, /video/day, HLS segments; both server engines) sends
+# in SCHED_CHUNK grants from one pacer. A stream is capped at STREAM_RATE_X times its own media
+# bitrate, all of them together at GLOBAL_RATE; while that global budget is short, the stream whose
+# client has the least buffered (media seconds sent minus seconds elapsed) goes first, so a cell
+# prefilling after a big seek can't starve the cells about to stall. That ordering is opt-in: it
+# only runs under a global cap, and GLOBAL_RATE is 0 (none) unless --global-rate sets one.
+# /api/streams shows the rates.
+# --------------------------------------------------------------------------- #
+class _Stream:
+    __slots__ = ("id", "client", "what", "media", "cap", "t0", "sent", "tokens", "last", "waiting", "recent")
+
+    def __init__(self, sid, client, what, media):
+        self.id, self.client, self.what = sid, client, what
+        self.media = media or MEDIA_RATE_DEFAULT          # bytes per second of playback
+        self.cap = max(STREAM_RATE_MIN, self.media * STREAM_RATE_X) if STREAM_RATE_X else 0
+        self.t0 = self.last = time.monotonic()
+        self.sent, self.tokens, self.waiting = 0, 0.0, 0.0
+        self.recent = collections.deque()                 # (time, bytes) of the last RATE_WINDOW
+
+    def buffered(self, now):
+        """Seconds of media the client holds beyond what it has had time to play."""
+        return self.sent / self.media - (now - self.t0)
+
 
-ROOTS = list(DEFAULT_ROOTS)
-PORT = DEFAULT_PORT
+class _Scheduler:
+    RATE_WINDOW = 2.0     # seconds the reported rates average over
+    BURST = 0.25          # seconds of budget a bucket may save up
 
-_seg_cache = {}            # cam_id -> (scan_time, segments)
-_seg_lock = threading.Lock()
-_reg_cache = {"t": 0.0, "reg": {}}   # camera registry cache
-_reg_lock = threading.Lock()
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = {}
+        self._ids = itertools.count(1)
+        self._tokens, self._last = 0.0, time.monotonic()
+
+    def open(self, client, what, media_rate):
+        s = _Stream(next(self._ids), client, what, media_rate)
+        with self._lock:
+            self._streams[s.id] = s
+        return s
+
+    def close(self, s):
+        with self._lock:
+            self._streams.pop(s.id, None)
+
+    def grant(self, s, n):
+        """Takes n bytes of budget for stream s: 0.0 if granted, else the seconds to wait before
+        asking again (the caller sleeps: a thread with time.sleep, the loop with asyncio.sleep)."""
+        now = time.monotonic()
+        with self._lock:
+            if s.cap:
+                s.tokens = min(s.tokens + (now - s.last) * s.cap, max(n, s.cap * self.BURST))
+                s.last = now
+                if s.tokens < n:
+                    s.waiting = 0.0                # held by its own cap, not queued: others needn't yield to it
+                    return (n - s.tokens) / s.cap
+            if GLOBAL_RATE:
+                self._tokens = min(self._tokens + (now - self._last) * GLOBAL_RATE, max(n, GLOBAL_RATE * self.BURST))
+                self._last = now
+                mine = s.buffered(now)
+                if self._tokens < n or any(o.waiting > now and o.buffered(now) < mine
+                                           for o in self._streams.values() if o is not s):
+                    d = max(0.002, (n - self._tokens) / GLOBAL_RATE)
+                    s.waiting = now + d + 0.05     # queued for the global budget until it asks again
+                    return d
+                self._tokens -= n
+            s.waiting = 0.0
+            s.tokens -= n
+            s.sent += n
+            s.recent.append((now, n))
+            while s.recent[0][0] < now - self.RATE_WINDOW:
+                s.recent.popleft()
+        return 0.0
+
+    def pace(self, s, n):
+        """Blocks the calling thread until stream s may send n more bytes."""
+        while True:
+            d = self.grant(s, n)
+            if not d:
+                return
+            time.sleep(d)
+
+    def snapshot(self):
+        """/api/streams: the caps and, per open stream, its recent rate and estimated client buffer."""
+        now = time.monotonic()
+        with self._lock:
+            out = [{"id": s.id, "client": s.client, "what": s.what, "sent": s.sent,
+                    "rate": int(sum(n for t, n in s.recent if t >= now - self.RATE_WINDOW) / self.RATE_WINDOW),
+                    "cap": int(s.cap), "media_rate": int(s.media), "buffered": round(s.buffered(now), 1),
+                    "waiting": s.waiting > now} for s in self._streams.values()]
+        return {"global_cap": GLOBAL_RATE, "rate": sum(x["rate"] for x in out), "streams": out}
+
+
+_SCHED = _Scheduler()
 
 
 # --------------------------------------------------------------------------- #
-# Camera registry: maps (root, folder) to a safe cam_id, preventing path traversal
+# go2rtc JS proxy: the split view's /video-stream.js and /video-rtc.js come from go2rtc over one
+# kept-alive connection and are cached pre-encoded. Fresh: served as is. Stale: served as is while
+# one background request revalidates it (conditional GET; usually a bare 304). A failed fetch is
+# remembered for JS_FAIL_TTL, and meanwhile the last good copy (any age) is served, or a 502 if
+# there is none, so a down go2rtc costs at most one waiting request thread per JS_FAIL_TTL.
 # --------------------------------------------------------------------------- #
-def _build_registry():
-    """Returns OrderedDict: cam_id -> {"id","label","dir"}.
-    Each XiaomiCamera_* subdirectory under a root counts as one camera; if a root has no such
-    subdirectory (it holds recording segments directly, or it is still an empty spare disk), the
-    root itself is treated as one camera — so the empty disk c700_05 also appears in the dropdown
-    by its share name (no recordings yet), and will be picked up automatically once a camera
-    starts writing into it (at that point cid changes from "i:." to "i:XiaomiCamera_...", the
-    label still being the share name)."""
-    reg = {}
-    for i, root in enumerate(ROOTS):
-        if not root or not os.path.isdir(root):
-            continue
-        subs = []
+class _Upstream:
+    def __init__(self, base, ctype, cache):
+        self.base, self.ctype, self.cache = base, ctype, cache
+        self._lock = threading.Lock()     # guards _ents
+        self._io = threading.Lock()       # one request at a time on the kept-alive connection
+        self._conn = None
+        self._ents = {}   # path -> [_encoded entry or None, validator headers, fresh until, failed until, in-flight Event or None]
+
+    def get(self, path):
+        """The _encoded(...) entry for `path`, or None (go2rtc unreachable, nothing cached). Only a
+        cold path makes its callers wait: the first one fetches, the rest wait for its result."""
+        with self._lock:
+            e = self._ents.get(path)
+            if e is None:
+                e = self._ents[path] = [None, {}, 0.0, 0.0, None]
+            now = time.monotonic()
+            if (e[0] is not None and now < e[2]) or now < e[3]:
+                return e[0]
+            flight, lead = e[4], e[4] is None
+            if lead:
+                flight = e[4] = threading.Event()
+            if e[0] is not None:
+                if lead:
+                    threading.Thread(target=self._refresh, args=(path, e, flight),
+                                     name="upstream:%s" % path, daemon=True).start()
+                return e[0]
+        if lead:
+            self._refresh(path, e, flight)
+        else:
+            flight.wait()
+        with self._lock:
+            return e[0]
+
+    def _refresh(self, path, e, flight):
         try:
-            with os.scandir(root) as it:
-                for ent in it:
-                    try:
-                        if ent.is_dir() and CAM_RE.search(ent.name):
-                            subs.append(ent.name)
-                    except OSError:
+            t = time.monotonic()
+            res = self._fetch(path, e[1])
+            if isinstance(res, tuple) and e[0] is not None and res[0] == e[0][1]["identity"]:
+                res = True                    # no validators upstream, same bytes: keep the encoded entry
+            elif isinstance(res, tuple):
+                res = (_encoded(self.ctype, res[0], self.cache), res[1])
+            with self._lock:
+                if res is None:
+                    e[3] = t + JS_FAIL_TTL
+                    return
+                if res is not True:
+                    e[0], e[1] = res
+                e[2], e[3] = t + JS_TTL, 0.0
+        finally:
+            with self._lock:
+                e[4] = None
+            flight.set()
+
+    def _fetch(self, path, validators):
+        """One GET of `path`, conditional on `validators`: (body, validators) for a 200, True for a
+        304, None for anything else. A kept-alive connection go2rtc has dropped meanwhile is retried
+        once on a new one (not after a timeout: that would double the wait)."""
+        u = urlparse(self.base)
+        with self._io:
+            for _ in range(2):
+                reused = self._conn is not None
+                if not reused:
+                    self._conn = http.client.HTTPConnection(u.hostname, u.port or 80, timeout=JS_TIMEOUT)
+                try:
+                    self._conn.request("GET", path, headers=validators)
+                    r = self._conn.getresponse()
+                    body = r.read()
+                except (OSError, http.client.HTTPException) as ex:
+                    self._conn.close()
+                    self._conn = None
+                    if reused and not isinstance(ex, TimeoutError):
                         continue
-        except OSError:
+                    return None
+                if r.will_close:
+                    self._conn.close()
+                    self._conn = None
+                if r.status == 304 and validators:
+                    return True
+                if r.status != 200:
+                    return None
+                got = {}
+                if r.getheader("ETag"):
+                    got["If-None-Match"] = r.getheader("ETag")
+                if r.getheader("Last-Modified"):
+                    got["If-Modified-Since"] = r.getheader("Last-Modified")
+                return body, got
+        return None
+
+
+_GO2RTC_JS = _Upstream(GO2RTC, "text/javascript; charset=utf-8", "max-age=3600")
+
+
+# --------------------------------------------------------------------------- #
+# HTTP
+# --------------------------------------------------------------------------- #
+def etag_match(header, etag):
+    """If-None-Match semantics: weak comparison against a comma-separated list (or "*")."""
+    if not header:
+        return False
+    return header.strip() == "*" or etag in (t.strip().replace("W/", "", 1) for t in header.split(","))
+
+
+def _http_date(header):
+    """An HTTP date header as epoch seconds, or None."""
+    try:
+        return parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _byte_ranges(spec, size):
+    """Parses a Range header into [(start, length)], clipped to the file: None = ignore the header
+    (malformed, not bytes, too many parts), [] = nothing satisfiable (416)."""
+    unit, _, sets = (spec or "").partition("=")
+    if unit.strip().lower() != "bytes" or not sets:
+        return None
+    out = []
+    for part in sets.split(","):
+        m = _RANGE_RE.match(part.strip())
+        if not m:
+            return None
+        gs, ge = m.group(1), m.group(2)
+        if gs == "":                        # last N bytes
+            if ge == "":
+                return None
+            n = min(int(ge), size)
+            if n:
+                out.append((size - n, n))
             continue
-        subs.sort()
-        share = os.path.basename(os.path.normpath(root)) or root
-        if subs:
-            multi = len(subs) > 1
-            for name in subs:
-                cid = "%d:%s" % (i, name)
-                lbl = _cam_label(name, share)
-                if multi and lbl == share:        # when one disk has multiple cameras, use the MAC tail to tell them apart
-                    mac = re.search(r"([0-9A-Fa-f]{12})$", name)
-                    if mac:
-                        lbl = "%s·%s" % (share, mac.group(1)[-4:])
-                reg[cid] = {"id": cid, "label": lbl, "dir": os.path.join(root, name)}
-        else:
-            cid = "%d:." % i
-            reg[cid] = {"id": cid, "label": _cam_label(share, share), "dir": root}
-    return reg
+        start = int(gs)
+        end = int(ge) if ge else size - 1
+        if ge and end < start:
+            return None
+        if start < size:
+            out.append((start, min(end, size - 1) - start + 1))
+    return out if len(out) <= MAX_RANGES else None
 
 
-def registry():
-    now = time.time()
-    with _reg_lock:
-        r = _reg_cache["reg"]
-        if r and now - _reg_cache["t"] < CACHE_TTL:
-            return r
-    reg = _build_registry()
-    with _reg_lock:
-        _reg_cache["t"] = now
-        _reg_cache["reg"] = reg
-    return reg
+_warmed = {}        # segment paths already read ahead; insertion order = age
 
 
-def list_cameras():
-    """Returns [{id,label}], across all root directories."""
-    return [{"id": c["id"], "label": c["label"]} for c in registry().values()]
+def _next_segment(cam, fn):
+    """Path of the segment after `fn` in camera `cam`'s list (what the page plays once `fn` ends),
+    or None, also when the camera has no listing yet: this only steers a readahead, so it reads the
+    current snapshot and never waits for one (scan() can, up to PRIME_WAIT)."""
+    with _seg_lock:
+        st = _cams.get(cam)
+    if st is None or not st.ready.is_set():
+        return None
+    segs = st.segs
+    i = segs.find(fn)
+    if i is None or i + 1 >= len(segs):
+        return None
+    return os.path.join(st.dir, segs.names[i + 1])
 
 
-def cam_dir(cam_id):
-    """Resolves cam_id to a disk directory; only via the registry, never concatenating untrusted input → no path traversal."""
-    c = registry().get(cam_id)
-    if c and os.path.isdir(c["dir"]):
-        return c["dir"]
-    return None
+def _read_ahead(path):
+    """Asks the kernel to pull a segment's head and moov into the page cache (posix_fadvise
+    WILLNEED; a plain read where that is missing), then parses its keyframes / moov-first view if it
+    is finished, so its first request finds nothing cold on the share."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        spans = [(0, min(size, READAHEAD_BYTES))]
+        spans += [(b[1], b[2]) for b in _top_boxes(fd, size) or [] if b[0] == b"moov" and b[1] + b[2] > READAHEAD_BYTES]
+        for off, n in spans:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fd, off, n, os.POSIX_FADV_WILLNEED)
+                continue
+            while n > 0:
+                buf = os.pread(fd, min(COPY_CHUNK, n), off)
+                if not buf:
+                    break
+                off, n = off + len(buf), n - len(buf)
+    finally:
+        os.close(fd)
+    pr = _parse_secs(os.path.basename(path))
+    if pr and pr[1] > pr[0]:
+        prebuild(path)
 
 
-# --------------------------------------------------------------------------- #
-# Index: read file names only
-# --------------------------------------------------------------------------- #
-def _parse_name(name):
-    m = FN_RE.search(name)
-    if not m:
+def _warm(cam, path):
+    """Reads segment `path` ahead on its camera's lane, once."""
+    with _fs_lock:
+        if path in _warmed:
+            return
+        _warmed[path] = True
+        while len(_warmed) > KEYFRAME_CACHE:
+            del _warmed[next(iter(_warmed))]
+    c = registry().get(cam)
+    if c:
+        _LANES.submit(c["root"], lambda: _read_ahead(path))
+
+
+def _notify_at(body, at, fn):
+    """Passes `body` through, calling fn() once the pieces before body offset `at` have been handed
+    to the socket (a slice straddling it is split there): how far the client has really read."""
+    pos = 0
+    for p in body:
+        n = _piece_len(p)
+        if fn is not None and pos + n > at:
+            k = at - pos
+            if k > 0:
+                yield p[:k] if isinstance(p, bytes) else (p[0], k) + p[2:]
+                p = p[k:] if isinstance(p, bytes) else (p[0] + k, n - k) + p[2:]
+            fn()
+            fn = None
+        pos += n
+        yield p
+
+
+def video_plan(cam, fn, headers, faststart=False, t=None, fragmented=False):
+    """Resolves a /video request (cam, file, request headers) to (fpath, status, headers, body,
+    media byte rate), or None for a 404; `body` is an iterable of bytes (multipart framing, a
+    rewritten moov) and (start, length) file slices; the media rate (bytes per second of playback,
+    None if unknown) sizes the stream's share in the scheduler. `faststart` asks for the moov-first view of a finished segment;
+    `t` (seconds into it) for a stream that starts at the keyframe at/before t: a fragmented MP4 is
+    cut to its init boxes + the fragments from that keyframe's on (timestamps untouched, so the
+    player's clock still reads clip time); a sample-table MP4 gets the moov-first view instead,
+    which lets the browser seek straight to t with one Range request. `fragmented` (HLS) asks for a
+    finished sample-table MP4 in its remuxed form (see remux_view); a fragmented one is as stored.
+    Both server engines answer from it, so Range/conditional handling can't drift apart.
+    A finished segment never changes again: it gets a strong ETag (size + mtime), Last-Modified and
+    a long max-age, and answers If-None-Match / If-Modified-Since with 304 and If-Range by the rules.
+    The in-progress chunk (start == end in its name) is still growing: no-store, no validators.
+    A client that streams past READAHEAD_AT of a finished segment has the one played after it read
+    ahead on the server (see _read_ahead): no preload hint, the browser fetches only what it plays."""
+    d = cam_dir(cam)
+    if not d or not FN_RE.search(fn or ""):
         return None
+    fpath = os.path.join(d, os.path.basename(fn))
     try:
-        s = datetime.datetime.strptime(m.group(1), "%Y%m%d%H%M%S")
-        e = datetime.datetime.strptime(m.group(2), "%Y%m%d%H%M%S")
-    except ValueError:
+        st = os.stat(fpath)
+    except OSError:
         return None
-    return s, e
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    size = st.st_size
+    pr = _parse_secs(os.path.basename(fn))
+    final = bool(pr) and pr[1] > pr[0]
 
+    hdrs = [("Content-Type", "video/mp4"), ("Accept-Ranges", "bytes")]
+    etag, view, tag = None, None, ""
+    if final and t is not None:
+        kf = keyframe_index(fpath, st)
+        if kf and kf["init"] is not None:
+            off, end = keyframe_at(kf, t)[1], kf["frags"]["run"][1]   # (not the mfra: its offsets would lie)
+            if off > kf["init"]:
+                view, tag = [(0, kf["init"]), (off, end - off)], "-t%x" % off
+        else:
+            faststart = True
+    if final and fragmented and view is None:
+        kf = keyframe_index(fpath, st)
+        got = remux_view(fpath, st) if kf and kf["init"] is None else None
+        if got:
+            view, tag = got[1], "-fm"
+    if final and faststart and view is None:
+        view = faststart_view(fpath, st)
+        tag = "-fs" if view else ""
+    if view:
+        size = sum(_piece_len(p) for p in view)
+    if final:
+        etag = '"%x-%x%s"' % (st.st_size, st.st_mtime_ns, tag)
+        hdrs += [("ETag", etag), ("Last-Modified", formatdate(st.st_mtime, usegmt=True)),
+                 ("Cache-Control", "private, max-age=%d, immutable" % SEGMENT_MAX_AGE)]
+    else:
+        hdrs.append(("Cache-Control", "no-store"))
+    nxt = _next_segment(cam, os.path.basename(fn)) if final else None
+    status, hdrs, body = _view_plan(view or [(0, size)], size, headers, hdrs, etag, st.st_mtime)
+    if nxt and body:
+        # READAHEAD_AT of the file as a body offset: through the parts sent, in the order asked for
+        # (multipart: their separators left out, so it fires a few bytes early); None = not reached
+        ranges = _byte_ranges(headers.get("Range"), size) if status == 206 else None
+        mark, at = int(size * READAHEAD_AT), 0
+        for start, length in ranges or [(0, size)]:
+            if start + length > mark:
+                at += max(0, mark - start)
+                break
+            at += length
+        else:
+            at = None
+        if at is not None:
+            body = _notify_at(body, at, lambda: _warm(cam, nxt))
+    return fpath, status, hdrs, body, (size / (pr[1] - pr[0]) if final else None)
 
-def scan(cam_id):
-    """Scans all recognizable segments under a camera directory (with a short cache)."""
-    now = time.time()
-    with _seg_lock:
-        c = _seg_cache.get(cam_id)
-        if c and now - c[0] < CACHE_TTL:
-            return c[1]
 
-    d = cam_dir(cam_id)
-    segs = []
-    if d and os.path.isdir(d):
+def day_plan(cam, date_str, upto, headers):
+    """video_plan for /video/day (see day_stream): (None, status, headers, body, media rate) or None (404); every
+    file slice in the body names its own file. A stream with a given `upto` only changes if one of
+    its segments goes away (rotation), so it is revalidated (no-cache) rather than kept for long."""
+    day = day_stream(cam, date_str, upto)
+    if day is None:
+        return None
+    hdrs = [("Content-Type", "video/mp4"), ("Accept-Ranges", "bytes"), ("ETag", day["etag"]),
+            ("Last-Modified", formatdate(day["mtime"], usegmt=True)), ("Cache-Control", "private, no-cache")]
+    return ((None,) + _view_plan(day["view"], day["size"], headers, hdrs, day["etag"], day["mtime"])
+            + (day["size"] / max(1.0, day["duration"]),))
+
+
+def ocr_plan(path, headers):
+    """video_plan for /ocr/<name>, the in-browser OCR engine under OCR_DIR (basename only: no path
+    traversal): (fpath, status, headers, body, 0) or None (404). Streamed like a segment, never read
+    whole (the model alone is ~90 MB), with Range, ETag / Last-Modified and 304. A precompressed
+    <name>.br / <name>.gz next to the file (and not older than it) is sent instead where the client
+    accepts it. Media rate 0 = not media: the stream scheduler leaves it alone."""
+    name = os.path.basename(path[len("/ocr/"):])
+    if not name or ".." in name:
+        return None
+    fpath = os.path.join(OCR_DIR, name)
+    try:
+        st = os.stat(fpath)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    sts, exts = {"identity": st}, {"br": ".br", "gzip": ".gz"}
+    for coding, ext in exts.items():
         try:
-            with os.scandir(d) as it:
-                for ent in it:
-                    try:
-                        if not ent.is_file():
-                            continue
-                    except OSError:
-                        continue
-                    pr = _parse_name(ent.name)
-                    if not pr:
-                        continue
-                    s, e = pr
-                    live = e <= s  # equal/inverted start-end = the segment currently being recorded
-                    if live:
-                        try:
-                            fresh = (now - ent.stat().st_mtime) < LIVE_STALE_SEC
-                        except OSError:
-                            fresh = True
-                        if fresh:
-                            e = datetime.datetime.now()
-                            if e <= s:
-                                e = s + datetime.timedelta(seconds=1)
-                        else:
-                            e = s + datetime.timedelta(seconds=1)
-                            live = False
-                    segs.append({"file": ent.name, "start": s, "end": e, "live": live})
+            pre = os.stat(fpath + ext)
         except OSError:
-            pass
-    segs.sort(key=lambda x: x["start"])
-
-    with _seg_lock:
-        _seg_cache[cam_id] = (now, segs)
-    return segs
+            continue
+        if stat.S_ISREG(pre.st_mode) and pre.st_mtime >= st.st_mtime:
+            sts[coding] = pre
+    coding = _pick_encoding(headers.get("Accept-Encoding"), {c: st.st_size for c, st in sts.items()})
+    st = sts[coding]
+    etag = '"%x-%x%s"' % (st.st_size, st.st_mtime_ns, "" if coding == "identity" else "-" + coding)
+    hdrs = [("Content-Type", _OCR_CT.get(os.path.splitext(name)[1], "application/octet-stream")),
+            ("Accept-Ranges", "bytes"), ("ETag", etag), ("Last-Modified", formatdate(st.st_mtime, usegmt=True)),
+            ("Cache-Control", "max-age=86400"), ("Vary", "Accept-Encoding")]
+    if coding != "identity":
+        hdrs.append(("Content-Encoding", coding))
+        fpath += exts[coding]
+    status, hdrs, body = _view_plan([(0, st.st_size)], st.st_size, headers, hdrs, etag, st.st_mtime)
+    return fpath, status, hdrs, body, 0
 
 
-def days_for(segs):
-    """List of dates that have recordings (with a rough per-day segment count), in ascending date order."""
-    days = {}
-    one = datetime.timedelta(days=1)
-    for sg in segs:
-        cur = sg["start"].date()
-        last = sg["end"].date()
-        while cur <= last:
-            k = cur.isoformat()
-            rec = days.setdefault(k, {"date": k, "count": 0})
-            rec["count"] += 1
-            cur += one
-    return [days[k] for k in sorted(days)]
+def _view_plan(view, size, headers, hdrs, etag, mtime):
+    """(status, headers, body) serving `view` (pieces adding up to `size` bytes) under the request's
+    conditional and Range headers: 304, 200, 416 or 206 (one slice, or multipart/byteranges).
+    `hdrs` starts with Content-Type and Accept-Ranges; etag None = a resource still changing
+    (no validators: never 304, If-Range never matches)."""
+    if etag is not None:
+        inm = headers.get("If-None-Match")
+        ims = None if inm else _http_date(headers.get("If-Modified-Since"))
+        if etag_match(inm, etag) or (ims is not None and int(mtime) <= ims):
+            return 304, hdrs[2:], []
+    ranges = _byte_ranges(headers.get("Range"), size)
+    ifr = headers.get("If-Range")
+    if ranges is not None and ifr:             # only a still-current validator keeps the Range
+        ifr = ifr.strip()
+        if ifr.startswith('"') or ifr.startswith("W/"):
+            ok = etag is not None and ifr == etag
+        else:
+            ok = etag is not None and _http_date(ifr) == int(mtime)
+        if not ok:
+            ranges = None
+    if ranges is None:
+        return 200, hdrs + [("Content-Length", str(size))], _view_slice(view, 0, size)
+    if not ranges:
+        return 416, [("Content-Range", "bytes */%d" % size), ("Content-Length", "0")], []
+    if len(ranges) == 1:
+        start, length = ranges[0]
+        return 206, hdrs + [("Content-Range", "bytes %d-%d/%d" % (start, start + length - 1, size)),
+                            ("Content-Length", str(length))], _view_slice(view, start, length)
+    seps, total = [], 0                        # multipart/byteranges: each slice with its own header
+    for start, length in ranges:
+        sep = ("\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n"
+               % (_BOUNDARY, hdrs[0][1], start, start + length - 1, size)).encode("latin-1")
+        seps.append(sep)
+        total += len(sep) + length
+    tail = ("\r\n--%s--\r\n" % _BOUNDARY).encode("latin-1")
+    body = itertools.chain.from_iterable(
+        itertools.chain((sep,), _view_slice(view, start, length)) for sep, (start, length) in zip(seps, ranges))
+    hdrs[0] = ("Content-Type", "multipart/byteranges; boundary=%s" % _BOUNDARY)
+    return 206, hdrs + [("Content-Length", str(total + len(tail)))], itertools.chain(body, (tail,))
 
 
-def segs_for_day(segs, date_str):
-    """All segments overlapping a given day (00:00~24:00 local time), sorted."""
+def _seek_arg(q):
+    """The t=<seconds> of a /video query, or None."""
     try:
-        d = datetime.date.fromisoformat(date_str)
+        t = float(q.get("t", [""])[0])
     except ValueError:
-        return []
-    day0 = datetime.datetime.combine(d, datetime.time.min)
-    day1 = day0 + datetime.timedelta(days=1)
-    out = []
-    for sg in segs:
-        if sg["start"] < day1 and sg["end"] > day0:
-            out.append({
-                "file": sg["file"],
-                "start": sg["start"].isoformat(),
-                "end": sg["end"].isoformat(),
-                "live": sg["live"],
-            })
-    return out
+        return None
+    return t if t >= 0 else None
+
+
+def send_range(sock, f, start, length, zerocopy=None):
+    """Writes `length` bytes of file `f` from offset `start` to `sock`. With sendfile (default where
+    the OS has it) the kernel moves the bytes straight from the page cache to the socket — no Python
+    buffers, no per-chunk allocations; otherwise (or zerocopy=False) a plain read/write loop.
+    Returns the number of bytes sent (short if the file shrank)."""
+    if SENDFILE if zerocopy is None else zerocopy:
+        return sock.sendfile(f, start, length)
+    f.seek(start)
+    sent = 0
+    while sent < length:
+        buf = f.read(min(COPY_CHUNK, length - sent))
+        if not buf:
+            break
+        sock.sendall(buf)
+        sent += len(buf)
+    return sent
 
 
-# --------------------------------------------------------------------------- #
-# HTTP
-# --------------------------------------------------------------------------- #
 class Handler(BaseHTTPRequestHandler):
     server_version = "XiaomiPlayback/1.0"
+    # HTTP/1.1 keep-alive: API polls and the <video> element's Range requests reuse one connection
+    # (and one thread). Every response carries Content-Length; anything that could leave the stream
+    # out of step (an error after the headers went out, a short body, an unread request body)
+    # closes the connection instead. `timeout` bounds the idle wait for the next request.
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
 
     def log_message(self, *args):
         pass  # quiet
 
+    def send_response(self, code, message=None):
+        self._responded = True
+        super().send_response(code, message)
+
+    def _fail(self, code, msg=None):
+        """Error reply if nothing was sent yet for this request; the connection is dropped either way."""
+        self.close_connection = True
+        if not getattr(self, "_responded", False):
+            try:
+                self.send_error(code, msg)
+            except Exception:  # noqa: BLE001
+                pass
+
+    def _begin(self):
+        """Per-request reset; a request body (which these routes never read) would desync the stream."""
+        self._responded = False
+        if self.headers.get("Content-Length", "0") != "0" or self.headers.get("Transfer-Encoding"):
+            self.close_connection = True
+
     # -- helpers ----------------------------------------------------------
     def _json(self, obj):
         body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
@@ -300,99 +3462,138 @@ class Handler(BaseHTTPRequestHandler):
         if self.command != "HEAD":
             self.wfile.write(body)
 
-    def _html(self):
-        body = HTML_PAGE.encode("utf-8")
-        self.send_response(200)
-        self.send_header("Content-Type", "text/html; charset=utf-8")
+    def _json_cached(self, ent, ctype="application/json; charset=utf-8"):
+        """Sends a pre-encoded (body, etag, cache_control), or a bare 304 if the client already has it."""
+        body, etag, cache = ent
+        fresh = etag_match(self.headers.get("If-None-Match"), etag)
+        self.send_response(304 if fresh else 200)
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", cache)
+        if fresh:
+            self.end_headers()
+            return
+        self.send_header("Content-Type", ctype)
         self.send_header("Content-Length", str(len(body)))
-        self.send_header("Cache-Control", "no-store")
         self.end_headers()
         if self.command != "HEAD":
             self.wfile.write(body)
 
-    def _jsproxy(self, path):
-        # Same-origin proxy of go2rtc's video-rtc.js / video-stream.js (with a short cache), used by the split-view component
-        with _JS_LOCK:
-            body = _JS_CACHE.get(path)
-        if body is None:
-            try:
-                body = urllib.request.urlopen(GO2RTC + path, timeout=8).read()
-            except Exception:
-                self.send_error(502, "go2rtc unreachable")
-                return
-            with _JS_LOCK:
-                _JS_CACHE[path] = body
-        self.send_response(200)
-        self.send_header("Content-Type", "text/javascript; charset=utf-8")
-        self.send_header("Content-Length", str(len(body)))
-        self.send_header("Cache-Control", "max-age=3600")
-        self.end_headers()
-        if self.command != "HEAD":
-            self.wfile.write(body)
+    def _static(self, path):
+        """The page or one of its /static/ parts, pre-encoded (see page_assets)."""
+        ent = page_assets().get(path)
+        if ent is None:
+            self.send_error(404)
+            return
+        self._send_encoded(ent)
 
-    def _ocr_file(self, path):
-        # Serve a locally-hosted tesseract.js engine file from OCR_DIR (basename only → no path traversal)
-        name = os.path.basename(path[len("/ocr/"):])
-        if not name or ".." in name:
-            self.send_error(404); return
-        fp = os.path.join(OCR_DIR, name)
-        if not os.path.isfile(fp):
-            self.send_error(404); return
-        try:
-            with open(fp, "rb") as f:
-                body = f.read()
-        except OSError:
-            self.send_error(404); return
-        ct = _OCR_CT.get(os.path.splitext(name)[1], "application/octet-stream")
-        self.send_response(200)
-        self.send_header("Content-Type", ct)
+    def _send_encoded(self, ent):
+        """Sends an _encoded(...) entry: the best variant the client accepts, or a bare 304 if it
+        already has it. Each coding has its own strong ETag (the entry's, "-gzip" / "-br" appended,
+        as ocr_plan does): the variants are different bytes."""
+        ctype, variants, etag, cache = ent
+        coding = _pick_encoding(self.headers.get("Accept-Encoding"), {c: len(b) for c, b in variants.items()})
+        if coding != "identity":
+            etag = etag[:-1] + "-" + coding + '"'
+        fresh = etag_match(self.headers.get("If-None-Match"), etag)
+        self.send_response(304 if fresh else 200)
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", cache)
+        self.send_header("Vary", "Accept-Encoding")
+        if fresh:
+            self.end_headers()
+            return
+        body = variants[coding]
+        self.send_header("Content-Type", ctype)
+        if coding != "identity":
+            self.send_header("Content-Encoding", coding)
         self.send_header("Content-Length", str(len(body)))
-        self.send_header("Cache-Control", "max-age=86400")
         self.end_headers()
         if self.command != "HEAD":
             self.wfile.write(body)
 
+    def _jsproxy(self, path):
+        # Same-origin proxy of go2rtc's video-rtc.js / video-stream.js (see _Upstream), used by the split-view component
+        ent = _GO2RTC_JS.get(path)
+        if ent is None:
+            self.send_error(502, "go2rtc unreachable")
+            return
+        self._send_encoded(ent)
+
     # -- routing ----------------------------------------------------------
     def do_GET(self):
+        self._begin()
         u = urlparse(self.path)
         q = parse_qs(u.query)
         try:
-            if u.path in ("/", "/index.html"):
-                self._html()
+            if u.path in ("/", "/index.html") or u.path.startswith("/static/"):
+                self._static("/" if u.path == "/index.html" else u.path)
             elif u.path == "/api/cameras":
                 self._json(list_cameras())
+            elif u.path == "/api/streams":
+                self._json(_SCHED.snapshot())
+            elif u.path == "/api/events":
+                self._events()
             elif u.path == "/api/timeline":
                 cam = q.get("cam", [""])[0]
-                self._json({"days": days_for(scan(cam))})
+                self._json_cached(timeline_body(scan(cam)))
             elif u.path == "/api/segments":
-                cam = q.get("cam", [""])[0]
+                cams = _cam_ids(q.get("cam", [""]))
                 date = q.get("date", [""])[0]
-                self._json({"segments": segs_for_day(scan(cam), date)})
+                if len(cams) == 1:
+                    self._json_cached(segments_body(scan(cams[0]), date))
+                else:                          # cam=a,b,c (or cam=a&cam=b): every camera in one response
+                    self._json_cached(segments_many_body(cams, date))
+            elif u.path == "/api/coverage":
+                ent = coverage_body(_cam_ids(q.get("cam", [])), q.get("span", ["day"])[0],
+                                    q.get("date", [""])[0])
+                if ent is None:
+                    self.send_error(404)
+                else:
+                    self._json_cached(ent)
             elif u.path == "/api/clipinfo":
                 self._clipinfo(q)
+            elif u.path == "/api/keyframes":
+                ent = keyframes_body(q.get("cam", [""])[0], q.get("file", [""])[0])
+                if ent is None:
+                    self.send_error(404)
+                else:
+                    self._json_cached(ent)
+            elif u.path == "/api/thumbs":
+                self._thumbs(q)
+            elif u.path == "/api/daymap":
+                self._json_cached(daymap_body(q.get("cam", [""])[0], q.get("date", [""])[0]))
             elif u.path == "/video":
                 self._video(q)
+            elif u.path == "/video/day":
+                self._video_day(q)
+            elif u.path.startswith("/hls/"):
+                self._hls(u.path)
             elif u.path in ("/video-stream.js", "/video-rtc.js"):
                 self._jsproxy(u.path)
             elif u.path.startswith("/ocr/"):
-                self._ocr_file(u.path)
+                self._send_plan(ocr_plan(u.path, self.headers))
             else:
                 self.send_error(404)
-        except (BrokenPipeError, ConnectionResetError):
-            pass
+        except (BrokenPipeError, ConnectionResetError, TimeoutError):
+            self.close_connection = True
         except Exception as ex:  # noqa: BLE001
-            try:
-                self.send_error(500, str(ex))
-            except Exception:
-                pass
+            self._fail(500, str(ex))
 
     def do_HEAD(self):
+        self._begin()
         u = urlparse(self.path)
-        if u.path == "/video":
+        if u.path in ("/video", "/video/day") or u.path.startswith(("/hls/", "/ocr/")):
             try:
-                self._video(parse_qs(u.query))
-            except (BrokenPipeError, ConnectionResetError):
-                pass
+                if u.path.startswith("/ocr/"):
+                    self._send_plan(ocr_plan(u.path, self.headers))
+                elif u.path.startswith("/hls/"):
+                    self._hls(u.path)
+                else:
+                    (self._video if u.path == "/video" else self._video_day)(parse_qs(u.query))
+            except (BrokenPipeError, ConnectionResetError, TimeoutError):
+                self.close_connection = True
+            except Exception as ex:  # noqa: BLE001
+                self._fail(500, str(ex))
         else:
             self.send_error(405)
 
@@ -429,61 +3630,300 @@ class Handler(BaseHTTPRequestHandler):
 
     # -- video stream (supports Range, for seeking) ----------------------
     def _video(self, q):
-        cam = q.get("cam", [""])[0]
-        fn = q.get("file", [""])[0]
-        d = cam_dir(cam)
-        if not d or not FN_RE.search(fn or ""):
-            self.send_error(404)
-            return
-        fpath = os.path.join(d, os.path.basename(fn))
-        if not os.path.isfile(fpath):
+        self._send_plan(video_plan(q.get("cam", [""])[0], q.get("file", [""])[0], self.headers,
+                                   q.get("faststart", [""])[0] == "1", _seek_arg(q), q.get("frag", [""])[0] == "1"))
+
+    def _video_day(self, q):
+        self._send_plan(day_plan(q.get("cam", [""])[0], q.get("date", [""])[0], q.get("upto", [None])[0],
+                                 self.headers))
+
+    def _thumbs(self, q):
+        cam, date, tag = q.get("cam", [""])[0], q.get("date", [""])[0], q.get("sheet", [None])[0]
+        if tag is None:
+            ent = thumbs_body(cam, date)
+        else:                                  # the sheet itself: its URL changes with it, so it keeps
+            jpg = thumb_sheet(cam, date, tag)
+            ent = jpg and (jpg, '"%s"' % tag, "private, max-age=%d, immutable" % SEGMENT_MAX_AGE)
+        if ent is None:
             self.send_error(404)
-            return
+        else:
+            self._json_cached(ent, "application/json; charset=utf-8" if tag is None else "image/jpeg")
 
-        size = os.path.getsize(fpath)
-        start, end, partial = 0, size - 1, False
-        rng = self.headers.get("Range")
-        if rng:
-            m = re.match(r"bytes=(\d*)-(\d*)", rng.strip())
-            if m:
-                gs, ge = m.group(1), m.group(2)
-                if gs == "" and ge != "":          # last N bytes
-                    start = max(0, size - int(ge))
-                    end = size - 1
-                else:
-                    start = int(gs) if gs else 0
-                    end = int(ge) if ge else size - 1
-                end = min(end, size - 1)
-                if start > end or start < 0:
-                    start, end = 0, size - 1
-                partial = True
-
-        length = end - start + 1
-        self.send_response(206 if partial else 200)
-        self.send_header("Content-Type", "video/mp4")
-        self.send_header("Accept-Ranges", "bytes")
-        self.send_header("Content-Length", str(length))
-        if partial:
-            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, size))
+    def _events(self):
+        """/api/events: the index change feed as Server-Sent Events, until the client goes away (a
+        ping every EVENTS_PING finds out). The stream holds this connection and its thread."""
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
         self.send_header("Cache-Control", "no-store")
         self.end_headers()
+        seq, out = _FEED.start(self.headers.get("Last-Event-ID"))
+        while True:
+            self.wfile.write(out or b": ping\n\n")
+            self.wfile.flush()
+            seq, out = _FEED.wait(seq, EVENTS_PING)
 
-        if self.command == "HEAD":
+    def _hls(self, path):
+        cam, name = _hls_path(path) or ("", "")
+        if name.endswith(".m3u8"):
+            ent = hls_playlist(cam, name[:-len(".m3u8")])
+            if ent is None:
+                self.send_error(404)
+            else:
+                self._json_cached(ent, "application/vnd.apple.mpegurl")
+        else:
+            self._send_plan(video_plan(cam, name, self.headers, fragmented=True))
+
+    def _send_plan(self, plan):
+        if plan is None:
+            self.send_error(404)
             return
+        fpath, status, hdrs, body, media = plan
+        self.send_response(status)
+        for k, v in hdrs:
+            self.send_header(k, v)
+        self.end_headers()
 
-        chunk = 256 * 1024
-        with open(fpath, "rb") as f:
-            f.seek(start)
-            remaining = length
-            while remaining > 0:
-                buf = f.read(min(chunk, remaining))
-                if not buf:
-                    break
+        if self.command == "HEAD" or not body:
+            return
+
+        self.connection.settimeout(SEND_TIMEOUT)
+        f = None
+        st = None if media == 0 else _SCHED.open(self.client_address[0], self.path, media)
+        try:
+            for piece in body:
+                if isinstance(piece, bytes):
+                    if st:
+                        _SCHED.pace(st, len(piece))
+                    self.wfile.write(piece)
+                    continue
+                path = piece[2] if len(piece) > 2 else fpath     # a day stream's slices name their file
+                if f is None or f.name != path:
+                    if f is not None:
+                        f.close()
+                    f = open(path, "rb")
+                pos, end = piece[0], piece[0] + piece[1]
+                while pos < end:                     # in scheduler grants (sendfile each); unscheduled: all at once
+                    n = min(SCHED_CHUNK, end - pos) if st else end - pos
+                    if st:
+                        _SCHED.pace(st, n)
+                    if send_range(self.connection, f, pos, n) < n:
+                        self.close_connection = True     # file shrank under us: promised bytes never came
+                        return
+                    pos += n
+        finally:
+            if st:
+                _SCHED.close(st)
+            if f is not None:
+                f.close()
+            self.connection.settimeout(self.timeout)
+
+
+# --------------------------------------------------------------------------- #
+# asyncio engine (--async): one event loop instead of one OS thread per connection. /video streams
+# are served on the loop itself, their blocking reads handed to a small bounded pool, so hundreds
+# of open Range streams cost a buffer each, not a thread each; every other route runs the very same
+# Handler on a second small pool, writing back through the loop.
+# --------------------------------------------------------------------------- #
+class _LoopWriter:
+    """File-like wfile for a Handler running on a worker thread: each write is handed to the event
+    loop and waited for (incl. drain), so a slow client back-pressures the handler, not memory."""
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+
+    async def _write(self, data):
+        if self.writer.is_closing():
+            raise ConnectionResetError("client went away")
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def write(self, data):
+        asyncio.run_coroutine_threadsafe(self._write(bytes(data)), self.loop).result()
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class _BridgedHandler(Handler):
+    """Handler fed one already-read request head, answering through a _LoopWriter."""
+
+    def __init__(self, head, wfile, client_address):
+        self._head, self._out = head, wfile
+        super().__init__(None, client_address, None)
+
+    def setup(self):
+        self.connection = None
+        self.rfile = io.BytesIO(self._head)
+        self.wfile = self._out
+
+    def handle(self):
+        self.handle_one_request()     # one request per instance; AsyncServer owns the keep-alive loop
+
+    def finish(self):
+        pass
+
+
+class AsyncServer:
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.io = ThreadPoolExecutor(ASYNC_IO_THREADS, thread_name_prefix="aio-io")
+        self.api = ThreadPoolExecutor(ASYNC_API_THREADS, thread_name_prefix="aio-api")
+
+    def serve_forever(self):
+        asyncio.run(self._main())
+
+    async def _main(self):
+        srv = await asyncio.start_server(self._conn, self.host, self.port)
+        async with srv:
+            await srv.serve_forever()
+
+    async def _conn(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            keep = True
+            while keep:        # HTTP/1.1 keep-alive: requests on one connection, one at a time
                 try:
-                    self.wfile.write(buf)
-                except (BrokenPipeError, ConnectionResetError):
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                    return
+                line, _, rest = head.partition(b"\r\n")
+                parts = line.decode("latin-1").split()
+                u = urlparse(parts[1]) if len(parts) == 3 else None
+                hls = _hls_path(u.path) if u is not None else None
+                if hls and not hls[1].endswith(".m3u8"):        # an HLS segment is a /video Range request
+                    u = u._replace(path="/video", query=urlencode({"cam": hls[0], "file": hls[1], "frag": 1}))
+                if (u is not None and (u.path in ("/video", "/video/day") or u.path.startswith("/ocr/"))
+                        and parts[0] in ("GET", "HEAD")):
+                    headers = parse_headers(io.BytesIO(rest))
+                    conn = headers.get("Connection", "").lower()
+                    keep = (parts[2] == "HTTP/1.1" and conn != "close" and not headers.get("Transfer-Encoding")
+                            and headers.get("Content-Length", "0") == "0")
+                    keep = await self._video(writer, parts[0], u.path, parse_qs(u.query), headers, keep)
+                elif u is not None and u.path == "/api/events" and parts[0] == "GET":
+                    await self._events(writer, parse_headers(io.BytesIO(rest)))   # a stream never hands back
+                    return
+                else:
+                    h = await loop.run_in_executor(self.api, _BridgedHandler, head, _LoopWriter(loop, writer),
+                                                   writer.get_extra_info("peername"))
+                    keep = not h.close_connection
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def _video(self, writer, method, path, q, headers, keep):
+        """Serves one /video, /video/day or /ocr/ request; returns whether the connection can take another."""
+        loop = asyncio.get_running_loop()
+        if path.startswith("/ocr/"):
+            plan = await loop.run_in_executor(self.io, ocr_plan, path, headers)
+        elif path == "/video/day":
+            plan = await loop.run_in_executor(
+                self.io, day_plan, q.get("cam", [""])[0], q.get("date", [""])[0], q.get("upto", [None])[0], headers)
+        else:
+            plan = await loop.run_in_executor(
+                self.io, video_plan, q.get("cam", [""])[0], q.get("file", [""])[0], headers,
+                q.get("faststart", [""])[0] == "1", _seek_arg(q), q.get("frag", [""])[0] == "1")
+        if plan is None:
+            writer.write(self._head(404, [("Content-Type", "text/plain"), ("Content-Length", "10")], keep)
+                         + (b"" if method == "HEAD" else b"Not Found\n"))
+            await writer.drain()
+            return keep
+        fpath, status, hdrs, body, media = plan
+        writer.write(self._head(status, hdrs, keep))
+        await writer.drain()
+        if method == "HEAD" or not body:
+            return keep
+        # One buffer per stream, refilled in place: drain() with a zero high-water mark returns only
+        # once the transport has let go of it, so memory stays one chunk per open stream.
+        writer.transport.set_write_buffer_limits(0)
+        buf = memoryview(bytearray(ASYNC_CHUNK))
+        body = iter(body)
+        fd, fd_path = None, None
+        peer = writer.get_extra_info("peername")
+        st = None if media == 0 else _SCHED.open(peer[0] if peer else "", path + "?" + urlencode(q, doseq=True), media)
+        try:
+            while True:
+                try:      # the body may read as it goes (a day stream's moofs): off the loop too
+                    piece = await loop.run_in_executor(self.io, next, body, None)
+                except OSError:
+                    return False
+                if piece is None:
                     break
-                remaining -= len(buf)
+                if isinstance(piece, bytes):
+                    await self._pace(st, len(piece))
+                    writer.write(piece)
+                    continue
+                p = piece[2] if len(piece) > 2 else fpath
+                if p != fd_path:
+                    if fd is not None:
+                        os.close(fd)
+                        fd = None
+                    fd = await loop.run_in_executor(self.io, os.open, p, os.O_RDONLY)
+                    fd_path = p
+                pos, end = piece[0], piece[0] + piece[1]
+                while pos < end:
+                    await self._pace(st, min(ASYNC_CHUNK, end - pos))
+                    k = await loop.run_in_executor(self.io, os.preadv, fd, [buf[:min(ASYNC_CHUNK, end - pos)]], pos)
+                    if not k:
+                        return False     # a short body (file shrank) leaves the stream out of step
+                    writer.write(buf[:k])
+                    await writer.drain()
+                    pos += k
+            await writer.drain()
+        finally:
+            if st:
+                _SCHED.close(st)
+            if fd is not None:
+                os.close(fd)
+        return keep
+
+    async def _events(self, writer, headers):
+        """/api/events on the loop itself (a stream would hold an API worker thread for good): the feed
+        pokes an asyncio.Event on publish; an idle stream sends a ping every EVENTS_PING."""
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+
+        def poke():
+            loop.call_soon_threadsafe(wake.set)
+
+        writer.write(self._head(200, [("Content-Type", "text/event-stream"), ("Cache-Control", "no-store")], False))
+        seq, out = _FEED.start(headers.get("Last-Event-ID"))
+        _FEED.listen(poke)
+        try:
+            while not writer.is_closing():
+                writer.write(out)
+                await writer.drain()
+                wake.clear()
+                seq, out = _FEED.read(seq)
+                if not out:
+                    try:
+                        await asyncio.wait_for(wake.wait(), EVENTS_PING)
+                    except asyncio.TimeoutError:
+                        out = b": ping\n\n"
+                    else:
+                        seq, out = _FEED.read(seq)
+        finally:
+            _FEED.listen(poke, False)
+
+    @staticmethod
+    async def _pace(st, n):
+        while st:
+            d = _SCHED.grant(st, n)
+            if not d:
+                return
+            await asyncio.sleep(d)
+
+    @staticmethod
+    def _head(status, hdrs, keep):
+        out = ["HTTP/1.1 %d %s" % (status, BaseHTTPRequestHandler.responses.get(status, ("",))[0]),
+               "Server: %s" % Handler.server_version, "Date: %s" % formatdate(usegmt=True)]
+        out += ["%s: %s" % kv for kv in hdrs]
+        if not keep:
+            out.append("Connection: close")
+        return ("\r\n".join(out) + "\r\n\r\n").encode("latin-1")
 
 
 # --------------------------------------------------------------------------- #
@@ -710,6 +4150,8 @@ HTML_PAGE = r"""<!DOCTYPE html>
     font-family:var(--mono);font-size:11px;color:#0a0c0f;background:var(--accent);
     padding:3px 7px;border-radius:5px;pointer-events:none;display:none;z-index:50;
     box-shadow:0 2px 8px rgba(0,0,0,.5)}
+  .thumb{position:fixed;transform:translateX(-50%);pointer-events:none;display:none;z-index:50;
+    background:#000 no-repeat;border:1px solid var(--accent);border-radius:4px;box-shadow:0 2px 8px rgba(0,0,0,.5)}
   .tip::after{content:"";position:absolute;left:50%;top:100%;transform:translateX(-50%);
     border:4px solid transparent;border-top-color:var(--accent)}
   .ticks{display:flex;justify-content:space-between;font-family:var(--mono);
@@ -815,6 +4257,7 @@ HTML_PAGE = r"""<!DOCTYPE html>
     <div class="track" id="track">
       <div class="playhead" id="playhead"></div>
       <div class="tip" id="tip"></div>
+      <div class="thumb" id="thumb"></div>
     </div>
     <div class="ticks" id="ticks"></div>
     <div class="empty" id="empty" style="display:none">No recordings on this day</div>
@@ -871,6 +4314,67 @@ let firstLoad = true;   // only the first load auto-jumps to the latest; afterwa
 let livePreload = false;   // true while the startup timeline load runs in the background under a live/grid view — loadSegment must NOT tear that view down or autoplay (it only preloads the latest clip into the hidden #vid)
 
 const pad = n => String(n).padStart(2, '0');
+// /video URL of a clip; faststart=1 = the server's moov-first view of finished clips (first frame after one request, not head/tail/head probing)
+function videoUrl(camId, file){ return '/video?cam=' + encodeURIComponent(camId) + '&file=' + encodeURIComponent(file) + '&faststart=1'; }
+// Seek-in-request: &t=<sec> has the server start a FINISHED clip's stream at the keyframe at/before t (its fMP4 fragment, timestamps untouched), so the target's bytes come first and the seek lands on the first try instead of poll-retrying a cold file. Only used for targets well into the clip, and only trusted if the browser kept the clip's own clock (duration ≈ clip length) — otherwise the caller reloads the whole file and falls back to the seek-retry.
+const CUT_MIN_SEC = 10;
+// Read-ahead: PRIME_LEAD_SEC before a clip ends, fetch the head of the clip that plays next (its moov + first fragments) so the switch finds it warm — in the server's page cache (it also reads the next clip ahead on its own once a stream is half through) and in the browser's HTTP cache (finished clips are immutable).
+const PRIME_LEAD_SEC = 20, PRIME_BYTES = 1 << 20;
+const primed = new Set();          // URLs already primed (bounded)
+function primeAhead(v, camId, seg, next){
+  if(!camId || !seg || !next || next.live || (seg.s1 - seg.s0) - v.currentTime > PRIME_LEAD_SEC) return;
+  const u = videoUrl(camId, next.file);
+  if(primed.has(u)) return;
+  primed.add(u); if(primed.size > 64) primed.delete(primed.values().next().value);
+  fetch(u, { headers: { Range: 'bytes=0-' + (PRIME_BYTES - 1) } }).then(r => r.arrayBuffer()).catch(() => {});
+}
+function videoUrlAt(camId, seg, t){ return videoUrl(camId, seg.file) + '&t=' + Math.floor(t); }
+function cutClockOk(v, seg){ return isFinite(v.duration) && Math.abs(v.duration - (seg.end - seg.start) / 1000) <= 1.5; }
+function cutActive(v){ return !!v._cutAt && v.src === v._cutSrc; }   // still on a cut stream: it has no data before _cutAt, so seeking there needs the whole file
+// Day stream: the server joins a day's finished clips into ONE continuous fMP4 (/video/day; /api/daymap says where each clip starts in it), so the single view plays across clip boundaries — and seeks between clips of the day — without reloading the <video>.
+let dayMap = null;               // {url, list: [[file, startSec, durSec]], index: {file: i}} of the current camera/day, or null (per-clip playback)
+const DAYMAP_RETRY_MS = 5000;    // the server is still indexing the day ("pending") → ask again this much later
+function dayOf(s){ return (dayMap && !s.live && dayMap.index[s.file] != null) ? dayMap : null; }   // the day stream holding clip s, if any
+function dayAt(m, t){ let lo = 0, hi = m.list.length - 1; while(lo < hi){ const mid = (lo + hi + 1) >> 1; if(m.list[mid][1] <= t) lo = mid; else hi = mid - 1; } return lo; }   // map entry playing at stream second t
+function onDay(){ return !!vid._day && vid.src === vid._daySrc; }   // the single <video> is on a day stream
+async function loadDayMap(d){
+  const c = cam;
+  let m;
+  try{ m = await api('/api/daymap?cam=' + encodeURIComponent(c) + '&date=' + d); }catch(_){ return; }
+  if(c !== cam || d !== dateStr || pbGrid) return;                  // camera/day changed meanwhile
+  if(m.url && m.segments.length > 1){
+    const index = {}; m.segments.forEach((x, i) => { index[x[0]] = i; });
+    dayMap = { url: m.url, list: m.segments, index };
+  }
+  if(m.pending) setTimeout(() => { if(c === cam && d === dateStr) loadDayMap(d); }, DAYMAP_RETRY_MS);
+}
+// Hover thumbnails: /api/thumbs describes one sprite sheet per camera-day (24 rows of 3600/every tiles, built in the background with ffmpeg on the server), so hovering/dragging the timeline shows what was recorded there above the time bubble — no clip has to load. No sheet (yet, or no ffmpeg) → just the bubble.
+let thumbs = null;               // {cam, date, every, w, h, cols, url, have: Uint8Array(slot → tile filled)} or null
+let thumbsGen = 0;
+const THUMBS_RETRY_MS = 10000, THUMBS_RETRIES = 30;   // the server is still extracting ("pending") → ask again, a bounded number of times
+function thumbCam(){ if(!pbGrid) return cam; const c = pbCams().find(x => x.key === pbMaster); return c ? c.id : null; }   // the timeline shows the master's clips in a split
+async function loadThumbs(d, tries){
+  const c = thumbCam(), gen = tries ? thumbsGen : ++thumbsGen;
+  if(!tries && !(thumbs && thumbs.cam === c && thumbs.date === d)) thumbs = null;
+  if(!c || !d) return;
+  let m;
+  try{ m = await api('/api/thumbs?cam=' + encodeURIComponent(c) + '&date=' + d); }catch(_){ return; }
+  if(gen !== thumbsGen || c !== thumbCam() || d !== dateStr || !m.enabled) return;   // camera/day changed meanwhile
+  if(m.url && !(thumbs && thumbs.url === m.url)){
+    const have = new Uint8Array(86400 / m.every); m.slots.forEach(([a, b]) => have.fill(1, a, b));
+    new Image().src = m.url;       // fetch the sheet now, so the first hover already has it
+    thumbs = { cam: c, date: d, every: m.every, w: m.w, h: m.h, cols: m.cols, url: m.url, have };
+  }
+  if(m.pending && (tries || 0) < THUMBS_RETRIES) setTimeout(() => { if(gen === thumbsGen) loadThumbs(d, (tries || 0) + 1); }, THUMBS_RETRY_MS);
+}
+function showThumb(sec, x, top){   // the tile of second `sec` of the day, centered at x, bottom edge just above `top`
+  const el = $('thumb'), t = thumbs, k = t ? Math.floor(sec / t.every) : -1;
+  if(!t || t.cam !== thumbCam() || t.date !== dateStr || !t.have[k]){ el.style.display = 'none'; return; }
+  el.style.width = t.w + 'px'; el.style.height = t.h + 'px';
+  el.style.backgroundImage = 'url("' + t.url + '")';
+  el.style.backgroundPosition = (-(k % t.cols) * t.w) + 'px ' + (-Math.floor(k / t.cols) * t.h) + 'px';
+  el.style.left = x + 'px'; el.style.top = (top - t.h - 6) + 'px'; el.style.display = 'block';
+}
 function hms(sec){
   sec = Math.max(0, Math.floor(sec));
   return pad(Math.floor(sec/3600)) + ':' + pad(Math.floor(sec/60)%60) + ':' + pad(sec%60);
@@ -904,6 +4408,7 @@ async function init(){
     $('empty').textContent = 'No XiaomiCamera_* directory found under the root (check the mount points / startup arguments)';
     return;
   }
+  openFeed();
   if(START_LIVE && liveAvailable()){
     applyMode('live', START_SPLIT);   // open straight into the default live view (single or split)
     livePreload = true;   // protect the live/grid view from the background preload's loadSegment (teardown + autoplay)
@@ -970,6 +4475,8 @@ async function selectDay(d, targetSec, play){
   dateStr = d;
   dayStart = new Date(d + 'T00:00:00');
   const dsel = $('dates'); if(dsel && dsel.value !== d) dsel.value = d;   // reflect the current day in the dropdown (e.g. on Back-to-latest / camera switch)
+  dayMap = null;
+  loadThumbs(d);
   if(pbGrid){                          // playback split: changing day → re-pull all streams, whole screen jumps to the target moment
     await pbFetchDay(d);
     segs = pbSegs[pbMaster] || []; curIdx = -1; renderTrack();
@@ -987,6 +4494,7 @@ async function selectDay(d, targetSec, play){
   });
   curIdx = -1;
   renderTrack();
+  if(segs.length > 1) loadDayMap(d);   // not awaited: until it arrives, clips play one by one
   $('empty').style.display = segs.length ? 'none' : '';
   if(!segs.length) $('empty').textContent = 'No recordings on this day';   // selected a date with no recordings
   if(segs.length){
@@ -1049,28 +4557,38 @@ function bestSegForSec(sec){
 
 // ---- Load and locate a segment ----
 let _lsGen = 0;   // supersede token: a newer loadSegment cancels the previous seek-retry poll (single <vid> is reused, so a stale poll/onMeta must not seek the new file)
+let _lsDone = true;   // the last loadSegment has landed (until then a day stream's position is not trusted to say which clip is playing)
 function loadSegment(idx, offsetSec, autoplay){
   if(idx < 0 || idx >= segs.length) return;
   if(gridMode && !livePreload) setGrid(false);   // any playback action exits the live split (but the startup background preload must leave the grid intact)
-  curIdx = idx; const s = segs[idx];
+  curIdx = idx; const s = segs[idx]; vid._cutAt = 0;
   $('liveTag').style.display = s.live ? 'block' : 'none';
   const gen = ++_lsGen, target = Math.max(0, offsetSec);
+  const dm = dayOf(s), base = dm ? dm.list[dm.index[s.file]][1] : 0;   // on the day stream the clip starts `base` seconds in
   const wantPlay = autoplay && !liveMode && !gridMode && !pbGrid;   // under live/split, do not let the background hidden single-stream recording autoplay
-  let tries = 0, done = false;
-  const seekNow = () => { if(vid.readyState >= 1){ try{ vid.currentTime = target; }catch(e){} } };   // a seek only takes effect once metadata is parsed
-  const onMeta = () => { vid.removeEventListener('loadedmetadata', onMeta); if(gen === _lsGen) seekNow(); };   // metadata arrived → seek at once (don't wait for the next 600ms tick); self-removes so a superseded load can't re-seek the new file
-  const finish = () => { if(done) return; done = true; if(wantPlay) vid.play().catch(()=>{}); updateHead(); };
+  let tries = 0, done = false, cut = !dm && !s.live && target >= CUT_MIN_SEC;   // cut = stream starts at the target's keyframe (see videoUrlAt)
+  _lsDone = false;
+  const seekNow = () => { if(vid.readyState >= 1){ try{ vid.currentTime = base + target; }catch(e){} } };   // a seek only takes effect once metadata is parsed
+  const onMeta = () => { vid.removeEventListener('loadedmetadata', onMeta); if(gen !== _lsGen) return;   // metadata arrived → seek at once (don't wait for the next 600ms tick); self-removes so a superseded load can't re-seek the new file
+    if(cut && !cutClockOk(vid, s)){ cut = false; vid.addEventListener('loadedmetadata', onMeta); vid.src = videoUrl(cam, s.file); vid.load(); return; }   // browser re-based the cut stream's clock → whole file instead
+    seekNow(); };
+  const finish = () => { if(done) return; done = true; if(gen === _lsGen) _lsDone = true; if(cut){ vid._cutAt = Math.floor(target); vid._cutSrc = vid.src; } if(wantPlay) vid.play().catch(()=>{}); updateHead(); };   // the cut guard arms only once landed (the browser's own start-up positioning must not trip it)
   // POLL-RETRY until the seek actually LANDS, then play. A cold fMP4 (moov duration=0) CLAMPS the first seek to the clip END until the file warms — re-seek every 600ms until it sticks (same as the split path gridSeekAll; single-view was MISSING this, so "picked 21:43 stuck at 21:50" = seek clamped to the segment end, never corrected). Repeated paused re-seeks + preload warm the fMP4 so it lands; play only after it lands.
   const trySeek = () => {
     if(done || gen !== _lsGen || curIdx !== idx) return;                                        // superseded by a newer load
-    if(vid.readyState >= 1 && Math.abs(vid.currentTime - target) <= 1.5){ finish(); return; }   // LANDED on target
+    if(vid.readyState >= 1 && Math.abs(vid.currentTime - base - target) <= 1.5){ finish(); return; }   // LANDED on target
     if(tries++ >= 100){ seekNow(); finish(); return; }                                          // ~60s upper bound; release (play from wherever) rather than hang on a broken clip
     seekNow();
     setTimeout(trySeek, 600);
   };
-  vid.addEventListener('loadedmetadata', onMeta);
-  vid.src = '/video?cam=' + encodeURIComponent(cam) + '&file=' + encodeURIComponent(s.file);
-  vid.load();
+  const same = dm && onDay() && vid._day.url === dm.url;   // already on this day stream → just seek, no reload
+  vid._day = dm;
+  if(!same){
+    vid.addEventListener('loadedmetadata', onMeta);
+    vid.src = dm ? dm.url : cut ? videoUrlAt(cam, s, target) : videoUrl(cam, s.file);
+    vid.load();
+    vid._daySrc = vid.src;
+  }
   trySeek();
   livePreload = false;   // one-shot: only the very first startup preload is protected; later timeline clicks tear down the grid as usual
 }
@@ -1108,8 +4626,9 @@ function showTip(e){              // a time bubble that follows the cursor; fixe
   tip.style.top  = (rect.top - 30) + 'px';
   tip.textContent = (dateStr ? dateStr + ' ' : '') + hms(sec);
   tip.style.display = 'block';
+  showThumb(sec, e.clientX, rect.top - 30);
 }
-function hideTip(){ $('tip').style.display = 'none'; }
+function hideTip(){ $('tip').style.display = 'none'; $('thumb').style.display = 'none'; }
 function dragShow(sec, e){ moveHead(sec); showTip(e); dragShownSec = sec; }   // move the playhead/time and remember where it is (so a dwell-lock can freeze on it)
 function armDwell(){ clearTimeout(dwellTimer); dragLocked = false; dwellTimer = setTimeout(() => { dragLocked = true; dragLockedSec = dragShownSec; }, DWELL_MS); }   // (re)start the hold timer; firing it = the finger held still → lock the selection
 function seekTo(sec){
@@ -1137,7 +4656,7 @@ track.addEventListener('pointermove', e => {
     cancelDrag = true;
     const w = currentWall(); if(w && w.sec != null && isFinite(w.sec)) moveHead(w.sec);
     const tip = $('tip'); tip.style.left = e.clientX + 'px'; tip.style.top = (rect.top - 30) + 'px';
-    tip.textContent = 'Release to cancel'; tip.style.display = 'block';
+    tip.textContent = 'Release to cancel'; tip.style.display = 'block'; $('thumb').style.display = 'none';
     return;
   }
   cancelDrag = false;
@@ -1185,15 +4704,31 @@ document.addEventListener('keydown', e => { if(e.key === 'Escape' && dragging){
 function updateHead(){
   if(dragging) return;
   if(pbGrid){ const v = pbVids[pbMaster]; if(v && v._seg) moveHead(v._seg.s0 + v.currentTime); return; }
-  if(curIdx < 0) return;
-  const s = segs[curIdx];
-  moveHead(s.s0 + vid.currentTime);
+  const [i, off] = vidPos();
+  if(i < 0) return;
+  if(i !== curIdx){                  // the day stream crossed into another clip
+    if(!_lsDone) return;
+    curIdx = i; $('liveTag').style.display = segs[i].live ? 'block' : 'none';
+  }
+  moveHead(segs[i].s0 + off);
+}
+function vidPos(){                   // single view: [index in segs, seconds into that clip] of what #vid shows
+  if(onDay()){
+    const m = vid._day, k = dayAt(m, vid.currentTime), i = segs.findIndex(x => x.file === m.list[k][0]);
+    if(i >= 0) return [i, vid.currentTime - m.list[k][1]];
+  }
+  return [curIdx, vid.currentTime];
 }
 vid.addEventListener('timeupdate', updateHead);
+vid.addEventListener('timeupdate', () => { if(!gridMode && !pbGrid && !onDay() && curIdx >= 0) primeAhead(vid, cam, segs[curIdx], segs[curIdx + 1]); });   // (a day stream crosses clips inside one stream)
+vid.addEventListener('seeking', () => {   // ±10s / native scrub back past the start of a cut stream → reload the whole clip there
+  if(cutActive(vid) && vid.currentTime < vid._cutAt && curIdx >= 0 && !gridMode && !pbGrid) loadSegment(curIdx, vid.currentTime, !vid.paused);
+});
 
 // ---- When one segment finishes, automatically continue to the next (continuous playback) ----
 vid.addEventListener('ended', () => {
   if(gridMode || pbGrid) return;   // in split mode, do not continue after the background single-stream recording ends (otherwise it would exit the split via loadSegment)
+  if(onDay()) loadDayMap(dateStr);   // end of the day stream: clips finished since it was mapped join the next one
   if(curIdx >= 0 && curIdx + 1 < segs.length){
     loadSegment(curIdx + 1, 0, true);
   }
@@ -1206,9 +4741,10 @@ function currentWall(){
     const v = pbVids[pbMaster];
     return { date: dateStr, sec: (v && v._seg) ? (v._seg.s0 + v.currentTime) : null, play: pbPlaying() };
   }
+  const [i, off] = vidPos();
   return {
     date: dateStr,
-    sec: (curIdx >= 0) ? (segs[curIdx].s0 + vid.currentTime) : null,
+    sec: (i >= 0) ? (segs[i].s0 + off) : null,
     play: !vid.paused,
   };
 }
@@ -1218,7 +4754,7 @@ $('camSel').onchange = e => {
   if(pbGrid){   // playback split: switch the reference (master clock) to the cell showing the selected camera (key by index, match by label)
     const lbl = liveLabel();
     const c = pbCams().find(c => c.label === lbl);
-    if(c){ pbMaster = c.key; segs = pbSegs[c.key] || []; curIdx = -1; pbMarkMaster(); renderTrack(); updateHead(); }
+    if(c){ pbMaster = c.key; segs = pbSegs[c.key] || []; curIdx = -1; pbMarkMaster(); renderTrack(); updateHead(); loadThumbs(dateStr); }
     return;
   }
   if(gridMode){ livePreload = true; loadTimeline(w); return; }   // live split: per-cell dropdowns own the cameras — only refresh the background timeline, do NOT let loadSegment tear the grid down
@@ -1448,6 +4984,7 @@ async function liveCoversRefresh(){   // in live the recorded-footage coverage i
     return;
   }
   if(nowRel < 0) return;   // timeline is on a future day (shouldn't happen in live) → leave it
+  if(feedUp()){ liveGrow(); return; }   // new/finalized clips are pushed (feedSegs): only the in-progress chunk's end has to follow "now"
   const day = dateStr, useCam = cam;
   _coversBusy = true;
   try{
@@ -1462,7 +4999,55 @@ async function liveCoversRefresh(){   // in live the recorded-footage coverage i
 }
 $('dpclock').textContent = dpClockText();
 setInterval(() => { const el = $('dpclock'); if(el) el.textContent = dpClockText(); liveHeadTick(); }, 1000);
-setInterval(liveCoversRefresh, 30000);   // coverage tracks "now" within ~30s; far lighter than the 1s playhead tick (one small cached JSON GET, only in live + today)
+setInterval(liveCoversRefresh, 30000);   // coverage tracks "now" within ~30s; far lighter than the 1s playhead tick (one small cached JSON GET, only in live + today — and only while the change feed is down)
+// ---- Index change feed: /api/events (Server-Sent Events) pushes new / finalized / removed clips and camera changes the moment the server's index sees them, so the timers above only poll /api/segments while the stream is down (EventSource reconnects by itself and the server replays what was missed) ----
+let feed = null;   // the EventSource, or null (no EventSource in this browser → the timers keep polling)
+function feedUp(){ return !!(feed && feed.readyState === 1); }   // 1 = OPEN
+function segRec(s){ const st = new Date(s.start), en = new Date(s.end);
+  return { file:s.file, live:s.live, start:st, end:en, s0:(st-dayStart)/1000, s1:(en-dayStart)/1000 }; }
+function segsWith(arr, type, e){   // a copy of one day's segment list with a pushed change applied; null = the change doesn't touch this day
+  const rest = arr.filter(s => s.file !== e.file && s.file !== e.was);   // finalized: the in-progress name (was) is replaced by the finished one
+  if(type !== 'removed'){ const s = segRec(e); if(s.s1 > 0 && s.s0 < DAY){ rest.push(s); rest.sort((a, b) => a.start - b.start); return rest; } }
+  return rest.length === arr.length ? null : rest;
+}
+function liveGrow(){   // the in-progress chunk's coverage follows "now" locally (no request)
+  const now = new Date(); let any = false;
+  segs.forEach(s => { if(s.live && now > s.end){ s.end = now; s.s1 = (now - dayStart)/1000; any = true; } });
+  if(any) renderTrack();
+}
+function feedSegs(type, e){
+  if(!dayStart) return;
+  if(pbGrid){
+    let hit = false;
+    pbCams().forEach(c => { if(c.id !== e.cam) return; const n = segsWith(pbSegs[c.key] || [], type, e); if(n){ pbSegs[c.key] = n; hit = true; } });
+    if(hit){ pbResumeParked(); segs = pbSegs[pbMaster] || []; renderTrack(); }
+    return;
+  }
+  if(e.cam !== cam) return;
+  if(dragging){ setTimeout(() => feedSegs(type, e), 1000); return; }   // don't swap the list under a drag (it snaps against it)
+  const n = segsWith(segs, type, e); if(!n) return;
+  const cur = segs[curIdx], f = cur && (cur.file === e.was ? e.file : cur.file);
+  segs = n; if(cur) curIdx = segs.findIndex(s => s.file === f);   // keep pointing at the playing clip (indices shift)
+  renderTrack();
+}
+async function feedReset(c){   // events were missed (or a camera just got its first listing): refetch the shown day — c = only if it shows that camera
+  if(!dayStart || !dateStr) return;
+  if(pbGrid){ if(!c || pbCams().some(x => x.id === c)) pbRefetchSegs(true); return; }
+  if(c && c !== cam) return;
+  const day = dateStr, useCam = cam;
+  let r; try{ r = await api('/api/segments?cam=' + encodeURIComponent(useCam) + '&date=' + day); }catch(_){ return; }
+  if(pbGrid || dateStr !== day || cam !== useCam) return;
+  const cur = segs[curIdx];
+  segs = (r.segments || []).map(segRec); if(cur) curIdx = segs.findIndex(s => s.file === cur.file);
+  renderTrack();
+}
+function openFeed(){
+  if(!window.EventSource) return;
+  feed = new EventSource('/api/events');
+  ['segment', 'finalized', 'removed'].forEach(t => feed.addEventListener(t, ev => feedSegs(t, JSON.parse(ev.data))));
+  feed.addEventListener('reset', ev => feedReset(JSON.parse(ev.data).cam));
+  feed.addEventListener('camera', () => { reloadCameras().catch(() => {}); });   // a camera appeared / went away: refresh the picker
+}
 // ---- Split view: watch all cameras' live pictures at once ----
 function liveGridLabels(){ return cellCams.slice(0, splitN); }   // cameras per cell (determined by cellCams)
 // Stick "● Live · protocol" in the top-right corner of the live component, the protocol read from the component's actual state:
@@ -1528,7 +5113,7 @@ async function clipInfoBox(camId, seg){
   const ft  = d => (d instanceof Date && !isNaN(d)) ? p2(d.getHours()) + ':' + p2(d.getMinutes()) + ':' + p2(d.getSeconds()) : '';
   const span = fdt(seg.start) + ' → ' + ft(seg.end);
   const smb = 'smb://' + info.smb_host + '/' + info.share + '/' + (info.subdir ? info.subdir + '/' : '') + info.file;
-  const vurl = 'http://' + location.host + '/video?cam=' + encodeURIComponent(camId) + '&file=' + encodeURIComponent(info.file);
+  const vurl = 'http://' + location.host + '/video?cam=' + encodeURIComponent(camId) + '&file=' + encodeURIComponent(info.file);   // the file as-is (curl/mpv)
   const curl = "curl -o " + info.file + " '" + vurl + "'";
   const scp = "scp -O -P 8822 root@" + location.hostname + ":'" + info.path + "' ~/Downloads/";
   const mpv = "mpv '" + vurl + "'";
@@ -1719,29 +5304,44 @@ function pbCamId(lbl){ const o = [...$('camSel').options].find(o => o.dataset.lb
 // One {key=cell index, label, id} per cell. Keyed by index → supports any per-cell camera, duplicates, reserved (no id)
 function pbCams(){ return cellCams.slice(0, splitN).map((lbl, i) => ({ key: String(i), label: lbl, id: pbCamId(lbl) })); }
 
-async function pbFetchDay(date){      // concurrently pull each cell's segments for the day (cells without an id = empty). Build into a temp then swap atomically so the 500ms maintenance loop never reads a half-empty pbSegs (matters for the periodic refetch below).
+async function pbFetchDay(date){      // pull every cell's segments for the day in ONE batched request (cam=a,b,c; cells without an id = empty). Build into a temp then swap atomically so the 500ms maintenance loop never reads a half-empty pbSegs (matters for the periodic refetch below).
   const cams = pbCams(), next = {};
-  await Promise.all(cams.map(async c => {
+  const ids = [...new Set(cams.filter(c => c.id).map(c => c.id))];
+  let per = null;
+  if(ids.length){
+    try{ const r = await api('/api/segments?cam=' + ids.map(encodeURIComponent).join(',') + '&date=' + date);
+      per = ids.length > 1 ? r.cams : { [ids[0]]: r }; }catch(_){}   // a single camera answers in the plain one-camera shape
+  }
+  cams.forEach(c => {
     if(!c.id){ next[c.key] = []; return; }
-    try{ const r = await api('/api/segments?cam=' + encodeURIComponent(c.id) + '&date=' + date);
-      next[c.key] = (r.segments || []).map(s => { const st = new Date(s.start), en = new Date(s.end);
-        return { file:s.file, live:s.live, start:st, end:en, s0:(st-dayStart)/1000, s1:(en-dayStart)/1000 }; });
-    }catch(_){ next[c.key] = pbSegs[c.key] || []; }
-  }));
+    const r = per && per[c.id];
+    if(!r){ next[c.key] = pbSegs[c.key] || []; return; }   // request failed / camera unknown: keep what the cell had
+    next[c.key] = (r.segments || []).map(s => { const st = new Date(s.start), en = new Date(s.end);
+      return { file:s.file, live:s.live, start:st, end:en, s0:(st-dayStart)/1000, s1:(en-dayStart)/1000 }; });
+  });
   pbSegs = next;
 }
-async function pbRefetchSegs(){       // periodic rescan while in playback split: picks up a freshly-FINALIZED clip (live → completed) so cells PARKED on an in-progress recording auto-resume.
+async function pbRefetchSegs(force){  // periodic rescan while in playback split: picks up a freshly-FINALIZED clip (live → completed) so cells PARKED on an in-progress recording auto-resume. force = the change feed asked for it (reset).
   if(!pbGrid) return;
-  if(!pbCams().some(c => { const v = pbVids[c.key]; return v && (v._gapHold || !v._seg); })) return;   // ONLY rescan when a cell is actually waiting on a clip to finalize. Otherwise skip: each rescan = 5 camera-dir scans (2 over remote CIFS) on the weak router, which competes with the 4K /video streaming and stalls cold-loads (playback "stuck loading"). No one waiting → nothing to pick up → don't hammer the server.
+  if(!force && feedUp()) return;        // the feed pushes finalized clips straight into pbSegs (feedSegs): nothing to poll
+  if(!force && !pbCams().some(c => { const v = pbVids[c.key]; return v && (v._gapHold || !v._seg); })) return;   // ONLY rescan when a cell is actually waiting on a clip to finalize. Otherwise skip: each rescan = 5 camera-dir scans (2 over remote CIFS) on the weak router, which competes with the 4K /video streaming and stalls cold-loads (playback "stuck loading"). No one waiting → nothing to pick up → don't hammer the server.
   const gen = pbGridGen;
   await pbFetchDay(dateStr);
   if(gen !== pbGridGen || !pbGrid) return;
+  pbResumeParked();
+  segs = pbSegs[pbMaster] || []; renderTrack();
+}
+function pbResumeParked(){
   const w = currentWall();
   if(w && w.sec != null && isFinite(w.sec)) pbCams().forEach(c => { const v = pbVids[c.key]; if(v && !v._seg && pbCovers(c.key, w.sec)) pbLoadCell(c.key, w.sec, pbPlaying()); });   // a cell parked with no usable clip (all-live edge) can now play a freshly-finalized completed clip
-  segs = pbSegs[pbMaster] || []; renderTrack();
 }
 
-function pbSeek(v, t){ v._progT = Date.now(); try{ v.currentTime = Math.max(0, t); }catch(_){} }   // programmatic positioning: record the timestamp; distinguish user drags from seeking via a time window (one seek may fire seeking multiple times)
+function pbSeek(v, t){ v._progT = Date.now();
+  if(cutActive(v) && t < v._cutAt && v._seg){   // before the start of a cut stream → reload the whole clip, then position
+    const at = Math.max(0, t), play = !v.paused, m = () => { v.removeEventListener('loadedmetadata', m); pbSeek(v, at); if(play) v.play().catch(()=>{}); };
+    v._cutAt = 0; v.addEventListener('loadedmetadata', m); v.src = videoUrl(v._id, v._seg.file); v.load(); return;
+  }
+  try{ v.currentTime = Math.max(0, t); }catch(_){} }   // programmatic positioning: record the timestamp; distinguish user drags from seeking via a time window (one seek may fire seeking multiple times)
 
 function pbBest(key, sec){            // the COMPLETED segment of this cell closest to sec (seconds of the day). Live (in-progress) clips are skipped: their fMP4 has no finalized moov/index → can't seek to a target moment → endless "Loading…". They become seekable once the camera finalizes the clip (the periodic refetch picks it up).
   const arr = pbSegs[key] || [];
@@ -1775,12 +5375,14 @@ function pbLoadCell(key, sec, autoplay){
   const b = pbBest(key, sec);
   if(!b){ v.removeAttribute('src'); v.load(); v._seg=null; v._idx=-1; v._gapHold=true; showCellMsg(v.parentElement, pbHoldMsg(key, sec)); return; }   // no COMPLETED clip at this moment (real gap, or only an in-progress recording) → park + hold (the refetch resumes it once a clip finalizes)
   showCellMsg(v.parentElement, '');
-  v._idx = b.idx; v._seg = arr[b.idx]; v._settling = true;   // being positioned → watchdog/maintenance leave it alone until it lands
+  v._idx = b.idx; v._seg = arr[b.idx]; v._settling = true; v._cutAt = 0;   // being positioned → watchdog/maintenance leave it alone until it lands
   const seg = arr[b.idx];
-  let tries = 0, done = false;
+  let tries = 0, done = false, cut = b.offset >= CUT_MIN_SEC;   // cut = stream starts at the target's keyframe (see videoUrlAt; pbBest only returns finished clips)
   const seekNow = () => { if(v.readyState >= 1) pbSeek(v, b.offset); };
-  const onMeta = () => { v.removeEventListener('loadedmetadata', onMeta); seekNow(); };
-  const finish = () => { if(done) return; done = true; v._settling = false; if(autoplay) v.play().catch(()=>{}); };
+  const onMeta = () => { v.removeEventListener('loadedmetadata', onMeta);
+    if(cut && v._seg === seg && !cutClockOk(v, seg)){ cut = false; v.addEventListener('loadedmetadata', onMeta); v.src = videoUrl(v._id, seg.file); v.load(); return; }   // clock re-based → whole file instead
+    seekNow(); };
+  const finish = () => { if(done) return; done = true; v._settling = false; if(cut && v._seg === seg){ v._cutAt = Math.floor(b.offset); v._cutSrc = v.src; } if(autoplay) v.play().catch(()=>{}); };
   const trySeek = () => {   // POLL-RETRY until the seek LANDS (same as gridSeekAll). A cold fMP4 (moov duration=0) clamps the first seek to the clip END; the old 3-try re-assert wasn't enough for a cold 4K MASTER — which the maintenance loop can't correct (it skips the master) → the reload/reassign could stick at the clip end.
     if(done) return;
     if(pbVids[key] !== v || v._seg !== seg){ v._settling = false; done = true; return; }   // torn down / reassigned under us
@@ -1790,7 +5392,7 @@ function pbLoadCell(key, sec, autoplay){
     setTimeout(trySeek, 600);
   };
   v.addEventListener('loadedmetadata', onMeta);
-  v.src = '/video?cam=' + encodeURIComponent(v._id) + '&file=' + encodeURIComponent(arr[b.idx].file);
+  v.src = cut ? videoUrlAt(v._id, seg, b.offset) : videoUrl(v._id, seg.file);
   v.load();
   trySeek();
 }
@@ -1823,7 +5425,7 @@ function gridSeekAll(sec, play){
       seekNow();
       setTimeout(trySeek, 600);
     };
-    if(!sameLoaded){ v.src = '/video?cam=' + encodeURIComponent(v._id) + '&file=' + encodeURIComponent(arr[b.idx].file); v.addEventListener('loadedmetadata', onMeta); v.load(); }
+    if(!sameLoaded){ v.src = videoUrl(v._id, arr[b.idx].file); v.addEventListener('loadedmetadata', onMeta); v.load(); }
     trySeek();
   });
   if(pending === 0) updateHead();      // nothing playable
@@ -2034,7 +5636,7 @@ async function pbOcrSync(){   // returns true if all cells were verified & align
       seekNow();
       setTimeout(poll, 600);
     };
-    if(reload){ v.src = '/video?cam=' + encodeURIComponent(v._id) + '&file=' + encodeURIComponent(arr[v._idx].file); v.addEventListener('loadedmetadata', onMeta); v.load(); }
+    if(reload){ v.src = videoUrl(v._id, arr[v._idx].file); v.addEventListener('loadedmetadata', onMeta); v.load(); }
     poll();
     return sameClip;
   };
@@ -2079,7 +5681,7 @@ function pbAlignCoarse(){      // fallback: align by assumed time (master._seg.s
       pbSeek(v, b.offset);                                          // same segment loaded: cheap seek (pbSeek records _progT so the 'seeking' event isn't misread as a user drag → _manual would wrongly flip and disable maintenance)
     } else {
       v._idx = b.idx; v._seg = arr[b.idx];                          // cross-segment/not loaded: reload into place (no play)
-      v.src = '/video?cam=' + encodeURIComponent(v._id) + '&file=' + encodeURIComponent(arr[b.idx].file);
+      v.src = videoUrl(v._id, arr[b.idx].file);
       const om = () => { v.removeEventListener('loadedmetadata', om); pbSeek(v, b.offset); };
       v.addEventListener('loadedmetadata', om); v.load();
     }
@@ -2113,7 +5715,7 @@ function pbEnterSeg(v, file, seekTo, play, rate){   // load a freshly-crossed cl
   const pl = () => clear();
   v.addEventListener('loadedmetadata', om); v.addEventListener('playing', pl);
   const st = setTimeout(() => { v._settling = false; }, 12000);   // safety: never strand the cell if 'playing' never fires (broken source) — hand back to the watchdog
-  v.src = '/video?cam=' + encodeURIComponent(v._id) + '&file=' + encodeURIComponent(file);
+  v.src = videoUrl(v._id, file);
   v.load();
 }
 function pbWatchCell(v, key){   // black/stall self-heal: a cell that errored or has no advancing frame for ~3s is auto-reloaded (capped, so a genuinely missing file isn't reloaded forever)
@@ -2273,7 +5875,7 @@ function pbReassign(idx, newLabel){   // change a cell's camera (playback): re-p
         return { file:s.file, live:s.live, start:st, end:en, s0:(st-dayStart)/1000, s1:(en-dayStart)/1000 }; }); }
     else pbSegs[key] = [];
     const w = currentWall(); pbLoadCell(key, (w && w.sec != null && isFinite(w.sec)) ? w.sec : 0, pbPlaying());
-    if(key === pbMaster){ segs = pbSegs[key] || []; curIdx = -1; renderTrack(); }   // reference cell changed camera → the timeline changes with it
+    if(key === pbMaster){ segs = pbSegs[key] || []; curIdx = -1; renderTrack(); loadThumbs(dateStr); }   // reference cell changed camera → the timeline changes with it
   })();
 }
 
@@ -2311,11 +5913,12 @@ async function setPbGrid(on){
       // No 'seeking' handler is needed. Dragging the REFERENCE within its current clip does NOT invalidate any OCR offset (the currentTime↔real-time mapping is constant within a file), so the maintenance keeps every non-master cell PRECISELY aligned to the reference's new moment using their intact offsets. (Clearing offsets here used to dump Precise back to coarse on every reference drag = the cells "going out of alignment".) A genuine clip change is handled where it actually happens: gridSeekAll (timeline jump) and the maintenance cross both reset/re-OCR the offset.
       pbVids[c.key] = v;
       v.addEventListener('timeupdate', updateHead);          // the reference cell drives the playhead (decided inside updateHead)
+      v.addEventListener('timeupdate', () => { const ni = pbNextDone(c.key, v._idx); if(ni >= 0) primeAhead(v, v._id, v._seg, (pbSegs[c.key] || [])[ni]); });   // warm the clip `advance` will load
       const advance = () => {                                // continue to this cell's next COMPLETED segment (skip a live/in-progress clip — not yet seekable)
         const arr = pbSegs[c.key] || []; const ni = pbNextDone(c.key, v._idx);
         if(ni < 0) return false;
         v._idx = ni; v._seg = arr[ni]; v._ocrOff = null; if(pbSyncMode === 'precise') v._recalPending = true;   // new file → offset invalid; in precise mode mark for a one-shot OCR re-calibration so ±1s is restored automatically
-        v.src = '/video?cam=' + encodeURIComponent(v._id) + '&file=' + encodeURIComponent(arr[ni].file);
+        v.src = videoUrl(v._id, arr[ni].file);
         const om = () => { v.removeEventListener('loadedmetadata', om); v.play().catch(()=>{}); };
         v.addEventListener('loadedmetadata', om); v.load(); return true;
       };
@@ -2400,23 +6003,89 @@ init();
 """
 
 
+# --------------------------------------------------------------------------- #
+# Page delivery. HTML_PAGE is split once into the page plus its stylesheet and script as
+# content-hashed /static/ files (immutable: a new build is a new name), each pre-encoded as
+# identity / gzip / brotli (where available); the page itself revalidates by ETag.
+# --------------------------------------------------------------------------- #
+_PAGE = None
+_page_lock = threading.Lock()
+
+
+def _encoded(ctype, body, cache):
+    """(ctype, {coding: bytes}, etag, cache_control) of one static response; the ETag is the
+    identity body's (see Handler._send_encoded for the others')."""
+    variants = {"identity": body}
+    if zlib is not None:
+        z = zlib.compressobj(9, zlib.DEFLATED, 31)        # wbits 31 = a gzip stream
+        variants["gzip"] = z.compress(body) + z.flush()
+    if brotli is not None:
+        variants["br"] = brotli.compress(body, quality=11)
+    return ctype, variants, '"%08x-%x"' % (binascii.crc32(body), len(body)), cache
+
+
+def _pick_encoding(header, sizes):
+    """The smallest of the codings in `sizes` ({coding: bytes}) the Accept-Encoding header allows
+    (identity if none). An explicit q=0 refuses a coding even when "*" would allow it."""
+    ok, no = set(), set()
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        refused = q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000")
+        (no if refused else ok).add(name.strip().lower())
+    have = [c for c in sizes if c not in no and (c in ok or ("*" in ok and c != "identity"))]
+    return min(have, key=sizes.get) if have else "identity"
+
+
+def page_assets():
+    """{url path: _encoded(...)} for "/" and its /static/ parts, built on first use (main() does it
+    up front, so no request pays for the compression)."""
+    global _PAGE
+    with _page_lock:
+        if _PAGE is None:
+            html, out = HTML_PAGE, {}
+            for tag, ext, ctype, ref in (
+                    ("style", "css", "text/css; charset=utf-8", '<link rel="stylesheet" href="%s">'),
+                    ("script", "js", "text/javascript; charset=utf-8", '<script src="%s"></script>')):
+                a = html.index("<%s>" % tag)
+                b = html.index("</%s>" % tag, a)
+                body = html[a + len(tag) + 2:b].encode("utf-8")
+                path = "/static/app.%08x.%s" % (binascii.crc32(body), ext)
+                out[path] = _encoded(ctype, body, "max-age=%d, immutable" % STATIC_MAX_AGE)
+                html = html[:a] + ref % path + html[b + len(tag) + 3:]
+            out["/"] = _encoded("text/html; charset=utf-8", html.encode("utf-8"), "no-cache")
+            _PAGE = out
+        return _PAGE
+
+
 # --------------------------------------------------------------------------- #
 def parse_args(argv):
-    """A trailing all-digit argument is treated as the port; the rest as root directories."""
-    roots, port = [], DEFAULT_PORT
+    """A trailing all-digit argument is treated as the port, --async picks the asyncio engine,
+    --global-rate=MBIT the cap on all video bodies (returned in bytes/s; 0 = none); the rest are
+    root directories."""
+    roots, port, use_async, rate = [], DEFAULT_PORT, False, GLOBAL_RATE
     for a in argv:
-        if a.isdigit():
+        if a == "--async":
+            use_async = True
+        elif a.startswith("--global-rate="):
+            try:
+                rate = int(float(a.partition("=")[2]) * 1e6 / 8)
+            except ValueError:
+                sys.exit("--global-rate takes Mbit/s, e.g. --global-rate=90")
+        elif a.isdigit():
             port = int(a)
         else:
             roots.append(a)
     if not roots:
         roots = list(DEFAULT_ROOTS)
-    return roots, port
+    return roots, port, use_async, max(0, rate)
 
 
 def main():
-    global ROOTS, PORT
-    ROOTS, PORT = parse_args(sys.argv[1:])
+    global ROOTS, PORT, GLOBAL_RATE
+    ROOTS, PORT, use_async, GLOBAL_RATE = parse_args(sys.argv[1:])
+    if use_async and asyncio is None:
+        sys.exit("--async needs the asyncio module (OpenWrt: opkg install python3-asyncio)")
 
     cams = list_cameras()
     print("=" * 60)
@@ -2429,9 +6098,22 @@ def main():
     else:
         print(" Warning: no XiaomiCamera_* directory found; check that the roots / mount points are correct.")
     print(" Open in browser: http://<local IP>:%d/   (or http://127.0.0.1:%d/)" % (PORT, PORT))
+    print(" Engine  :", "asyncio" if use_async else "threads")
+    print(" Rate cap:", "%g Mbit/s, all video together" % (GLOBAL_RATE * 8 / 1e6) if GLOBAL_RATE else "none")
+    print(" Thumbs  :", "%s -> %s" % (FFMPEG, THUMB_DIR) if FFMPEG else "off (no ffmpeg on PATH)")
     print(" Press Ctrl+C to stop")
     print("=" * 60)
 
+    watcher()   # index in the background from now on: request threads only read the live segment lists
+    page_assets()
+
+    if use_async:
+        try:
+            AsyncServer("0.0.0.0", PORT).serve_forever()
+        except KeyboardInterrupt:
+            print("\nStopped.")
+        return
+
     httpd = ThreadingHTTPServer(("0.0.0.0", PORT), Handler)
     try:
         httpd.serve_forever()